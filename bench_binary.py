@@ -0,0 +1,89 @@
+"""benchmark of the binary result format of exp_binary.py
+
+Simulates participants into a csv data file, converts it to a binary
+result file, and compares the time of a full scan counting the choices
+per condition and urn type, and of reading single participants:
+
+    python bench_binary.py --participants 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from exp_analysis import ChoiceRates, iter_rows
+from exp_binary import BinaryResults, convert_csv
+from exp_columnar import TrialStores
+from exp_recorder import Recorders
+from exp_setting import Settings
+from exp_simulation import ChoiceModels, Simulations
+
+
+def simulate_csv(csv_path, ppt_num, between):
+    """record simulated participants into a csv data file"""
+    setting = Settings()
+    setting.between = between
+    storage = TrialStores()
+    recorder = Recorders(setting, storage)
+    Simulations(setting, recorder, ChoiceModels()).run(ppt_num)
+    storage.to_csv(csv_path)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def csv_row(csv_path, k):
+    """read participant k of a csv data file by scanning to it"""
+    for i, (row, _) in enumerate(iter_rows(csv_path)):
+        if i == k:
+            return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--participants", type=int, default=100000)
+    parser.add_argument("--between", action="store_true")
+    parser.add_argument("--lookups", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "within_data.csv")
+        data_path = os.path.join(temp_dir, "within_data.bin")
+        simulate_csv(csv_path, args.participants, args.between)
+        count, elapsed = timed(lambda: convert_csv(csv_path, data_path))
+        print(f"converted {count} participants in {elapsed:.2f} s, "
+              f"csv {os.path.getsize(csv_path) / 1e6:.1f} MB, "
+              f"binary {os.path.getsize(data_path) / 1e6:.1f} MB")
+
+        def scan_csv():
+            rates = ChoiceRates(csv_path, os.path.join(temp_dir, "state"))
+            rates.update()
+            return {key[1:]: count for key, count in rates.counts.items()}
+
+        csv_counts, csv_time = timed(scan_csv)
+        results, open_time = timed(lambda: BinaryResults(data_path))
+        binary_counts, binary_time = timed(results.choice_counts)
+        if csv_counts != binary_counts:
+            raise SystemExit("FAIL: counts of the csv and binary files differ")
+        print(f"full scan: csv {csv_time * 1e3:.1f} ms, "
+              f"binary {binary_time * 1e3:.1f} ms "
+              f"(open {open_time * 1e3:.2f} ms), "
+              f"{csv_time / binary_time:.0f}x faster")
+
+        ks = [random.randrange(count) for _ in range(args.lookups)]
+        rows, binary_time = timed(lambda: [results.row(k) for k in ks])
+        k = ks[0]
+        _, csv_time = timed(lambda: csv_row(csv_path, k))
+        if list(csv_row(csv_path, k).values()) != rows[0]:
+            raise SystemExit("FAIL: rows of the csv and binary files differ")
+        print(f"participant k: csv scan {csv_time * 1e3:.2f} ms, "
+              f"binary {binary_time / len(ks) * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
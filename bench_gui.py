@@ -0,0 +1,421 @@
+"""benchmarks of the PyQt experiment window
+
+Runs offscreen, without a display:
+
+    python bench_gui.py startup --conditions 3 30 100
+    python bench_gui.py click --urns 2 20 200
+    python bench_gui.py ui
+    python bench_gui.py flow --conditions 3 30 --urns 2 20 --json flow.json
+
+The flow benchmark writes machine-readable results with --json, to
+compare runs for regressions. Every configuration of the flow benchmark
+runs in its own process, so its peak RSS is not the peak of the
+configurations before it.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtCore import QT_VERSION_STR
+from PyQt6.QtWidgets import QApplication, QMainWindow
+from PyQt6.uic import loadUi
+from exp_condition import Conditions
+from exp_image import image_cache
+from exp_latency import summarize_ms
+from exp_recorder import Recorders
+from exp_replay import wait_for_page
+from exp_storage import MemoryStorage
+from exp_sweep import SweepSettings
+from exp_uicache import load_ui
+from exp_urn import FixUrns, RandomUrns, draw_ball
+from exp_window import ExperimentWindow
+
+
+def make_setting(condition_num, urn_sizes_start=2):
+    """get within-subject settings with condition_num conditions
+
+    Args:
+        condition_num: amount of conditions, one urn size per condition
+        urn_sizes_start: size of the urns of the first condition
+
+    Returns:
+        a SweepSettings object, see exp_sweep.py
+    """
+    sizes = [urn_sizes_start * (i + 1) for i in range(condition_num)]
+    setting = SweepSettings(sizes, 2, False)
+    setting.data_path = os.path.join(tempfile.gettempdir(), "bench_gui.csv")
+    return setting
+
+
+def time_startup(condition_num, lazy):
+    """time building the trials and the experiment window
+
+    Args:
+        condition_num: amount of conditions
+        lazy: True to build the trial widgets on demand
+
+    Returns:
+        seconds from set_trials to a shown window
+    """
+    setting = make_setting(condition_num)
+    setting.lazy_trials = lazy
+    recorder = Recorders(setting, MemoryStorage())
+    image_cache.warm(setting)
+    start = time.perf_counter()
+    trials = setting.set_trials()
+    window = ExperimentWindow(trials, setting, recorder)
+    window.show()
+    QApplication.processEvents()
+    elapsed = time.perf_counter() - start
+    window.close()
+    window.deleteLater()
+    QApplication.processEvents()
+    return elapsed
+
+
+def bench_startup(args):
+    for condition_num in args.conditions:
+        eager = min(time_startup(condition_num, False)
+                    for _ in range(args.repeat))
+        lazy = min(time_startup(condition_num, True)
+                   for _ in range(args.repeat))
+        print(f"startup, {condition_num} conditions: "
+              f"eager {eager * 1000:.1f} ms, lazy {lazy * 1000:.1f} ms")
+
+
+def time_clicks(urn_num, clicks):
+    """time from clicking the last urn button to the start of the
+    animation, on a trial with urn_num urns
+
+    Args:
+        urn_num: amount of urns in the trial
+        clicks: amount of clicks timed
+
+    Returns:
+        latencies: seconds of each click
+        draw_seconds: seconds per draw_ball call alone
+    """
+    setting = make_setting(1)
+    setting.lazy_trials = False
+    urns = [FixUrns("urn_" + str(i), ["blue", "red"], [1, 1],
+                    setting.urn_path) for i in range(urn_num)]
+    setting.conditions = [Conditions("many_urns", urns)]
+    recorder = Recorders(setting, MemoryStorage())
+    image_cache.warm(setting)
+    trials = setting.set_trials()
+    window = ExperimentWindow(trials, setting, recorder)
+    window.show()
+    window.stackedWidget.setCurrentIndex(setting.pages_before_trials)
+    QApplication.processEvents()
+
+    button = trials[0].button_index[urns[-1].name]
+    window.connect_all_buttons()
+    latencies = []
+    for _ in range(clicks):
+        window.urn_chosen = False
+        start = time.perf_counter()
+        button.click()
+        latencies.append(time.perf_counter() - start)
+        # undo the click, so the next one starts from the same state
+        window.anim.finished.disconnect(window.finish_animation)
+        window.anim.stop()
+        window.ball.deleteLater()
+        recorder.ppt_data = recorder.ppt_data[:-len(recorder.trial_info)]
+
+    start = time.perf_counter()
+    for _ in range(clicks):
+        draw_ball(trials[0], urns[-1].name)
+    draw_seconds = (time.perf_counter() - start) / clicks
+
+    window.close()
+    window.deleteLater()
+    QApplication.processEvents()
+    return latencies, draw_seconds
+
+
+def bench_click(args):
+    for urn_num in args.urns:
+        latencies, draw_seconds = time_clicks(urn_num, args.clicks)
+        latencies.sort()
+        median = latencies[len(latencies) // 2]
+        worst = latencies[-1]
+        print(f"click, {urn_num} urns: median {median * 1e6:.0f} us, "
+              f"max {worst * 1e6:.0f} us, "
+              f"draw_ball {draw_seconds * 1e6:.2f} us")
+
+
+def time_ui(ui_path, loader):
+    """time setting up a main window from the ui file
+
+    Args:
+        ui_path: path of the ui file
+        loader: loadUi or load_ui
+
+    Returns:
+        seconds to set up the window
+    """
+    window = QMainWindow()
+    start = time.perf_counter()
+    loader(ui_path, window)
+    elapsed = time.perf_counter() - start
+    window.deleteLater()
+    QApplication.processEvents()
+    return elapsed
+
+
+def bench_ui(args):
+    cache_dir = os.path.join(os.path.dirname(args.ui_path), "__uicache__")
+    parse = min(time_ui(args.ui_path, loadUi) for _ in range(args.repeat))
+    cold = []
+    for _ in range(args.repeat):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cold.append(time_ui(args.ui_path, load_ui))
+    warm = min(time_ui(args.ui_path, load_ui) for _ in range(args.repeat))
+    print(f"ui, loadUi {parse * 1000:.1f} ms, "
+          f"compiled cold {min(cold) * 1000:.1f} ms, "
+          f"compiled warm {warm * 1000:.1f} ms")
+
+
+class FlowSettings(SweepSettings):
+    """class of settings of the flow benchmark, with urn_num urns in every
+    condition, random-mix and fix-mix in turn"""
+
+    def __init__(self, condition_num, urn_num):
+        self.urn_num = urn_num
+        sizes = [2 * (i + 1) for i in range(condition_num)]
+        super().__init__(sizes, 2, False)
+
+    def set_conditions(self):
+        conditions = []
+        for index, size in enumerate(self.sizes):
+            urns = []
+            for i in range(self.urn_num):
+                name = "urn_" + str(size) + "_" + str(i)
+                if i % 2:
+                    urns.append(FixUrns(name + "_equal", self.colors,
+                                        [size // 2, size // 2],
+                                        self.urn_path))
+                else:
+                    urns.append(RandomUrns(name + "_random", self.colors,
+                                           size, self.urn_path, self.rng))
+            self.arrange_urns(urns, index)
+            conditions.append(Conditions("size" + str(size), urns))
+        return conditions
+
+
+def peak_rss_mb():
+    """get the peak resident set size of this process so far, in MB, None
+    if unknown, see run_config"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if platform.system() == "Darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def run_flow(condition_num, urn_num, anim_ms, lazy, seed):
+    """drive one participant from the consent page to the final page
+
+    Args:
+        condition_num: amount of conditions
+        urn_num: amount of urns in every trial
+        anim_ms: duration of the ball animation
+        lazy: True to build the trial widgets on demand
+        seed: master seed of the session
+
+    Returns:
+        startup_ns: time from start_session to a shown window
+        transitions: times from a click on a page, or the end of the
+                     animation on a trial page, to the next page shown
+        clicks: times from the click on an urn to the start of the
+                animation
+    """
+    setting = FlowSettings(condition_num, urn_num)
+    setting.data_path = os.path.join(tempfile.gettempdir(), "bench_gui.csv")
+    setting.lazy_trials = lazy
+    setting.anim_duration = anim_ms
+    setting.seed = seed
+    recorder = Recorders(setting, MemoryStorage())
+    image_cache.warm(setting)
+
+    start = time.perf_counter_ns()
+    setting.start_session(recorder)
+    window = ExperimentWindow(setting.set_trials(), setting, recorder)
+    window.show()
+    QApplication.processEvents()
+    startup_ns = time.perf_counter_ns() - start
+
+    transitions = []
+    clicks = []
+    window.checkBox.setChecked(True)
+    window.age.setValue(setting.min_age)
+    window.gender.setCurrentIndex(1)
+    window.education.setCurrentIndex(1)
+    window.race.setCurrentIndex(1)
+    for button in [window.pushButton_1, window.pushButton_2,
+                   window.pushButton_3]:
+        index = window.stackedWidget.currentIndex()
+        start = time.perf_counter_ns()
+        button.click()
+        transitions.append(wait_for_page(window, index) - start)
+
+    for i in range(len(window.trials)):
+        index = window.stackedWidget.currentIndex()
+        trial = window.current_trial()
+        button = trial.button_index[trial.urns[i % len(trial.urns)].name]
+        start = time.perf_counter_ns()
+        button.click()
+        clicks.append(window.anim_start_ns - start)
+        shown = wait_for_page(window, index)
+        # the end of the animation was just recorded by finish_animation
+        transitions.append(shown - int(recorder.ppt_data[-1]))
+
+    if recorder.ppt_cmplt != 1:
+        raise RuntimeError("the flow did not reach the final page")
+    window.close()
+    window.deleteLater()
+    QApplication.processEvents()
+    return startup_ns, transitions, clicks
+
+
+def measure_flow(args, condition_num, urn_num):
+    """
+    Returns:
+        a dict, the results of one configuration of the flow benchmark
+    """
+    startups = []
+    transitions = []
+    clicks = []
+    for repeat in range(args.repeat):
+        startup_ns, page_ns, click_ns = run_flow(
+            condition_num, urn_num, args.anim_ms, not args.eager,
+            args.seed + repeat)
+        startups.append(startup_ns)
+        transitions += page_ns
+        clicks += click_ns
+    return {"conditions": condition_num,
+            "urns": urn_num,
+            "lazy_trials": not args.eager,
+            "repeat": args.repeat,
+            "startup": summarize_ms(startups),
+            "transition": summarize_ms(transitions),
+            "click_to_animation": summarize_ms(clicks),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def run_config(args, condition_num, urn_num):
+    """measure one configuration of the flow benchmark in a new process
+
+    The peak RSS of a process only grows, so the peak of a configuration
+    is only its own in a process of its own.
+
+    Returns:
+        a dict, see measure_flow
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_path = os.path.join(temp_dir, "flow.json")
+        command = [sys.executable, os.path.abspath(__file__), "flow",
+                   "--in-process",
+                   "--conditions", str(condition_num),
+                   "--urns", str(urn_num),
+                   "--repeat", str(args.repeat),
+                   "--anim-ms", str(args.anim_ms),
+                   "--seed", str(args.seed),
+                   "--json", json_path]
+        if args.eager:
+            command.append("--eager")
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(json_path, "r") as json_file:
+            return json.load(json_file)["results"][0]
+
+
+def bench_flow(args):
+    results = []
+    for condition_num in args.conditions:
+        for urn_num in args.urns:
+            if args.in_process:
+                result = measure_flow(args, condition_num, urn_num)
+            else:
+                result = run_config(args, condition_num, urn_num)
+            results.append(result)
+            print(f"flow, {condition_num} conditions, {urn_num} urns: "
+                  f"startup {result['startup']['p50_ms']:.1f} ms, "
+                  f"transition p50 {result['transition']['p50_ms']:.2f} ms "
+                  f"p99 {result['transition']['p99_ms']:.2f} ms, "
+                  f"click p50 {result['click_to_animation']['p50_ms']:.2f} "
+                  f"ms p99 {result['click_to_animation']['p99_ms']:.2f} ms, "
+                  f"peak RSS {result['peak_rss_mb'] or 0:.0f} MB")
+    if args.json:
+        report = {"python": platform.python_version(),
+                  "qt": QT_VERSION_STR,
+                  "platform": platform.platform(),
+                  "qpa": os.environ.get("QT_QPA_PLATFORM"),
+                  "anim_ms": args.anim_ms,
+                  "results": results}
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    startup = subparsers.add_parser(
+        "startup", help="time to build and show the window, with eager and "
+                        "lazy trial widgets")
+    startup.add_argument("--conditions", nargs="+", type=int,
+                         default=[3, 30, 100])
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.set_defaults(run=bench_startup)
+    click = subparsers.add_parser(
+        "click", help="click-to-draw latency with many urns in a trial")
+    click.add_argument("--urns", nargs="+", type=int, default=[2, 20, 200])
+    click.add_argument("--clicks", type=int, default=200)
+    click.set_defaults(run=bench_click)
+    ui = subparsers.add_parser(
+        "ui", help="time to set up the window by parsing the ui file and "
+                   "from the compiled module")
+    ui.add_argument("--ui-path", default="experiment.ui")
+    ui.add_argument("--repeat", type=int, default=10)
+    ui.set_defaults(run=bench_ui)
+    flow = subparsers.add_parser(
+        "flow", help="drive consent, demographics and every trial with "
+                     "synthetic clicks")
+    flow.add_argument("--conditions", nargs="+", type=int, default=[3, 30])
+    flow.add_argument("--urns", nargs="+", type=int, default=[2, 20])
+    flow.add_argument("--repeat", type=int, default=3)
+    flow.add_argument("--anim-ms", type=int, default=1,
+                      help="duration of the ball animation, see "
+                           "Settings.anim_duration")
+    flow.add_argument("--eager", action="store_true",
+                      help="build every trial widget at startup")
+    flow.add_argument("--seed", type=int, default=0)
+    flow.add_argument("--in-process", action="store_true",
+                      help="run every configuration in this process, the "
+                           "peak RSS then includes the ones before")
+    flow.add_argument("--json", default=None,
+                      help="path of the machine-readable results")
+    flow.set_defaults(run=bench_flow)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    args.run(args)
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
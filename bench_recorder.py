@@ -0,0 +1,125 @@
+"""stress test of concurrent recorders
+
+Spawns many writer processes which record participants into the same data
+file, then checks that no sequence was handed out twice and that every row
+is complete. Run it with e.g. `python bench_recorder.py --writers 12`.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from exp_binary import BinaryResults
+from exp_recorder import Recorders
+from exp_storage import SqliteStorage
+
+
+class StressSettings:
+    """minimal settings needed by the recorders"""
+
+    def __init__(self, data_path, condition_num, storage="csv"):
+        self.data_path = data_path
+        self.storage = storage
+        self.condition_num = condition_num
+        self.journal_interval = 0.2
+        self.plan = None
+        self.counterbalance = False
+        self.metrics_path = None
+        self.metrics_port = None
+
+    def condition_num_per_ppt(self):
+        return self.condition_num
+
+
+def write_participants(data_path, condition_num, ppt_num, storage):
+    """record ppt_num participants, as one station would do
+
+    Args:
+        data_path: shared data file path
+        condition_num: amount of trials per participant
+        ppt_num: amount of participants to record
+        storage: "csv", "sqlite" or "binary", see Settings.storage
+    """
+    setting = StressSettings(data_path, condition_num, storage)
+    for _ in range(ppt_num):
+        recorder = Recorders(setting)
+        recorder.append_demographics()
+        for i in range(condition_num):
+            recorder.append_trial_data("size" + str(i), "urn_a urn_b",
+                                       "urn_a", "fix", "blue")
+        recorder.completed()
+        recorder.data_to_csv()
+        recorder.close()
+
+
+def check_data(data_path, condition_num, expected_rows):
+    """check the data file written by the writers
+
+    Returns:
+        a list of problems found, empty if the data file is consistent
+    """
+    problems = []
+    with open(data_path, "r") as data_file:
+        lines = data_file.read().split("\n")
+    if lines[-1] != "":
+        problems.append("last row is not terminated")
+    rows = [line.split(",") for line in lines[1:-1]]
+    if len(rows) != expected_rows:
+        problems.append(f"{len(rows)} rows, expected {expected_rows}")
+    columns = (len(Recorders.ppt_info) +
+               len(Recorders.trial_info) * condition_num)
+    for row in rows:
+        if len(row) != columns:
+            problems.append("malformed row: " + ",".join(row))
+    seqs = [row[0] for row in rows]
+    if len(set(seqs)) != len(seqs):
+        problems.append("duplicated sequences")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=12)
+    parser.add_argument("--participants", type=int, default=200,
+                        help="participants recorded by each writer")
+    parser.add_argument("--conditions", type=int, default=3)
+    parser.add_argument("--storage", choices=["csv", "sqlite", "binary"],
+                        default="csv")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = os.path.join(temp_dir, "stress_data." + args.storage)
+        processes = [multiprocessing.Process(
+            target=write_participants,
+            args=(data_path, args.conditions, args.participants,
+                  args.storage))
+            for _ in range(args.writers)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        total = args.writers * args.participants
+        if args.storage == "sqlite":
+            storage = SqliteStorage(data_path)
+            data_path = os.path.join(temp_dir, "stress_data.csv")
+            storage.export_csv(data_path)
+            storage.close()
+        elif args.storage == "binary":
+            results = BinaryResults(data_path)
+            data_path = os.path.join(temp_dir, "stress_data.csv")
+            results.to_csv(data_path)
+        problems = check_data(data_path, args.conditions, total)
+        print(f"{args.writers} writers, {total} rows in {elapsed:.2f} s "
+              f"({total / elapsed:.0f} rows/s)")
+        for problem in problems:
+            print("FAIL:", problem)
+        if problems or any(p.exitcode for p in processes):
+            raise SystemExit(1)
+        print("OK: no duplicated sequences or corrupt rows")
+
+
+if __name__ == "__main__":
+    main()
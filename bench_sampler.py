@@ -0,0 +1,171 @@
+"""benchmark of the urn samplers
+
+Compares the batch NumPy sampler of exp_urn.py with the scalar
+random_portion/get_ball path, and the alias and without-replacement
+samplers of exp_sampler.py with get_ball for urns of many colors and many
+balls: the distributions of mixtures and draws are checked with a
+chi-square test of homogeneity, and the time per sample is reported. Run
+it with e.g. `python bench_sampler.py --samples 200000`.
+"""
+import argparse
+import math
+import random
+import time
+import numpy as np
+from exp_sampler import BallBags
+from exp_urn import FixUrns, RandomUrns, get_ball, random_portion
+
+
+def chi_square(counts_a, counts_b):
+    """chi-square test of homogeneity of two samples
+
+    Args:
+        counts_a: a dict, {category: count} of the first sample
+        counts_b: a dict, {category: count} of the second sample
+
+    Returns:
+        statistic: the chi-square statistic
+        df: degrees of freedom
+    """
+    categories = set(counts_a) | set(counts_b)
+    total_a = sum(counts_a.values())
+    total_b = sum(counts_b.values())
+    statistic = 0.0
+    for category in categories:
+        a = counts_a.get(category, 0)
+        b = counts_b.get(category, 0)
+        expected_a = (a + b) * total_a / (total_a + total_b)
+        expected_b = (a + b) * total_b / (total_a + total_b)
+        statistic += (a - expected_a) ** 2 / expected_a
+        statistic += (b - expected_b) ** 2 / expected_b
+    return statistic, len(categories) - 1
+
+
+def count(items):
+    counts = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def report(name, statistic, df, scalar_time, batch_time, samples,
+           batch_name="batch"):
+    # about a 1e-4 false alarm rate for the degrees of freedom used here
+    limit = df + 4 * math.sqrt(2 * df) + 4
+    verdict = "same distribution" if statistic < limit else "DIFFERENT"
+    print(f"{name}: chi2={statistic:.1f} df={df} ({verdict}), "
+          f"scalar {scalar_time / samples * 1e9:.0f} ns/sample, "
+          f"{batch_name} {batch_time / samples * 1e9:.0f} ns/sample")
+    return statistic < limit
+
+
+def compare_portions(size, colors, samples, rng):
+    urn = RandomUrns("urn", colors, size)
+    start = time.perf_counter()
+    scalar = [tuple(random_portion(size, len(colors)))
+              for _ in range(samples)]
+    scalar_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = urn.batch_color_num(samples, rng)
+    batch_time = time.perf_counter() - start
+    statistic, df = chi_square(count(scalar),
+                               count(map(tuple, batch.tolist())))
+    return report(f"mixtures size={size} colors={len(colors)}", statistic,
+                  df, scalar_time, batch_time, samples)
+
+
+def compare_draws(color_num, colors, samples, rng):
+    urn = FixUrns("urn", colors, color_num)
+    start = time.perf_counter()
+    scalar = [get_ball(colors, color_num) for _ in range(samples)]
+    scalar_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = urn.batch_draws(samples, rng)
+    batch_time = time.perf_counter() - start
+    statistic, df = chi_square(count(scalar),
+                               count(colors[i] for i in batch.tolist()))
+    return report(f"draws color_num={color_num}", statistic, df,
+                  scalar_time, batch_time, samples)
+
+
+def compare_alias(color_count, balls, samples, rng):
+    """compare the alias sampler with get_ball for an urn of color_count
+    colors and about balls balls"""
+    colors = [f"color{i}" for i in range(color_count)]
+    color_num = random_portion(balls, color_count)
+    urn = FixUrns("urn", colors, color_num)
+    start = time.perf_counter()
+    scalar = [get_ball(colors, color_num) for _ in range(samples)]
+    scalar_time = time.perf_counter() - start
+    start = time.perf_counter()
+    alias = [urn.draw() for _ in range(samples)]
+    alias_time = time.perf_counter() - start
+    statistic, df = chi_square(count(scalar), count(alias))
+    passed = report(f"alias colors={color_count} balls={balls}", statistic,
+                    df, scalar_time, alias_time, samples, "alias")
+
+    start = time.perf_counter()
+    urn.sampler().sample_batch(samples, rng)
+    batch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    urn.batch_draws(samples, rng)
+    cumulative_time = time.perf_counter() - start
+    print(f"  batch: cumulative {cumulative_time / samples * 1e9:.0f} "
+          f"ns/sample, alias {batch_time / samples * 1e9:.0f} ns/sample")
+    return passed
+
+
+def check_bag(color_count, balls, samples):
+    """draw without replacement and check the balls left of each color"""
+    color_num = random_portion(balls, color_count)
+    bag = BallBags(color_num)
+    samples = min(samples, balls)
+    drawn = [0] * color_count
+    start = time.perf_counter()
+    for _ in range(samples):
+        drawn[bag.sample()] += 1
+    elapsed = time.perf_counter() - start
+    passed = all(d <= num for d, num in zip(drawn, color_num))
+    passed = passed and len(bag) == balls - samples
+    if samples == balls:
+        passed = passed and drawn == color_num
+    verdict = "consistent" if passed else "INCONSISTENT"
+    print(f"without replacement colors={color_count} balls={balls}: "
+          f"{verdict}, {elapsed / samples * 1e9:.0f} ns/sample")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--colors", nargs="+", type=int,
+                        default=[2, 10, 50, 200],
+                        help="amounts of colors of the alias benchmarks")
+    parser.add_argument("--balls", type=int, default=1000000,
+                        help="amount of balls of the alias benchmarks")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    results = [
+        compare_portions(2, ["blue", "red"], args.samples, rng),
+        compare_portions(10, ["blue", "red"], args.samples, rng),
+        compare_portions(100, ["blue", "red"], args.samples, rng),
+        compare_portions(10, ["blue", "red", "green", "yellow"],
+                         args.samples, rng),
+        compare_draws([1, 1], ["blue", "red"], args.samples, rng),
+        compare_draws([30, 50, 0, 20], ["blue", "red", "green", "yellow"],
+                      args.samples, rng),
+    ]
+    for color_count in args.colors:
+        results.append(compare_alias(color_count, args.balls, args.samples,
+                                     rng))
+        results.append(check_bag(color_count, args.balls, args.samples))
+    results.append(check_bag(20, 5000, 5000))
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
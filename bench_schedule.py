@@ -0,0 +1,120 @@
+"""benchmark of the balanced schedule of exp_schedule.py
+
+Recruits simulated participants, of whom a fraction drops out, until
+every cell of the design has the target amount of completed participants,
+with three ways of assigning the cells:
+
+    shuffle   a uniformly random cell, as shuffled trial orders and urns
+    sequence  the participant sequence modulo the amount of cells, as the
+              between-subject assignment by sequence
+    schedule  the schedule, handing the cells of dropouts out again
+
+and reports the participants recruited and the time per allocation of
+the schedule persisted in a file:
+
+    python bench_schedule.py --target 10 --dropout 0.2
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from exp_schedule import Schedules
+from exp_setting import Settings
+
+
+def recruit(assign, cell_num, target, dropout, rng, finish=None):
+    """recruit participants until every cell has target completed
+
+    Args:
+        assign: function of the sequence of a participant, giving a cell
+        cell_num: amount of cells
+        target: completed participants wanted in every cell
+        dropout: probability of a participant not completing
+        rng: a random.Random object
+        finish: function of the cell and whether it was completed
+
+    Returns:
+        amount of participants recruited
+    """
+    completed = [0] * cell_num
+    short = cell_num
+    seq = 0
+    while short:
+        seq += 1
+        cell = assign(seq)
+        done = rng.random() >= dropout
+        if finish is not None:
+            finish(cell, done)
+        if done:
+            completed[cell] += 1
+            if completed[cell] == target:
+                short -= 1
+    return seq
+
+
+def bench_recruit(cell_num, target, dropout, repeat, seed):
+    """
+    Returns:
+        a dict, {way of assigning: mean participants recruited}
+    """
+    rng = random.Random(seed)
+    recruited = {"shuffle": 0, "sequence": 0, "schedule": 0}
+    for _ in range(repeat):
+        recruited["shuffle"] += recruit(
+            lambda seq: rng.randrange(cell_num), cell_num, target,
+            dropout, rng)
+        recruited["sequence"] += recruit(
+            lambda seq: seq % cell_num, cell_num, target, dropout, rng)
+        schedule = Schedules(cell_num)
+        recruited["schedule"] += recruit(
+            lambda seq: schedule.allocate(), cell_num, target, dropout, rng,
+            schedule.finish)
+    return {way: total / repeat for way, total in recruited.items()}
+
+
+def bench_allocate(cell_num, allocations):
+    """
+    Returns:
+        seconds per allocation and finish of a schedule in a file
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        schedule = Schedules(cell_num, os.path.join(temp_dir, "schedule"))
+        start = time.perf_counter()
+        for _ in range(allocations):
+            schedule.finish(schedule.allocate(), True)
+        elapsed = time.perf_counter() - start
+        schedule.close()
+    return elapsed / allocations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--between", action="store_true",
+                        help="cells of the between-subject design")
+    parser.add_argument("--target", type=int, default=10,
+                        help="completed participants wanted per cell")
+    parser.add_argument("--dropout", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--allocations", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    setting = Settings()
+    setting.between = args.between
+    cell_num = setting.cell_num()
+    recruited = bench_recruit(cell_num, args.target, args.dropout,
+                              args.repeat, args.seed)
+    print(f"{cell_num} cells, {args.target} completed wanted per cell "
+          f"({cell_num * args.target} in all), dropout {args.dropout}:")
+    for way, mean in recruited.items():
+        print(f"  {way}: {mean:.1f} participants recruited")
+    seconds = bench_allocate(cell_num, args.allocations)
+    print(f"schedule in a file: {seconds * 1e6:.1f} us per allocation "
+          f"and finish")
+
+
+if __name__ == "__main__":
+    main()
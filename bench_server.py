@@ -0,0 +1,251 @@
+"""load test of the session server of exp_server.py
+
+Starts the server in another process on a free local port, then drives
+hundreds of concurrent participants through the whole flow with
+keep-alive connections, and reports the p50/p99 latency of each kind of
+request and the sessions completed per second. The data file is checked
+for one row per participant and unique sequences, for every storage the
+server can record into:
+
+    python bench_server.py --participants 1000 --concurrency 300
+    python bench_server.py --storage sqlite
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from exp_analysis import iter_rows
+from exp_binary import BinaryResults
+from exp_server import SessionServers
+from exp_setting import Settings
+from exp_storage import SqliteStorage
+
+DATA_FILES = {"csv": "within_data.csv", "sqlite": "within_data.db",
+              "binary": "within_data.bin"}
+
+
+def run_server(data_path, storage, ports, stop):
+    """serve until stop is set, then write every row"""
+    setting = Settings()
+    setting.storage = storage
+    setting.data_path = data_path
+
+    async def serve():
+        server = SessionServers(setting)
+        ports.put(await server.start("127.0.0.1", 0))
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        await server.stop()
+
+    asyncio.run(serve())
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Clients:
+    """class of the keep-alive connection of one simulated participant"""
+
+    def __init__(self, port, latencies):
+        """
+        Args:
+            port: port of the server on localhost
+            latencies: a dict, {kind of request: list of seconds}, filled
+                       by request
+        """
+        self.port = port
+        self.latencies = latencies
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            "127.0.0.1", self.port)
+
+    async def request(self, kind, method, path, body=None):
+        """send one request and wait for its answer
+
+        Returns:
+            the JSON answer, a dict
+        """
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        head = (f"{method} {path} HTTP/1.1\r\n"
+                f"Host: localhost\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n\r\n")
+        start = time.perf_counter()
+        self.writer.write(head.encode("latin-1") + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        answer = json.loads(await self.reader.readexactly(length))
+        self.latencies.setdefault(kind, []).append(
+            time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f"{kind}: {status} {answer.get('error')}")
+        return answer
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def participant(port, latencies, think_ms, rng):
+    """go through the whole flow as one participant"""
+    client = Clients(port, latencies)
+    await client.connect()
+
+    async def think():
+        if think_ms:
+            await asyncio.sleep(rng.uniform(0, 2 * think_ms) / 1000)
+
+    state = await client.request("session", "POST", "/sessions")
+    path = "/sessions/" + state["session"]
+    await think()
+    await client.request("consent", "POST", path + "/consent",
+                         {"agree": True})
+    await think()
+    await client.request("demographics", "POST", path + "/demographics",
+                         {"age": 20, "gender": "Female",
+                          "education_level": "Primary School",
+                          "race": "Asian"})
+    await think()
+    state = await client.request("start", "POST", path + "/start")
+    while state["page"] == "trial":
+        await think()
+        urn = rng.choice(state["urns"])["name"]
+        state = await client.request("choose", "POST", path + "/choose",
+                                     {"urn": urn})
+    await client.close()
+
+
+async def load(port, ppt_num, concurrency, think_ms, seed):
+    """run ppt_num participants, at most concurrency at once
+
+    Returns:
+        latencies: a dict, {kind of request: list of seconds}
+        elapsed: seconds of the whole load
+    """
+    latencies = {}
+    limit = asyncio.Semaphore(concurrency)
+    rng = random.Random(seed)
+
+    async def limited():
+        async with limit:
+            await participant(port, latencies, think_ms, rng)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(ppt_num)))
+    return latencies, time.perf_counter() - start
+
+
+def to_csv(data_path, storage):
+    """get the data written by the server in the csv layout
+
+    Returns:
+        path of the csv file
+    """
+    if storage == "csv":
+        return data_path
+    csv_path = data_path + ".csv"
+    if storage == "sqlite":
+        sqlite_storage = SqliteStorage(data_path)
+        sqlite_storage.export_csv(csv_path)
+        sqlite_storage.close()
+    else:
+        BinaryResults(data_path).to_csv(csv_path)
+    return csv_path
+
+
+def check_data(data_path, storage, ppt_num):
+    """check the rows written by the server
+
+    Returns:
+        a list of problems found, empty if the data file is consistent
+    """
+    rows = [row for row, _ in iter_rows(to_csv(data_path, storage))]
+    problems = []
+    if len(rows) != ppt_num:
+        problems.append(f"{len(rows)} rows, expected {ppt_num}")
+    seqs = [row["sequence"] for row in rows]
+    if len(set(seqs)) != len(seqs):
+        problems.append("duplicated sequences")
+    if any(row["completed"] != "1" for row in rows):
+        problems.append("rows of incomplete sessions")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--participants", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=300)
+    parser.add_argument("--think-ms", type=float, default=0,
+                        help="mean pause of a participant between requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", nargs="+",
+                        choices=sorted(DATA_FILES),
+                        default=["csv", "sqlite", "binary"])
+    args = parser.parse_args()
+
+    failed = False
+    for storage in args.storage:
+        failed |= run_storage(storage, args)
+    if failed:
+        raise SystemExit(1)
+
+
+def run_storage(storage, args):
+    """load a server recording into one storage and report
+
+    Returns:
+        True if the server failed or the data file is not consistent
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = os.path.join(temp_dir, DATA_FILES[storage])
+        ports = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        server = multiprocessing.Process(
+            target=run_server, args=(data_path, storage, ports, stop))
+        server.start()
+        port = ports.get(timeout=30)
+        try:
+            latencies, elapsed = asyncio.run(
+                load(port, args.participants, args.concurrency,
+                     args.think_ms, args.seed))
+        finally:
+            stop.set()
+            server.join()
+        problems = check_data(data_path, storage, args.participants)
+
+    every = [seconds for kind in latencies for seconds in latencies[kind]]
+    print(f"{storage}, {args.participants} participants, "
+          f"{args.concurrency} at once: "
+          f"{len(every)} requests in {elapsed:.2f} s "
+          f"({args.participants / elapsed:.0f} sessions/s, "
+          f"{len(every) / elapsed:.0f} requests/s)")
+    for kind, seconds in list(latencies.items()) + [("all", every)]:
+        print(f"  {kind}: p50 {percentile(seconds, 0.5) * 1000:.2f} ms, "
+              f"p99 {percentile(seconds, 0.99) * 1000:.2f} ms")
+    for problem in problems:
+        print("FAIL:", problem)
+    if problems or server.exitcode:
+        return True
+    print("OK: one completed row per participant, no duplicated sequences")
+    return False
+
+
+if __name__ == "__main__":
+    main()
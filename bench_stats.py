@@ -0,0 +1,61 @@
+"""benchmark of the resampling of exp_stats.py
+
+Reports resamples per second of the bootstrap and the permutation test
+on synthetic choices, for a few chunk sizes and amounts of processes,
+against a plain python loop:
+
+    python bench_stats.py --participants 300 --resamples 100000
+"""
+import argparse
+import random
+import time
+import numpy as np
+from exp_stats import Resamplers
+
+
+def python_bootstrap(x, count):
+    """bootstrap of a mean with a plain python loop, as a baseline"""
+    n = len(x)
+    return [sum(random.choices(x, k=n)) / n for _ in range(count)]
+
+
+def rate(function, count):
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--participants", type=int, default=300)
+    parser.add_argument("--resamples", type=int, default=100000)
+    parser.add_argument("--chunk-sizes", nargs="+", type=int,
+                        default=[1000, 10000])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = (rng.random(args.participants) < 0.6).astype(np.float64)
+    y = (rng.random(args.participants) < 0.5).astype(np.float64)
+
+    baseline_count = max(1, args.resamples // 100)
+    baseline = rate(lambda: python_bootstrap(x.tolist(), baseline_count),
+                    baseline_count)
+    print(f"python loop bootstrap: {baseline:,.0f} resamples/s")
+
+    for workers in args.workers:
+        for chunk_size in args.chunk_sizes:
+            with Resamplers(chunk_size, workers, seed=0) as resamplers:
+                bootstrap = rate(
+                    lambda: resamplers.run("bootstrap_mean", (x,),
+                                           args.resamples), args.resamples)
+                permutation = rate(
+                    lambda: resamplers.run("permute_difference", (x, y),
+                                           args.resamples), args.resamples)
+            print(f"workers={workers} chunk={chunk_size}: "
+                  f"bootstrap {bootstrap:,.0f} resamples/s, "
+                  f"permutation {permutation:,.0f} resamples/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""streaming analysis of the data written by the recorders
+
+Reads the wide csv layout of Recorders.get_header one row at a time, so
+memory does not grow with the data file, and yields one long-format
+record per trial. Choice rates per condition and urn type are kept as
+incremental aggregates, updated from the rows appended since the last run:
+
+    python exp_analysis.py within_data.csv between_data.csv
+"""
+import argparse
+import csv
+import json
+import os
+from exp_storage import split_header
+
+
+def iter_lines(path, offset=0):
+    """read the complete lines of a file from a byte offset
+
+    A last line without line break is still being written and is left
+    for the next run.
+
+    Args:
+        path: path of the csv file
+        offset: byte offset to start from
+
+    Yields:
+        line: a decoded line, without line break
+        end: byte offset right after the line
+    """
+    with open(path, "rb") as data_file:
+        data_file.seek(offset)
+        end = offset
+        for raw_line in data_file:
+            if not raw_line.endswith(b"\n"):
+                break
+            end += len(raw_line)
+            yield raw_line.decode("utf-8").rstrip("\r\n"), end
+
+
+def parse_line(line):
+    """split one csv line into values"""
+    return next(csv.reader([line]))
+
+
+def read_header(path):
+    """read the header of a csv data file
+
+    Returns:
+        header: a list of column names
+        end: byte offset right after the header
+    """
+    for line, end in iter_lines(path):
+        return parse_line(line), end
+    return [], 0
+
+
+def design_of(path, trial_num):
+    """get the design of a data file, see Settings.set_data_path
+
+    Returns:
+        "between" or "within"
+    """
+    name = os.path.basename(path)
+    if name.startswith("between_"):
+        return "between"
+    if name.startswith("within_"):
+        return "within"
+    return "between" if trial_num == 1 else "within"
+
+
+# kinds of urns named by the suffix of their name, in data recorded before
+# the kind of the chosen urn was recorded (choice_kind)
+NAME_KINDS = {"equal": "fix", "fix": "fix", "random": "random"}
+
+
+def urn_type(urn_name, choice_kind=""):
+    """get the kind of a chosen urn, "fix" or "random"
+
+    The kind is recorded with the choice (see Recorders.trial_info). For
+    data recorded before, it is taken from the suffix of the name, e.g.
+    "random" for "urn_10_random", "fix" for "urn_10_equal", else "".
+
+    Args:
+        urn_name: name of the chosen urn
+        choice_kind: recorded kind of the chosen urn, if any
+    """
+    if choice_kind:
+        return choice_kind
+    return NAME_KINDS.get(urn_name.rsplit("_", 1)[-1], "")
+
+
+def iter_rows(path, offset=0):
+    """read the participant rows of a csv data file
+
+    Args:
+        path: path of the csv file
+        offset: byte offset to start from, 0 for the first row
+
+    Yields:
+        row: a dict, {column name: value}
+        end: byte offset right after the row
+    """
+    header, header_end = read_header(path)
+    for line, end in iter_lines(path, max(offset, header_end)):
+        yield dict(zip(header, parse_line(line))), end
+
+
+def iter_trials(path, offset=0):
+    """read the trials of a csv data file in long format
+
+    Args:
+        path: path of the csv file
+        offset: byte offset to start from, 0 for the first row
+
+    Yields:
+        trial: a dict with the participant columns, design, trial number,
+               urn_type and the per-trial columns without prefix, one per
+               trial the participant reached
+    """
+    header, _ = read_header(path)
+    ppt_fields, trial_fields, trial_num = split_header(header)
+    design = design_of(path, trial_num)
+    for row, _ in iter_rows(path, offset):
+        yield from row_trials(row, ppt_fields, trial_fields, trial_num,
+                              design)
+
+
+def row_trials(row, ppt_fields, trial_fields, trial_num, design):
+    """split one wide participant row into long-format trials"""
+    for i in range(1, trial_num + 1):
+        prefix = str(i) + "_"
+        if not row.get(prefix + "condition"):
+            break
+        trial = {field: row.get(field, "") for field in ppt_fields}
+        trial["design"] = design
+        trial["trial"] = i
+        for field in trial_fields:
+            trial[field] = row.get(prefix + field, "")
+        trial["urn_type"] = urn_type(trial["choice"],
+                                     trial.get("choice_kind", ""))
+        yield trial
+
+
+class ChoiceRates:
+    """class of incremental choice rates of a csv data file
+
+    Counts the choices per design, condition and urn type. The counts and
+    the byte offset read so far are saved to a state file, so the next
+    update only reads the rows appended since. If the data file became
+    shorter than the offset or the bytes right before the offset changed,
+    e.g. the file was rewritten, the counts are rebuilt from the start.
+    """
+
+    # amount of bytes before the offset used to detect a data file
+    # rewritten since the last update, see DataIndex in exp_index.py
+    tail_length = 64
+
+    def __init__(self, data_path, state_path=None):
+        """initialize the aggregates
+
+        Args:
+            data_path: path of the csv data file
+            state_path: path of the state file, defaulted to
+                        data_path + ".rates.json"
+        """
+        self.data_path = data_path
+        self.state_path = state_path or data_path + ".rates.json"
+        self.offset = 0
+        self.tail = ""
+        self.ppt_num = 0
+        self.completed = 0
+        # {(design, condition, urn type): amount of choices}
+        self.counts = {}
+
+    def load(self):
+        """read the state file, if any"""
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+            self.offset = int(state["offset"])
+            # states of older versions have no tail, so they are rebuilt
+            self.tail = state.get("tail", "")
+            self.ppt_num = int(state["ppt_num"])
+            self.completed = int(state["completed"])
+            self.counts = {tuple(key): count
+                           for key, count in state["counts"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            self.reset()
+
+    def save(self):
+        """write the state file"""
+        state = {"offset": self.offset,
+                 "tail": self.tail,
+                 "ppt_num": self.ppt_num,
+                 "completed": self.completed,
+                 "counts": [[list(key), count]
+                            for key, count in self.counts.items()]}
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_path, self.state_path)
+
+    def reset(self):
+        self.offset = 0
+        self.tail = ""
+        self.ppt_num = 0
+        self.completed = 0
+        self.counts = {}
+
+    def update(self):
+        """count the rows appended since the last update
+
+        Returns:
+            amount of new participant rows
+        """
+        if self.is_stale():
+            self.reset()
+        header, _ = read_header(self.data_path)
+        ppt_fields, trial_fields, trial_num = split_header(header)
+        design = design_of(self.data_path, trial_num)
+        new_rows = 0
+        for row, end in iter_rows(self.data_path, self.offset):
+            new_rows += 1
+            self.completed += row.get("completed") == "1"
+            for trial in row_trials(row, ppt_fields, trial_fields,
+                                    trial_num, design):
+                key = (design, trial["condition"], trial["urn_type"])
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.offset = end
+        self.ppt_num += new_rows
+        self.tail = self.read_tail()
+        return new_rows
+
+    def read_tail(self):
+        """read the bytes right before the offset
+
+        Returns:
+            the tail as a hex string
+        """
+        start = max(0, self.offset - self.tail_length)
+        with open(self.data_path, "rb") as data_file:
+            data_file.seek(start)
+            return data_file.read(self.offset - start).hex()
+
+    def is_stale(self):
+        """check whether the part of the data file already counted was
+        changed
+
+        Returns:
+            True if the counts do not match the data file, else False
+        """
+        if self.offset > os.path.getsize(self.data_path):
+            return True
+        return self.read_tail() != self.tail
+
+    def rates(self):
+        """get the choice rate of each urn type
+
+        Returns:
+            a dict, {(design, condition): {urn type: (count, proportion)}}
+        """
+        totals = {}
+        for (design, condition, _), count in self.counts.items():
+            key = (design, condition)
+            totals[key] = totals.get(key, 0) + count
+        rates = {}
+        for (design, condition, kind), count in sorted(self.counts.items()):
+            total = totals[(design, condition)]
+            rates.setdefault((design, condition), {})[kind] = (
+                count, count / total)
+        return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_paths", nargs="+")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="ignore the saved state and read everything")
+    args = parser.parse_args()
+
+    for data_path in args.data_paths:
+        aggregates = ChoiceRates(data_path)
+        if not args.rebuild:
+            aggregates.load()
+        new_rows = aggregates.update()
+        aggregates.save()
+        print(f"{data_path}: {aggregates.ppt_num} participants "
+              f"({aggregates.completed} completed, {new_rows} new)")
+        for (design, condition), kinds in aggregates.rates().items():
+            text = ", ".join(f"{kind} {count} ({proportion:.3f})"
+                             for kind, (count, proportion) in kinds.items())
+            print(f"  {design} {condition}: {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""fixed-width binary result files
+
+Every participant is one record of the same size: the amount of values
+recorded, the participant fields and the fields of every trial, with text
+fields interned to integer codes (see exp_columnar.py). Participant k is
+at a known offset, so the file can be appended to by the recorders (see
+BinaryStorage and Settings.storage) and opened by analysis with a NumPy
+memmap for zero-copy scans (see BinaryResults). The header and the
+codebooks are kept in a json sidecar file, <data_path>.json.
+
+    python exp_binary.py within_data.csv within_data.bin
+"""
+import argparse
+import json
+import os
+import struct
+from exp_analysis import iter_lines, parse_line, urn_type
+from exp_columnar import CODE_TYPECODE, INT_TYPECODES, Codebooks, to_int
+from exp_lock import FileLock
+from exp_storage import split_header
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"EXPBIN1\n"
+FILE_HEADER = struct.Struct("<8sII")
+NUMPY_TYPES = {"b": "i1", "h": "<i2", "H": "<u2", "q": "<i8", "Q": "<u8"}
+
+
+def record_layout(header):
+    """get the fields of a record
+
+    Args:
+        header: header of the wide data, see Recorders.get_header
+
+    Returns:
+        a list of (name, typecode), starting with the amount of values
+    """
+    layout = [("row_length", "H")]
+    for name in header:
+        layout.append((name, INT_TYPECODES.get(field_of(name),
+                                               CODE_TYPECODE)))
+    return layout
+
+
+def field_of(name):
+    """get the field of a column name, e.g. "choice" for "2_choice" """
+    prefix, _, field = name.partition("_")
+    return field if prefix.isdigit() else name
+
+
+class BinaryStorage:
+    """class of binary storage of the recorders
+
+    Appends one fixed-width record per participant under the file lock
+    (see exp_lock.py). The amount of participants is the size of the file
+    divided by the record size, and sequences are reserved in the sidecar
+    file, so no scan is needed.
+    """
+
+    def __init__(self, data_path):
+        """initialize the storage
+
+        Args:
+            data_path: binary data file path
+        """
+        self.data_path = data_path
+        self.meta_path = data_path + ".json"
+        self.lock = FileLock(data_path + ".lock")
+        self.header = []
+        self.layout = []
+        self.record = None
+        self.codebooks = {}
+        self.next_seq = 1
+
+    def set_header(self, header):
+        self.header = list(header)
+        self.layout = record_layout(header)
+        self.record = struct.Struct(
+            "<" + "".join(code for _, code in self.layout))
+
+    def load_meta(self):
+        """read the sidecar file, under the lock
+
+        The file is read every time, as another station may have changed
+        it within the same mtime tick of a coarse file system (e.g. SMB,
+        NFS, FAT). The codebooks only grow, so only the ones which grew
+        are built again.
+
+        Returns:
+            False if there is no sidecar file yet
+        """
+        try:
+            with open(self.meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            return False
+        if not self.header:
+            self.set_header(meta["header"])
+        elif meta["header"] != self.header:
+            raise ValueError(self.data_path + " was written with another "
+                             "header, choose another data path")
+        for field, values in meta["codebooks"].items():
+            codebook = self.codebooks.get(field)
+            if codebook is None or len(codebook.values) != len(values):
+                self.codebooks[field] = Codebooks(values)
+        self.next_seq = meta["next_seq"]
+        return True
+
+    def save_meta(self):
+        """write the sidecar file"""
+        meta = {"header": self.header,
+                "codebooks": {field: codebook.values for field, codebook in
+                              self.codebooks.items()},
+                "next_seq": self.next_seq}
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, self.meta_path)
+
+    def init(self, header):
+        """create a new data file and sidecar file if no such file
+
+        Args:
+            header: header of the wide data
+
+        Raises:
+            ValueError: if the data file was written with another header,
+                        or exists without its sidecar file, which is
+                        needed to decode it
+        """
+        with self.lock:
+            if self.load_meta():
+                if list(header) != self.header:
+                    raise ValueError(self.data_path + " was written with "
+                                     "another header, choose another data "
+                                     "path")
+                return
+            if os.path.exists(self.data_path):
+                raise ValueError(self.data_path + " exists without its "
+                                 "sidecar file " + self.meta_path +
+                                 ", restore it or choose another data path")
+            self.set_header(header)
+            # never truncate a data file created meanwhile
+            fd = os.open(self.data_path,
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            with os.fdopen(fd, "wb") as data_file:
+                data_file.write(FILE_HEADER.pack(MAGIC, 1, self.record.size))
+            self.save_meta()
+
+    def allocate_seq(self):
+        """hand out the sequence of the next participant"""
+        with self.lock:
+            self.load_meta()
+            seq = max(self.next_seq, self.count_ppt() + 1)
+            self.next_seq = seq + 1
+            self.save_meta()
+            return seq
+
+    def count_ppt(self):
+        """count the participants already recorded"""
+        size = os.path.getsize(self.data_path) - FILE_HEADER.size
+        return size // self.record.size
+
+    def has_seq(self, seq):
+        """check whether the row of a sequence is already recorded, by
+        reading the sequence of every record
+
+        Args:
+            seq: sequence of the participant, a str
+        """
+        # the amount of values and the sequence start every record
+        start = struct.Struct("<" + self.layout[0][1] + self.layout[1][1])
+        seq = to_int(str(seq))
+        with self.lock, open(self.data_path, "rb") as data_file:
+            data_file.seek(FILE_HEADER.size)
+            while True:
+                record = data_file.read(self.record.size)
+                if len(record) < self.record.size:
+                    return False
+                if start.unpack_from(record)[1] == seq:
+                    return True
+
+    def encode(self, row):
+        """pack one row into a record, interning new text values
+
+        Returns:
+            record: bytes
+            changed: True if a codebook got a new value
+        """
+        values = [len(row)]
+        changed = False
+        for i, (name, code) in enumerate(self.layout[1:]):
+            value = row[i] if i < len(row) else ""
+            if code == CODE_TYPECODE:
+                codebook = self.codebooks.setdefault(field_of(name),
+                                                     Codebooks())
+                size = len(codebook.values)
+                values.append(codebook.code(value))
+                changed = changed or len(codebook.values) != size
+            else:
+                values.append(to_int(value))
+        return self.record.pack(*values), changed
+
+    def write_rows(self, rows):
+        """append participant rows with one write
+
+        Args:
+            rows: lists of str, in the order of the header
+        """
+        with self.lock:
+            self.load_meta()
+            records = []
+            changed = False
+            for row in rows:
+                record, new_values = self.encode(row)
+                records.append(record)
+                changed = changed or new_values
+            # codes are saved before the records that use them
+            if changed:
+                self.save_meta()
+            fd = os.open(self.data_path, os.O_WRONLY | os.O_APPEND)
+            try:
+                data = b"".join(records)
+                written = os.write(fd, data)
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            if rows:
+                self.next_seq = max(self.next_seq, to_int(rows[-1][0]) + 1)
+
+    def write(self, row):
+        """append one participant row
+
+        Args:
+            row: a list of str, in the order of the header
+        """
+        self.write_rows([row])
+
+    def flush(self):
+        """rows are written through, nothing to flush"""
+
+    def close(self):
+        """rows are written through, nothing to close"""
+
+
+class BinaryResults:
+    """class of read-only access to a binary result file with NumPy"""
+
+    def __init__(self, data_path):
+        """map the data file into memory
+
+        Args:
+            data_path: binary data file path
+        """
+        if np is None:
+            raise ImportError("reading binary results needs NumPy")
+        with open(data_path + ".json", "r") as meta_file:
+            meta = json.load(meta_file)
+        self.header = meta["header"]
+        self.layout = record_layout(self.header)
+        self.codebooks = {field: Codebooks(values) for field, values in
+                          meta["codebooks"].items()}
+        self.dtype = np.dtype([(name, NUMPY_TYPES[code])
+                               for name, code in self.layout])
+        with open(data_path, "rb") as data_file:
+            magic, _, record_size = FILE_HEADER.unpack(
+                data_file.read(FILE_HEADER.size))
+        if magic != MAGIC or record_size != self.dtype.itemsize:
+            raise ValueError(data_path + " is not a binary result file of "
+                             "this header")
+        size = os.path.getsize(data_path) - FILE_HEADER.size
+        if size < record_size:
+            self.records = np.zeros(0, dtype=self.dtype)
+        else:
+            self.records = np.memmap(data_path, dtype=self.dtype, mode="r",
+                                     offset=FILE_HEADER.size,
+                                     shape=(size // record_size,))
+
+    def __len__(self):
+        return len(self.records)
+
+    def code(self, field, value):
+        """get the code of a text value, -1 if never recorded"""
+        return self.codebooks.get(field, Codebooks()).codes.get(value, -1)
+
+    def row(self, k):
+        """get the row of participant k, as written by the recorders"""
+        record = self.records[k]
+        row = []
+        for name, code in self.layout[1:]:
+            value = record[name]
+            if code == CODE_TYPECODE:
+                row.append(self.codebooks[field_of(name)].value(value))
+            else:
+                row.append(str(value))
+        return row[:record["row_length"]]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.row(k)
+
+    def to_csv(self, csv_path):
+        """write the rows in the csv layout of Recorders.get_header"""
+        with open(csv_path, "w") as csv_file:
+            csv_file.write(','.join(self.header) + '\n')
+            for row in self:
+                csv_file.write(','.join(row) + '\n')
+
+    def choice_counts(self):
+        """count the choices per condition and urn type, without decoding
+        any row
+
+        Returns:
+            a dict, {(condition, urn type): amount of choices}
+        """
+        _, trial_fields, trial_num = split_header(self.header)
+        # the kind of the chosen urn, else its name for older data
+        kinds = "choice_kind" in trial_fields
+        field = "choice_kind" if kinds else "choice"
+        conditions = self.codebooks.get("condition", Codebooks()).values
+        choices = self.codebooks.get(field, Codebooks()).values
+        if "condition" not in trial_fields or not conditions:
+            return {}
+        pairs = np.zeros((len(conditions), len(choices)), dtype=np.int64)
+        empty = self.code("condition", "")
+        for i in range(1, trial_num + 1):
+            condition = self.records[f"{i}_condition"]
+            choice = self.records[f"{i}_{field}"]
+            reached = condition != empty
+            np.add.at(pairs, (condition[reached], choice[reached]), 1)
+        counts = {}
+        for c, k in zip(*np.nonzero(pairs)):
+            if kinds:
+                key = (conditions[c], choices[k])
+            else:
+                key = (conditions[c], urn_type(choices[k]))
+            counts[key] = counts.get(key, 0) + int(pairs[c, k])
+        return counts
+
+
+def convert_csv(csv_path, data_path, batch=10000):
+    """convert a csv data file written by the recorders
+
+    Args:
+        csv_path: path of the csv data file
+        data_path: path of the binary data file to write
+        batch: amount of rows written at once
+
+    Returns:
+        amount of participants converted
+    """
+    storage = BinaryStorage(data_path)
+    rows = []
+    count = 0
+    for line, _ in iter_lines(csv_path):
+        if not storage.header:
+            storage.init(parse_line(line))
+            continue
+        rows.append(parse_line(line))
+        if len(rows) >= batch:
+            storage.write_rows(rows)
+            count += len(rows)
+            rows = []
+    storage.write_rows(rows)
+    return count + len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv_path")
+    parser.add_argument("data_path")
+    args = parser.parse_args()
+    count = convert_csv(args.csv_path, args.data_path)
+    print(f"{count} participants converted to {args.data_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""compact columnar store of recorded data
+
+Keeps the rows of Recorders.ppt_data in typed arrays instead of lists of
+strings: condition names, urn names, colors and the other text fields are
+interned to small integer codes, numbers are stored as machine integers,
+and the trials of all participants are stored one after another with the
+offset of the first trial of each participant. A store can be used as the
+storage of Recorders, e.g. for large simulations, converted from and to
+the csv layout of Recorders.get_header, and saved to a binary file which
+is opened again by memory mapping:
+
+    python exp_columnar.py within_data.csv within_data.col
+"""
+import argparse
+import json
+import mmap
+import struct
+from array import array
+from exp_analysis import iter_lines, parse_line
+from exp_storage import split_header
+
+MAGIC = b"EXPCOL1\n"
+
+# typecodes of the numeric fields, every other field is interned
+INT_TYPECODES = {"sequence": "q",
+                 "ID": "q",
+                 "completed": "b",
+                 "seed": "q",
+                 "cell": "q",
+                 "age": "h",
+                 "onset_ns": "q",
+                 "press_ns": "q",
+                 "anim_start_ns": "q",
+                 "anim_end_ns": "q"}
+CODE_TYPECODE = "H"
+
+
+class Codebooks:
+    """class of interned strings of one field"""
+
+    def __init__(self, values=()):
+        """
+        Args:
+            values: strings already interned, in the order of their codes
+        """
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value):
+        """get the code of a string, interning it if new"""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            if code > 0xFFFF:
+                raise ValueError("more than 65536 distinct values")
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        """get the string of a code"""
+        return self.values[code]
+
+
+def to_int(value):
+    """parse a recorded number, an empty value is 0"""
+    return int(value) if value else 0
+
+
+class TrialStores:
+    """class of columnar store of participants and their trials
+
+    Implements the storage interface of Recorders (see exp_storage.py), so
+    it can record a simulation directly.
+    """
+
+    def __init__(self, header=None):
+        """initialize an empty store
+
+        Args:
+            header: header of the wide data, see Recorders.get_header,
+                    or None to set it later with init
+        """
+        self.header = []
+        self.ppt_fields = []
+        self.trial_fields = []
+        self.trial_num = 0
+        self.ppt_columns = {}
+        self.trial_columns = {}
+        self.codebooks = {}
+        # amount of values in each row, for rows of participants who quit
+        self.row_lengths = array("H")
+        # offset of the first trial of each participant, plus the end
+        self.trial_starts = array("q", [0])
+        self.next_seq = 1
+        self.read_only = False
+        if header is not None:
+            self.init(header)
+
+    def init(self, header):
+        """set up the columns of a header
+
+        Args:
+            header: header of the wide data
+        """
+        if self.header:
+            return
+        self.header = list(header)
+        self.ppt_fields, self.trial_fields, self.trial_num = \
+            split_header(header)
+        for field in self.ppt_fields:
+            self.ppt_columns[field] = array(self.typecode(field))
+        for field in self.trial_fields:
+            self.trial_columns[field] = array(self.typecode(field))
+
+    def typecode(self, field):
+        """get the typecode of a field, interning it if not numeric"""
+        if field in INT_TYPECODES:
+            return INT_TYPECODES[field]
+        self.codebooks.setdefault(field, Codebooks())
+        return CODE_TYPECODE
+
+    def encode(self, field, value):
+        if field in self.codebooks:
+            return self.codebooks[field].code(value)
+        return to_int(value)
+
+    def decode(self, field, code):
+        if field in self.codebooks:
+            return self.codebooks[field].value(code)
+        return str(code)
+
+    def allocate_seq(self):
+        """hand out the sequence of the next participant"""
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def count_ppt(self):
+        """count the participants stored"""
+        return len(self)
+
+    def has_seq(self, seq):
+        """check whether the row of a sequence is stored"""
+        return to_int(str(seq)) in self.ppt_columns.get("sequence", ())
+
+    def append(self, row):
+        """append one participant row
+
+        Args:
+            row: a list of str, in the order of the header
+        """
+        if self.read_only:
+            raise ValueError("a memory mapped store is read only")
+        ppt_num = len(self.ppt_fields)
+        trial_size = len(self.trial_fields)
+        self.row_lengths.append(len(row))
+        for i, field in enumerate(self.ppt_fields):
+            value = row[i] if i < len(row) else ""
+            self.ppt_columns[field].append(self.encode(field, value))
+        trials = 0
+        for start in range(ppt_num, len(row), trial_size):
+            for i, field in enumerate(self.trial_fields):
+                index = start + i
+                value = row[index] if index < len(row) else ""
+                self.trial_columns[field].append(self.encode(field, value))
+            trials += 1
+        self.trial_starts.append(self.trial_starts[-1] + trials)
+        if self.ppt_fields and row:
+            self.next_seq = max(self.next_seq, to_int(row[0]) + 1)
+
+    # storage interface, see exp_storage.py
+    write = append
+
+    def flush(self):
+        """rows are kept in memory, nothing to flush"""
+
+    def close(self):
+        """rows are kept in memory, nothing to close"""
+
+    def __len__(self):
+        return len(self.row_lengths)
+
+    def row(self, k):
+        """get the row of participant k, as written by the recorders
+
+        Args:
+            k: index of the participant, from 0
+
+        Returns:
+            row: a list of str
+        """
+        row = [self.decode(field, self.ppt_columns[field][k])
+               for field in self.ppt_fields]
+        for t in range(self.trial_starts[k], self.trial_starts[k + 1]):
+            for field in self.trial_fields:
+                row.append(self.decode(field, self.trial_columns[field][t]))
+        return row[:self.row_lengths[k]]
+
+    def __getitem__(self, index):
+        """get the row of one participant, or a store of a slice of them"""
+        if isinstance(index, slice):
+            return self.slice(*index.indices(len(self))[:2])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("participant index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.row(k)
+
+    def slice(self, start, stop):
+        """get a new store with the participants from start to stop
+
+        Columns of a memory mapped store are sliced without copying.
+        """
+        stop = max(start, stop)
+        store = TrialStores()
+        store.header = self.header
+        store.ppt_fields = self.ppt_fields
+        store.trial_fields = self.trial_fields
+        store.trial_num = self.trial_num
+        store.codebooks = self.codebooks
+        store.read_only = self.read_only
+        first = self.trial_starts[start]
+        last = self.trial_starts[stop]
+        store.ppt_columns = {field: column[start:stop]
+                             for field, column in self.ppt_columns.items()}
+        store.trial_columns = {field: column[first:last]
+                               for field, column in self.trial_columns.items()}
+        store.row_lengths = self.row_lengths[start:stop]
+        store.trial_starts = array("q", (offset - first for offset in
+                                         self.trial_starts[start:stop + 1]))
+        store.next_seq = self.next_seq
+        return store
+
+    def to_csv(self, csv_path):
+        """write the store in the csv layout of Recorders.get_header"""
+        with open(csv_path, "w") as csv_file:
+            csv_file.write(','.join(self.header) + '\n')
+            for row in self:
+                csv_file.write(','.join(row) + '\n')
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        """read a csv data file written by the recorders, row by row"""
+        store = None
+        for line, _ in iter_lines(csv_path):
+            if store is None:
+                store = cls(parse_line(line))
+            else:
+                store.append(parse_line(line))
+        return store if store is not None else cls()
+
+    def columns(self):
+        """get every column with its name, for saving"""
+        columns = [("row_lengths", self.row_lengths),
+                   ("trial_starts", self.trial_starts)]
+        columns += [("ppt:" + field, column)
+                    for field, column in self.ppt_columns.items()]
+        columns += [("trial:" + field, column)
+                    for field, column in self.trial_columns.items()]
+        return columns
+
+    def save(self, path):
+        """save the store to a binary file
+
+        The file starts with a json description of the columns and the
+        codebooks, followed by the raw bytes of every column aligned to 8
+        bytes, in the byte order of this machine.
+        """
+        layout = []
+        offset = 0
+        for name, column in self.columns():
+            typecode = column.typecode if isinstance(column, array) \
+                else column.format
+            size = len(column) * column.itemsize
+            layout.append([name, typecode, offset, len(column)])
+            offset += (size + 7) // 8 * 8
+        meta = json.dumps({"header": self.header,
+                           "next_seq": self.next_seq,
+                           "codebooks": {field: codebook.values for
+                                         field, codebook in
+                                         self.codebooks.items()},
+                           "columns": layout}).encode("utf-8")
+        start = len(MAGIC) + 8 + len(meta)
+        start = (start + 7) // 8 * 8
+        with open(path, "wb") as data_file:
+            data_file.write(MAGIC)
+            data_file.write(struct.pack("<Q", len(meta)))
+            data_file.write(meta)
+            data_file.write(b"\0" * (start - data_file.tell()))
+            for name, column in self.columns():
+                data = bytes(column) if isinstance(column, memoryview) \
+                    else column.tobytes()
+                data_file.write(data)
+                data_file.write(b"\0" * ((8 - len(data) % 8) % 8))
+
+    @classmethod
+    def load(cls, path):
+        """open a binary file saved by save, by memory mapping
+
+        The columns are read-only views of the mapped file, so opening is
+        independent of the size of the data and only the pages read are
+        loaded from disk.
+        """
+        with open(path, "rb") as data_file:
+            mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + " is not a columnar store file")
+        meta_size, = struct.unpack_from("<Q", mapped, len(MAGIC))
+        meta_start = len(MAGIC) + 8
+        meta = json.loads(bytes(mapped[meta_start:meta_start + meta_size]))
+        start = (meta_start + meta_size + 7) // 8 * 8
+
+        store = cls()
+        store.header = meta["header"]
+        store.ppt_fields, store.trial_fields, store.trial_num = \
+            split_header(store.header)
+        store.codebooks = {field: Codebooks(values) for field, values in
+                           meta["codebooks"].items()}
+        store.next_seq = meta["next_seq"]
+        store.read_only = True
+        store.mapped = mapped
+        view = memoryview(mapped)
+        for name, typecode, offset, length in meta["columns"]:
+            itemsize = array(typecode).itemsize
+            begin = start + offset
+            column = view[begin:begin + length * itemsize].cast(typecode)
+            if name == "row_lengths":
+                store.row_lengths = column
+            elif name == "trial_starts":
+                store.trial_starts = column
+            elif name.startswith("ppt:"):
+                store.ppt_columns[name[4:]] = column
+            else:
+                store.trial_columns[name[6:]] = column
+        return store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv_path")
+    parser.add_argument("store_path")
+    args = parser.parse_args()
+
+    store = TrialStores.from_csv(args.csv_path)
+    store.save(args.store_path)
+    print(f"{len(store)} participants, "
+          f"{store.trial_starts[-1]} trials saved to {args.store_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,14 @@
+def urn_letter(i):
+    """get the letter of the i-th urn, counting from 0: A, B, ..., Z, AA,
+    AB, ..."""
+    letter = ""
+    i += 1
+    while i:
+        i, remainder = divmod(i - 1, 26)
+        letter = chr(ord('A') + remainder) + letter
+    return letter
+
+
 class Conditions:
     """ class of experiment conditions"""
 
@@ -11,6 +22,9 @@ class Conditions:
         self.name = name
         self.urns = urns
         self.urn_positions = self.get_urn_names()
+        self.urn_index = {urn.name: urn for urn in urns}
+        # {urn name: ball color} drawn at the start of the session
+        self.draws = {}
 
     def get_urn_names(self):
         urn_positions = []
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from PyQt6.QtGui import QPixmap
+
+
+class ImageCache:
+    """class of shared cache of decoded and scaled images
+
+    Pixmaps are keyed by path and target size, so every png is decoded
+    from disk once and every scaled variant is built once. The least
+    recently used pixmaps are evicted beyond max_size entries.
+    """
+
+    def __init__(self, max_size=64):
+        """initialize the cache
+
+        Args:
+            max_size: maximum amount of pixmaps kept
+        """
+        self.max_size = max_size
+        self.pixmaps = OrderedDict()
+
+    def pixmap(self, path, width=0, height=0):
+        """get the pixmap of an image, scaled if a size is given
+
+        Args:
+            path: path of the image
+            width: target width, 0 to keep the aspect ratio by height
+            height: target height, 0 to keep the aspect ratio by width
+
+        Returns:
+            pixmap: a QPixmap
+        """
+        key = (path, width, height)
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+            return pixmap
+
+        if not width and not height:
+            pixmap = QPixmap(path)
+        else:
+            source = self.pixmap(path)
+            if not width:
+                pixmap = source.scaledToHeight(height)
+            elif not height:
+                pixmap = source.scaledToWidth(width)
+            else:
+                pixmap = source.scaled(width, height)
+        self.pixmaps[key] = pixmap
+        while len(self.pixmaps) > self.max_size:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
+    def urn_height(self, geo_list, urn_num):
+        """get the height of urn images in a trial
+
+        Args:
+            geo_list: geometric information of the trial
+            urn_num: amount of urns in the trial
+        """
+        return int(geo_list[3] / urn_num)
+
+    def ball_path(self, setting, color):
+        """get the path of the ball image of a color"""
+        return setting.ball_path + color + setting.ball_file_extension
+
+    def warm(self, setting, conditions=None):
+        """decode the urn and ball images used in the experiment
+
+        Call this once at startup, after the QApplication is created.
+
+        Args:
+            setting: setting of the experiment
+            conditions: conditions to warm for, defaulted to
+                        setting.conditions
+        """
+        if conditions is None:
+            conditions = setting.conditions
+        for condition in conditions:
+            height = self.urn_height(setting.trial_geo_list,
+                                     len(condition.urns))
+            for urn in condition.urns:
+                self.pixmap(urn.image_path, height=height)
+                for color in urn.colors:
+                    self.pixmap(self.ball_path(setting, color))
+
+
+# shared by the trials and the experiment window
+image_cache = ImageCache()
@@ -0,0 +1,169 @@
+import json
+import os
+
+
+class DataIndex:
+    """class of sidecar index of the csv data file
+
+    The index remembers how many lines the csv file has and how many bytes
+    of it have been counted, so the sequence of the next participant is
+    known without reading the whole file. Rows appended by other programs
+    are counted by reading only the new tail of the file, and the index is
+    rebuilt from the csv file if it is missing or does not match the file.
+
+    The index also remembers the next participant sequence handed out, so
+    stations that started but have not written their row yet are not
+    given the same sequence again.
+    """
+
+    # amount of bytes before the counted offset used to detect a csv file
+    # rewritten behind the back of the index
+    tail_length = 64
+
+    def __init__(self, data_path):
+        """initialize the index of a csv file
+
+        Args:
+            data_path: csv data file path
+        """
+        self.data_path = data_path
+        self.index_path = data_path + ".idx"
+        self.lines = 0
+        self.size = 0
+        self.tail = ""
+        self.next_seq = 0
+
+    def load(self):
+        """read the sidecar index file
+
+        Returns:
+            True if the index file exists and is readable, else False
+        """
+        try:
+            with open(self.index_path, "r") as index_file:
+                index = json.load(index_file)
+            self.lines = int(index["lines"])
+            self.size = int(index["size"])
+            self.tail = index["tail"]
+            self.next_seq = int(index.get("next_seq", 0))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def save(self):
+        """write the sidecar index file
+
+        The index is written to a temporary file first and then renamed, so
+        readers never see a half-written index.
+        """
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump({"lines": self.lines,
+                       "size": self.size,
+                       "tail": self.tail,
+                       "next_seq": self.next_seq}, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def read_tail(self, data_file, size):
+        """read the bytes right before the offset size
+
+        Args:
+            data_file: csv file opened in binary mode
+            size: offset of the end of the tail
+
+        Returns:
+            the tail as a hex string
+        """
+        start = max(0, size - self.tail_length)
+        data_file.seek(start)
+        return data_file.read(size - start).hex()
+
+    def count_lines(self, data_file, start):
+        """count the complete lines of the csv file from the offset start
+
+        A last line without line break is still being written, so it is
+        left to the next update.
+
+        Args:
+            data_file: csv file opened in binary mode
+            start: offset to start counting from
+
+        Returns:
+            lines: amount of complete lines after start
+            size: offset right after the last complete line
+        """
+        data_file.seek(start)
+        lines = 0
+        size = start
+        offset = start
+        while True:
+            chunk = data_file.read(1 << 20)
+            if not chunk:
+                break
+            count = chunk.count(b"\n")
+            if count:
+                lines += count
+                size = offset + chunk.rindex(b"\n") + 1
+            offset += len(chunk)
+        return lines, size
+
+    def rebuild(self):
+        """count every line of the csv file"""
+        self.lines = 0
+        self.size = 0
+        self.tail = ""
+        self.next_seq = 0
+        self.update()
+
+    def update(self):
+        """count the lines appended since the last update"""
+        with open(self.data_path, "rb") as data_file:
+            lines, size = self.count_lines(data_file, self.size)
+            self.lines += lines
+            self.size = size
+            self.tail = self.read_tail(data_file, self.size)
+
+    def is_stale(self):
+        """check whether the counted part of the csv file was changed
+
+        Returns:
+            True if the index does not match the csv file, else False
+        """
+        if self.size > os.path.getsize(self.data_path):
+            return True
+        with open(self.data_path, "rb") as data_file:
+            return self.read_tail(data_file, self.size) != self.tail
+
+    def sync(self):
+        """make the index consistent with the csv file
+
+        Returns:
+            lines: amount of lines in the csv file
+        """
+        if not os.path.exists(self.data_path):
+            self.lines = 0
+            self.size = 0
+            self.tail = ""
+            self.next_seq = 0
+            return self.lines
+        if not self.load() or self.is_stale():
+            self.rebuild()
+            self.save()
+        elif self.size < os.path.getsize(self.data_path):
+            self.update()
+            self.save()
+        return self.lines
+
+    def allocate(self):
+        """hand out the sequence of the next participant
+
+        Call this while holding the lock of the data file.
+
+        Returns:
+            seq: the sequence, at least the amount of lines in the csv file
+        """
+        self.sync()
+        seq = max(self.next_seq, self.lines)
+        self.next_seq = seq + 1
+        self.save()
+        return seq
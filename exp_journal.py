@@ -0,0 +1,163 @@
+"""write-ahead journal of the participant being recorded
+
+The recorders keep the row of the participant in memory and write it to
+the data file at the end of the session. Every time the row grows
+(demographics, a trial, its animation times) a copy of it is appended to
+a journal file of the station, and the journal is flushed to disk by one
+fsync per interval for all the copies appended in it (group commit), so
+a crash loses at most the last interval. Once the row is in the data
+file, the journal is emptied.
+
+Each journal is locked by its station while open. At startup, the
+journals of stations that are gone are folded into the data file, with
+the rows marked completed=0 (see recover_journals), unless the row of
+the participant reached the data file before the journal was emptied.
+"""
+import glob
+import json
+import os
+import secrets
+import socket
+import threading
+from exp_lock import FileLock
+
+
+def journal_dir(data_path):
+    """get the directory of the journals of a data file"""
+    return data_path + ".journal"
+
+
+class Journals:
+    """class of write-ahead journal of one recorder"""
+
+    def __init__(self, data_path, interval=0.2):
+        """create the journal file of this station and lock it
+
+        Args:
+            data_path: data file path
+            interval: seconds between the fsyncs of the journal, 0 to
+                      fsync every copy
+        """
+        directory = journal_dir(data_path)
+        os.makedirs(directory, exist_ok=True)
+        name = (f"{socket.gethostname()}-{os.getpid()}-"
+                f"{secrets.token_hex(4)}.jsonl")
+        self.path = os.path.join(directory, name)
+        self.interval = interval
+        self.lock = FileLock(self.path + ".lock")
+        self.lock.acquire()
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o666)
+        # appends and fsyncs may happen in the timer thread
+        self.mutex = threading.Lock()
+        self.timer = None
+
+    def append(self, row):
+        """append a copy of the row of the participant
+
+        Args:
+            row: a list of str, as Recorders.ppt_data
+        """
+        data = (json.dumps(row) + "\n").encode("utf-8")
+        with self.mutex:
+            written = os.write(self.fd, data)
+            while written < len(data):
+                written += os.write(self.fd, data[written:])
+            if not self.interval:
+                os.fsync(self.fd)
+            elif self.timer is None:
+                self.timer = threading.Timer(self.interval, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def sync(self):
+        """fsync the copies appended since the last fsync"""
+        with self.mutex:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.fd is not None:
+                os.fsync(self.fd)
+
+    def commit(self):
+        """empty the journal, once the row is in the data file"""
+        with self.mutex:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            os.ftruncate(self.fd, 0)
+            os.fsync(self.fd)
+
+    def close(self):
+        """close the journal, removing it if empty"""
+        self.sync()
+        with self.mutex:
+            empty = os.fstat(self.fd).st_size == 0
+            os.close(self.fd)
+            self.fd = None
+        if empty:
+            os.remove(self.path)
+            remove_quietly(self.lock.lock_path)
+        self.lock.release()
+
+
+def last_row(journal_path):
+    """read the last complete copy of a row in a journal
+
+    Returns:
+        row: a list of str, or None if the journal is empty
+    """
+    row = None
+    with open(journal_path, "rb") as journal_file:
+        for line in journal_file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                row = json.loads(line)
+            except ValueError:
+                break
+    return row
+
+
+def recover_journals(data_path, storage):
+    """fold the journals of stations that are gone into the data file
+
+    Journals still locked by a running station are left alone. The last
+    copy of the row in each journal is written as an incomplete row, if
+    the data file has no row of its sequence yet: a station may have
+    crashed after writing the row but before emptying its journal.
+
+    Args:
+        data_path: data file path
+        storage: storage of the data file, see exp_storage.py
+
+    Returns:
+        rows: the rows recovered, lists of str
+    """
+    recovered = []
+    pattern = os.path.join(journal_dir(data_path), "*.jsonl")
+    for journal_path in sorted(glob.glob(pattern)):
+        lock = FileLock(journal_path + ".lock")
+        if not lock.acquire_nowait():
+            continue
+        try:
+            # another station may have recovered it meanwhile
+            if os.path.exists(journal_path):
+                row = last_row(journal_path)
+                if row is not None and not storage.has_seq(row[0]):
+                    row[2] = "0"
+                    storage.write(row)
+                    recovered.append(row)
+                os.remove(journal_path)
+            remove_quietly(lock.lock_path)
+        finally:
+            lock.release()
+    return recovered
+
+
+def remove_quietly(path):
+    """remove a file, if it still exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,105 @@
+import json
+import time
+from PyQt6.QtCore import QObject, QTimer, Qt
+
+
+def percentile(values, fraction):
+    """get a percentile of a list of numbers, 0 if empty"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize_ms(values_ns):
+    """summarize nanosecond samples in milliseconds"""
+    return {"n": len(values_ns),
+            "p50_ms": percentile(values_ns, 0.5) / 1e6,
+            "p99_ms": percentile(values_ns, 0.99) / 1e6,
+            "max_ms": max(values_ns, default=0) / 1e6}
+
+
+class LatencyMonitors(QObject):
+    """class of monitors of the latency added by the user interface
+
+    Measures how late the event loop runs a precise periodic timer
+    (event-loop delay), how long it takes from a click to the start of the
+    ball animation, and how regularly the animation frames are updated
+    (frame drops). All times are taken with time.perf_counter_ns, the same
+    clock as the response times recorded by the recorders.
+    """
+
+    def __init__(self, tick_ms=5, frame_ms=1000 / 60):
+        """initialize the monitors and start the event-loop probe
+
+        Args:
+            tick_ms: interval of the event-loop probe timer
+            frame_ms: expected interval between animation frames
+        """
+        super().__init__()
+        self.tick_ns = int(tick_ms * 1e6)
+        self.frame_ns = int(frame_ms * 1e6)
+        self.loop_delays = []
+        self.click_delays = []
+        self.frame_intervals = []
+        self.dropped_frames = 0
+        self.frames = 0
+        self.last_tick = time.perf_counter_ns()
+        self.last_frame = 0
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(tick_ms)
+
+    def tick(self):
+        """record how late the probe timer fired"""
+        now = time.perf_counter_ns()
+        self.loop_delays.append(max(0, now - self.last_tick - self.tick_ns))
+        self.last_tick = now
+
+    def click(self, press_ns, anim_start_ns):
+        """record the delay from a click to the start of the animation"""
+        self.click_delays.append(anim_start_ns - press_ns)
+
+    def watch_animation(self, animation):
+        """record the frame updates of an animation
+
+        Args:
+            animation: a QPropertyAnimation about to be started
+        """
+        self.last_frame = 0
+        animation.valueChanged.connect(self.frame)
+
+    def frame(self, value):
+        """record one animation frame"""
+        now = time.perf_counter_ns()
+        if self.last_frame:
+            interval = now - self.last_frame
+            self.frame_intervals.append(interval)
+            # a frame is dropped for every missed frame interval
+            self.dropped_frames += max(0, round(interval / self.frame_ns) - 1)
+        self.frames += 1
+        self.last_frame = now
+
+    def report(self):
+        """get the latency report
+
+        Returns:
+            a dict of summaries, in milliseconds
+        """
+        return {"event_loop_delay": summarize_ms(self.loop_delays),
+                "click_to_animation": summarize_ms(self.click_delays),
+                "animation_frame_interval":
+                    summarize_ms(self.frame_intervals),
+                "animation_frames": self.frames,
+                "animation_dropped_frames": self.dropped_frames}
+
+    def write(self, path):
+        """write the latency report as json
+
+        Args:
+            path: path of the report file
+        """
+        with open(path, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
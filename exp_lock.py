@@ -0,0 +1,134 @@
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """class of advisory inter-process file lock
+
+    Every station writing to the same data file takes this lock before
+    allocating a participant sequence or appending a row. The lock is held
+    on a separate lock file, so readers of the data file are never blocked.
+    """
+
+    def __init__(self, lock_path, timeout=30.0):
+        """initialize the lock
+
+        Args:
+            lock_path: path of the lock file
+            timeout: seconds to wait for the lock before giving up
+        """
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self.fd = None
+        self.depth = 0
+
+    def acquire(self):
+        """acquire the lock, blocking until it is free
+
+        The lock is re-entrant within one recorder, so nested calls only
+        take the lock once.
+        """
+        if self.depth:
+            self.depth += 1
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                self.acquire_windows(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+        self.depth = 1
+
+    def acquire_nowait(self):
+        """acquire the lock only if it is free
+
+        Returns:
+            True if the lock was acquired
+        """
+        if self.depth:
+            self.depth += 1
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        self.fd = fd
+        self.depth = 1
+        return True
+
+    def acquire_windows(self, fd):
+        """acquire the lock with msvcrt, which only retries for 10 seconds
+
+        Args:
+            fd: file descriptor of the lock file
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("could not lock " + self.lock_path)
+                time.sleep(0.01)
+
+    def release(self):
+        """release the lock"""
+        self.depth -= 1
+        if self.depth:
+            return
+        fd = self.fd
+        self.fd = None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def append_line(path, line):
+    """append one line to a file with a single write
+
+    The file is opened in append mode, so concurrent writers never
+    overwrite each other, and the line is written by one system call,
+    flushed to disk and closed before returning.
+
+    Args:
+        path: path of the file
+        line: text to append, including the line break
+    """
+    data = line.encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        written = os.write(fd, data)
+        # a single write may be cut short, e.g. by a signal
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,276 @@
+"""live metrics of a data collection campaign
+
+The recorders and the experiment window update counters and histograms
+as participants go through the experiment, so the progress of a campaign
+can be followed without opening the data file:
+
+    - participants started, completed and incomplete
+    - time spent on every page (consent, demographics, instruction,
+      trial, debrief)
+    - choices of every urn per condition
+    - completed participants per cell of the schedule (see
+      exp_schedule.py) and the spread between the cells, as read from
+      the schedule shared by every station
+    - latency of writing the row of a participant (data_to_csv, or the
+      batch of rows of the server)
+
+The metrics are exported in the Prometheus text format, to a file written
+atomically at most every Settings.metrics_interval seconds (e.g. for the
+textfile collector of the node exporter), and/or by a local HTTP endpoint:
+
+    curl http://127.0.0.1:9464/metrics
+
+Nothing is counted unless Settings.metrics_path or Settings.metrics_port
+is set.
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DWELL_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+WRITE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 1)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "exp_participants_started_total":
+        ("counter", "Participants whose session was started.", None),
+    "exp_participants_completed_total":
+        ("counter", "Participants who completed the experiment.", None),
+    "exp_participants_incomplete_total":
+        ("counter", "Participants recorded without completing the "
+                    "experiment.", None),
+    "exp_page_dwell_seconds":
+        ("histogram", "Time spent on a page of the experiment.",
+         DWELL_BUCKETS),
+    "exp_choices_total":
+        ("counter", "Urns chosen, per condition.", None),
+    "exp_cell_completed_total":
+        ("counter", "Completed participants, per cell of the schedule.",
+         None),
+    "exp_cell_spread":
+        ("gauge", "Most minus least completed participants of the cells "
+                  "of the schedule.", None),
+    "exp_write_seconds":
+        ("histogram", "Time to write the row of a participant.",
+         WRITE_BUCKETS),
+}
+
+
+def escape(value):
+    """escape a label value of the text format"""
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def format_labels(labels, extra=()):
+    """format labels, a tuple of (name, value), e.g. {page="trial"}"""
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"'
+                          for name, value in labels) + "}"
+
+
+class Metrics:
+    """class of counters and histograms of the experiment"""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.interval = 1.0
+        self.last_write = 0.0
+        self.timer = None
+        # (handed out, completed) of every cell, see Schedules.counts
+        self.cell_counts = []
+        self.server = None
+        # updated by the GUI, the server and the HTTP threads
+        self.lock = threading.Lock()
+        # the file is written by the timer thread or at close
+        self.write_lock = threading.Lock()
+        # {(name, labels): value}
+        self.counters = {}
+        # {(name, labels): [count per bucket..., count, sum]}
+        self.histograms = {}
+
+    def configure(self, setting):
+        """start counting if the settings export the metrics
+
+        Only the first settings exporting the metrics are used, e.g. when
+        the server makes a recorder per session.
+
+        Args:
+            setting: setting of the experiment, see Settings.metrics_path
+                     and Settings.metrics_port
+        """
+        if self.enabled:
+            return
+        if setting.metrics_path is None and setting.metrics_port is None:
+            return
+        self.path = setting.metrics_path
+        self.interval = setting.metrics_interval
+        if setting.metrics_port is not None:
+            self.serve(setting.metrics_port)
+        self.enabled = True
+
+    def inc(self, name, labels=(), amount=1):
+        """add to a counter
+
+        Args:
+            name: name of the counter, see METRICS
+            labels: a tuple of (label name, value)
+            amount: amount added
+        """
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """count a value in a histogram
+
+        Args:
+            name: name of the histogram, see METRICS
+            value: observed value, e.g. seconds
+            labels: a tuple of (label name, value)
+        """
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            counts = self.histograms.get(key)
+            if counts is None:
+                counts = [0] * (len(buckets) + 2)
+                self.histograms[key] = counts
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    def set_cells(self, counts):
+        """remember the counts of the cells, read from the schedule by
+        the thread using it
+
+        Args:
+            counts: a list of (handed out, completed), see Schedules.counts
+        """
+        with self.lock:
+            self.cell_counts = list(counts)
+
+    def cell_spread(self):
+        """most minus least completed participants of the cells"""
+        completed = [done for _, done in self.cell_counts]
+        if not completed:
+            return 0
+        return max(completed) - min(completed)
+
+    def render(self):
+        """get the metrics in the Prometheus text format
+
+        Returns:
+            text: a str
+        """
+        lines = []
+        with self.lock:
+            samples = {}
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            for (name, labels), counts in self.histograms.items():
+                samples.setdefault(name, []).append((labels, list(counts)))
+            samples["exp_cell_completed_total"] = [
+                ((("cell", cell),), done)
+                for cell, (_, done) in enumerate(self.cell_counts)]
+            samples["exp_cell_spread"] = [((), self.cell_spread())]
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples.get(name, [])):
+                if kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    le = format_labels(labels, [("le", bound)])
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = format_labels(labels, [("le", "+Inf")])
+                lines.append(f"{name}_bucket{le} {value[-2]}")
+                lines.append(f"{name}_count{format_labels(labels)} "
+                             f"{value[-2]}")
+                lines.append(f"{name}_sum{format_labels(labels)} "
+                             f"{value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """write the metrics file, replacing it atomically"""
+        with self.write_lock:
+            self.timer = None
+            temp_path = self.path + "." + str(os.getpid()) + ".tmp"
+            with open(temp_path, "w") as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(temp_path, self.path)
+            self.last_write = time.monotonic()
+
+    def update(self):
+        """write the metrics file once the interval since the last write
+        has passed, in a timer thread, so the updates of the interval
+        are written together"""
+        if not self.enabled or self.path is None:
+            return
+        with self.write_lock:
+            if self.timer is not None:
+                return
+            delay = self.last_write + self.interval - time.monotonic()
+            self.timer = threading.Timer(max(delay, 0), self.write)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def serve(self, port, host="127.0.0.1"):
+        """serve the metrics on http://host:port/metrics, in a thread
+
+        Returns:
+            the port listened to, e.g. the free port chosen for port 0
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                """requests are not logged"""
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        return self.server.server_address[1]
+
+    def close(self):
+        """write the metrics file a last time and stop serving"""
+        if not self.enabled:
+            return
+        with self.write_lock:
+            if self.timer is not None:
+                self.timer.cancel()
+        if self.path is not None:
+            self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.enabled = False
+
+
+metrics = Metrics()
@@ -0,0 +1,436 @@
+"""compiled plan of the experiment design
+
+The design is declared in a json file (design.json by default, see
+Settings.design_path) instead of being instantiated by hand in
+Settings.set_conditions. The file is validated and compiled once into a
+compact plan: a table of urn specs, the conditions as tuples of urn
+indices, the counterbalancing table of the between-subject design and the
+header of the data. The plan is cached in __plancache__ next to the
+design file, keyed by the hash of the file, so launches load the plan
+instead of expanding and validating the design again.
+
+A design lists its conditions, a factorial design, or both:
+
+    {
+        "colors": ["blue", "red"],
+        "conditions": [
+            {"name": "size2",
+             "urns": [{"name": "urn_2_random", "kind": "random", "size": 2},
+                      {"name": "urn_2_equal", "kind": "fix",
+                       "color_num": [1, 1]}]}
+        ],
+        "factorial": {
+            "sizes": [20, 100],
+            "colors": [["blue", "red"], ["blue", "red", "green", "yellow"]],
+            "pairs": [["random", "equal"]],
+            "condition": "size{size}_{colors}colors",
+            "urn": "urn_{size}_{colors}_{kind}"
+        },
+        "cells": ["size2", "size20_2colors"]
+    }
+
+Urns are "random" (random mixture of size balls), "fix" (the given
+color_num) or "equal" (size balls split equally into the colors). The
+conditions of the factorial design are every size x colors x pair, named
+from the templates. cells is the counterbalancing table, the condition
+of the n-th participant of a between-subject design is the n-th cell in
+turn, defaulted to every condition once. Check and compile a design:
+
+    python exp_plan.py design.json
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+from exp_condition import Conditions
+from exp_recorder import Recorders
+from exp_urn import RandomUrns, FixUrns
+
+# changed whenever the layout of Plans changes, so old caches are ignored
+PLAN_VERSION = 2
+
+URN_KINDS = ("random", "fix", "equal")
+
+
+def make_header(trial_num):
+    """get the header of the data with trial_num trials per participant,
+    see Recorders.get_header"""
+    header = list(Recorders.ppt_info)
+    for i in range(1, trial_num + 1):
+        prefix = str(i) + "_"
+        for info in Recorders.trial_info:
+            header.append(prefix + info)
+    return tuple(header)
+
+
+class Plans:
+    """class of compiled experiment design"""
+
+    def __init__(self, palettes, urns, conditions, cells, digest=""):
+        """
+        Args:
+            palettes: a list of tuples of colors
+            urns: a list of urn specs, (name, kind, palette index, size,
+                  color_num), color_num is None for random urns
+            conditions: a list of (name, tuple of urn indices)
+            cells: counterbalancing table, a list of condition indices
+            digest: hash of the design file
+        """
+        self.palettes = palettes
+        self.urns = urns
+        self.conditions = conditions
+        self.cells = cells
+        self.digest = digest
+        self.headers = {}
+        for trial_num in sorted({1, len(conditions)}):
+            self.headers[trial_num] = make_header(trial_num)
+
+    def compact(self):
+        """get the plan as plain tuples and lists, see __init__"""
+        return (self.palettes, self.urns, self.conditions, self.cells,
+                self.digest)
+
+    def header(self, trial_num):
+        """get the header with trial_num trials per participant
+
+        Returns:
+            a list of str
+        """
+        header = self.headers.get(trial_num)
+        if header is None:
+            header = make_header(trial_num)
+        return list(header)
+
+    def cell(self, existing_ppt):
+        """get the index of the condition of a between-subject participant
+
+        Args:
+            existing_ppt: amount of participants before this one
+
+        Returns:
+            an int, index into the conditions
+        """
+        return self.cells[existing_ppt % len(self.cells)]
+
+    def build(self, rng, image_path, arrange=None):
+        """instantiate the urns and conditions of one session
+
+        Every urn is built in the order of the design, mixing the random
+        urns from rng, then the urns of every condition are arranged in
+        turn, so the session is the same for the same stream.
+
+        Args:
+            rng: the random module or a random.Random object
+            image_path: path of urn image
+            arrange: function putting the urns of a condition in their
+                     positions, in place, called with the urns and the
+                     index of the condition, defaulted to rng.shuffle
+
+        Returns:
+            a list containing condition objects
+        """
+        palettes = [list(colors) for colors in self.palettes]
+        urns = []
+        for name, kind, palette, size, color_num in self.urns:
+            if color_num is None:
+                urns.append(RandomUrns(name, palettes[palette], size,
+                                       image_path, rng))
+            else:
+                urns.append(FixUrns(name, palettes[palette],
+                                    list(color_num), image_path))
+        condition_urns = []
+        for index, (_, indices) in enumerate(self.conditions):
+            members = [urns[i] for i in indices]
+            if arrange is None:
+                rng.shuffle(members)
+            else:
+                arrange(members, index)
+            condition_urns.append(members)
+        return [Conditions(name, members) for (name, _), members
+                in zip(self.conditions, condition_urns)]
+
+
+def check(condition, message, where):
+    if not condition:
+        raise ValueError(f"{where}: {message}")
+
+
+def check_colors(colors, where):
+    check(isinstance(colors, list) and len(colors) >= 2 and
+          all(isinstance(color, str) and color for color in colors),
+          "colors must be a list of at least 2 names", where)
+    check(len(set(colors)) == len(colors), "colors are repeated", where)
+
+
+def urn_spec(spec, colors, where):
+    """validate an urn of the design
+
+    Returns:
+        (name, kind, colors, size, color_num)
+    """
+    check(isinstance(spec, dict), "an urn must be an object", where)
+    name = spec.get("name")
+    check(isinstance(name, str) and name, "an urn needs a name", where)
+    where += ", urn " + name
+    colors = spec.get("colors", colors)
+    check(colors is not None, "no colors", where)
+    check_colors(colors, where)
+    kind = spec.get("kind")
+    check(kind in URN_KINDS, f"kind must be one of {URN_KINDS}", where)
+    if kind == "fix":
+        color_num = spec.get("color_num")
+        check(isinstance(color_num, list) and
+              len(color_num) == len(colors) and
+              all(isinstance(num, int) and num >= 0 for num in color_num),
+              "color_num must have a count per color", where)
+        size = sum(color_num)
+        check(size > 0, "the urn is empty", where)
+        return name, kind, colors, size, tuple(color_num)
+    size = spec.get("size")
+    check(isinstance(size, int) and size > 0,
+          "size must be a positive int", where)
+    if kind == "equal":
+        check(size % len(colors) == 0,
+              f"size {size} can not be split equally into "
+              f"{len(colors)} colors", where)
+        color_num = (size // len(colors),) * len(colors)
+        return name, "fix", colors, size, color_num
+    check(len(colors) - 1 <= size + 1,
+          "more colors than possible mixtures", where)
+    return name, kind, colors, size, None
+
+
+def fill_template(template, fields, where):
+    """fill a name template of the factorial design, e.g. "size{size}" """
+    try:
+        return template.format(**fields)
+    except (KeyError, IndexError, ValueError) as error:
+        raise ValueError(f"{where}: the template {template!r} is not valid "
+                         f"({error!r}), its fields are "
+                         f"{', '.join(sorted(fields))}")
+
+
+def expand_factorial(factorial):
+    """get the conditions of a factorial design, as in "conditions" """
+    where = "factorial"
+    check(isinstance(factorial, dict), "must be an object", where)
+    sizes = factorial.get("sizes")
+    palettes = factorial.get("colors")
+    pairs = factorial.get("pairs", [["random", "equal"]])
+    condition_name = factorial.get("condition", "size{size}")
+    urn_name = factorial.get("urn", "urn_{size}_{kind}")
+    check(isinstance(sizes, list) and sizes, "needs a list of sizes", where)
+    check(isinstance(palettes, list) and palettes,
+          "needs a list of lists of colors", where)
+    check(isinstance(pairs, list) and pairs and
+          all(isinstance(pair, list) and pair for pair in pairs),
+          "pairs must be a list of lists of urn kinds", where)
+    conditions = []
+    for size in sizes:
+        for colors in palettes:
+            check_colors(colors, where)
+            for pair in pairs:
+                fields = {"size": size, "colors": len(colors),
+                          "pair": "_".join(pair)}
+                urns = []
+                for i, kind in enumerate(pair):
+                    check(kind in ("random", "equal"),
+                          "urns of pairs are random or equal", where)
+                    name = fill_template(
+                        urn_name, dict(fields, kind=kind, i=i + 1), where)
+                    urns.append({"name": name, "kind": kind,
+                                 "size": size, "colors": colors})
+                conditions.append(
+                    {"name": fill_template(condition_name, fields, where),
+                     "urns": urns})
+    return conditions
+
+
+def compile_design(design, digest=""):
+    """validate a design and compile it into a plan
+
+    Args:
+        design: the design, a dict as read from the design file
+        digest: hash of the design file
+
+    Returns:
+        a Plans object
+
+    Raises:
+        ValueError: if the design is not valid
+    """
+    check(isinstance(design, dict), "the design must be an object", "design")
+    colors = design.get("colors")
+    specs = list(design.get("conditions", []))
+    if "factorial" in design:
+        specs += expand_factorial(design["factorial"])
+    check(specs, "no conditions", "design")
+
+    palettes = []
+    palette_index = {}
+    urns = []
+    conditions = []
+    condition_index = {}
+    for spec in specs:
+        check(isinstance(spec, dict) and spec.get("name"),
+              "a condition needs a name", "design")
+        where = "condition " + str(spec["name"])
+        check(spec["name"] not in condition_index,
+              "the condition is repeated", where)
+        members = spec.get("urns")
+        check(isinstance(members, list) and len(members) >= 2,
+              "a condition needs at least 2 urns", where)
+        indices = []
+        names = set()
+        for member in members:
+            name, kind, urn_colors, size, color_num = urn_spec(
+                member, spec.get("colors", colors), where)
+            check(name not in names, "urn " + name + " is repeated", where)
+            names.add(name)
+            key = tuple(urn_colors)
+            if key not in palette_index:
+                palette_index[key] = len(palettes)
+                palettes.append(key)
+            indices.append(len(urns))
+            urns.append((name, kind, palette_index[key], size, color_num))
+        condition_index[spec["name"]] = len(conditions)
+        conditions.append((spec["name"], tuple(indices)))
+
+    cells = design.get("cells")
+    if cells is None:
+        cells = list(range(len(conditions)))
+    else:
+        check(isinstance(cells, list) and cells,
+              "cells must be a list of condition names", "design")
+        unknown = [name for name in cells if name not in condition_index]
+        check(not unknown, f"unknown conditions in cells: {unknown}",
+              "design")
+        cells = [condition_index[name] for name in cells]
+    return Plans(palettes, urns, conditions, cells, digest)
+
+
+def compile_plan(design_path, cache_dir=None):
+    """compile a design file to a cached plan, unless already compiled
+
+    The name of the cached plan contains a hash of the design file, so the
+    plan is compiled again whenever the design changes.
+
+    Args:
+        design_path: path of the design file
+        cache_dir: directory of the compiled plans, defaulted to
+                   __plancache__ next to the design file
+
+    Returns:
+        plan_path: path of the cached plan
+
+    Raises:
+        ValueError: if the design is not valid, naming the design file
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(design_path),
+                                 "__plancache__")
+    with open(design_path, "rb") as design_file:
+        data = design_file.read()
+    key = data + repr((PLAN_VERSION, Recorders.ppt_info,
+                       Recorders.trial_info)).encode()
+    digest = hashlib.sha256(key).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(design_path))[0]
+    plan_path = os.path.join(cache_dir,
+                             "plan_" + stem + "_" + digest + ".json")
+    if os.path.exists(plan_path):
+        return plan_path
+
+    plan = read_design(design_path, data, digest)
+    os.makedirs(cache_dir, exist_ok=True)
+    # caches of older versions were pickled
+    for pattern in ("_*.json", "_*.pickle"):
+        for stale_path in glob.glob(os.path.join(cache_dir,
+                                                 "plan_" + stem + pattern)):
+            os.remove(stale_path)
+    temp_path = plan_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "w") as plan_file:
+        # plain data only, the cache directory may be writable by others,
+        # so reading it back must not run any code
+        json.dump(plan.compact(), plan_file)
+    os.replace(temp_path, plan_path)
+    return plan_path
+
+
+def read_design(design_path, data, digest=""):
+    """compile the content of a design file, see compile_design
+
+    Raises:
+        ValueError: if the design is not valid, naming the design file
+    """
+    try:
+        return compile_design(json.loads(data), digest)
+    except ValueError as error:
+        raise ValueError(f"{design_path}: {error}")
+
+
+def read_plan(plan_path):
+    """read a cached plan, see compile_plan
+
+    Args:
+        plan_path: path of the cached plan
+
+    Returns:
+        a Plans object
+
+    Raises:
+        ValueError: if the cached plan is malformed
+    """
+    with open(plan_path, "r") as plan_file:
+        compact = json.load(plan_file)
+    try:
+        palettes, urns, conditions, cells, digest = compact
+        # json keeps tuples as lists
+        return Plans([tuple(palette) for palette in palettes],
+                     [(name, kind, palette, size,
+                       None if color_num is None else tuple(color_num))
+                      for name, kind, palette, size, color_num in urns],
+                     [(name, tuple(indices)) for name, indices in conditions],
+                     list(cells), digest)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"{plan_path}: malformed plan, {error}")
+
+
+def load_plan(design_path):
+    """load the plan of a design file, compiling it if needed
+
+    If the plan can not be cached or the cached plan is malformed, the
+    design is compiled directly.
+
+    Args:
+        design_path: path of the design file
+
+    Returns:
+        a Plans object
+    """
+    try:
+        return read_plan(compile_plan(design_path))
+    except (OSError, ValueError):
+        with open(design_path, "rb") as design_file:
+            return read_design(design_path, design_file.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("design_path", nargs="?", default="design.json")
+    args = parser.parse_args()
+
+    try:
+        plan_path = compile_plan(args.design_path)
+    except ValueError as error:
+        raise SystemExit("invalid design, " + str(error))
+    plan = read_plan(plan_path)
+    print(f"{len(plan.conditions)} conditions, {len(plan.urns)} urns, "
+          f"{len(plan.cells)} cells, {len(plan.header(len(plan.conditions)))}"
+          f" columns within-subject, compiled to {plan_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,153 @@
-import os
+import time
+from exp_journal import Journals, recover_journals
+from exp_metrics import metrics
+from exp_schedule import Schedules
+from exp_storage import open_storage
 
 
 class Recorders:
     """class of recorders of the experiment"""
 
-    def __init__(self, setting):
+    # information recorded for every participant
+    ppt_info = ["sequence",
+                "ID",
+                "completed",
+                "seed",
+                "cell",
+                "age",
+                "gender",
+                "education_level",
+                "race"]
+
+    # information recorded for every trial
+    # times are time.perf_counter_ns() values of the trial onset (page
+    # shown), the button press and the start and finish of the animation
+    # choice_kind is the kind of the chosen urn, "fix" or "random"
+    trial_info = ["condition",
+                  "urn_positions",
+                  "choice",
+                  "choice_kind",
+                  "ball_color",
+                  "onset_ns",
+                  "press_ns",
+                  "anim_start_ns",
+                  "anim_end_ns"]
+
+    def __init__(self, setting, storage=None, schedule=None):
         """initialize the recorders
 
         Args:
             setting: setting of the experiment
+            storage: storage of the data, see exp_storage.py,
+                     defaulted to the storage chosen in the settings,
+                     which is kept with a write-ahead journal (see
+                     exp_journal.py and Settings.journal_interval)
+            schedule: schedule of the cells, see exp_schedule.py,
+                      defaulted to the one next to the data file for the
+                      storage chosen in the settings, else to one in
+                      memory, if setting.counterbalance
+
+        The metrics of the experiment are exported if the settings say so,
+        see exp_metrics.py.
         """
+        metrics.configure(setting)
         self.data_path = setting.data_path
+        self.journal = None
+        schedule_path = None
+        if storage is None:
+            storage = open_storage(setting)
+            schedule_path = self.data_path + ".schedule"
+            if setting.journal_interval is not None:
+                self.journal = Journals(self.data_path,
+                                        setting.journal_interval)
+        if schedule is None and setting.counterbalance:
+            schedule = Schedules(setting.cell_num(), schedule_path)
+        self.storage = storage
+        self.schedule = schedule
+        if metrics.enabled and schedule_path and schedule is not None:
+            metrics.set_cells(schedule.counts())
         self.condition_num = setting.condition_num_per_ppt()
+        self.plan = setting.plan
         self.header = self.get_header()
         self.ppt_seq = 1
         self.init_csv()
+        self.reset_ppt()
+
+    def reset_ppt(self):
+        """reset the information of the participant"""
         self.ppt_id = self.set_id()
         self.ppt_cmplt = 0
+        self.ppt_seed = 0
+        self.ppt_cell = -1
         self.ppt_age = 0
         self.ppt_gender = ""
         self.ppt_edu = ""
         self.ppt_race = ""
         self.ppt_data = [str(self.ppt_seq),
                          str(self.ppt_id),
-                         str(self.ppt_cmplt)]
+                         str(self.ppt_cmplt),
+                         str(self.ppt_seed),
+                         str(self.ppt_cell)]
+
+    def set_seed(self, seed):
+        """record the seed of the random stream of the participant, see
+        Settings.start_session"""
+        self.ppt_seed = seed
+        self.ppt_data[3] = str(self.ppt_seed)
+
+    def set_cell(self, cell):
+        """record the cell of the participant in the balanced schedule,
+        see Settings.start_session"""
+        self.ppt_cell = cell
+        self.ppt_data[4] = str(self.ppt_cell)
+
+    def session_started(self):
+        """count the participant as started, see Settings.start_session"""
+        if metrics.enabled:
+            metrics.inc("exp_participants_started_total")
+
+    def allocate_cell(self):
+        """get the cell of the participant from the schedule
+
+        Returns:
+            an int, -1 if no schedule
+        """
+        if self.schedule is None:
+            return -1
+        return self.schedule.allocate()
+
+    def finish_cell(self, cell, completed):
+        """count the participant in the schedule, or hand the cell out
+        again if the participant did not complete the experiment"""
+        if self.schedule is not None and cell >= 0:
+            self.schedule.finish(cell, completed)
+            # every station counts in the schedule file, the cells of a
+            # schedule written later are counted by its writer
+            if (metrics.enabled
+                    and not getattr(self.schedule, "writes_later", False)):
+                metrics.set_cells(self.schedule.counts())
 
     def init_csv(self):
-        """initialize the csv file
-        create a new csv file if no such file
-        else get the sequence of the participant
+        """initialize the data file
+        create a new data file if no such file,
+        fold the journals of crashed stations into it,
+        then get the sequence of the participant
         """
-        if os.path.exists(self.data_path):
-            self.get_seq()
-        else:
-            data_file = open(self.data_path, 'w')
-            data_file.write(','.join(self.header) + '\n')
-            data_file.close()
+        self.storage.init(self.header)
+        if self.journal:
+            for row in recover_journals(self.data_path, self.storage):
+                # journals of older versions hold the age in this column
+                cell = row[4] if len(row) > 4 else ""
+                if (self.schedule is not None and cell.isdigit()
+                        and int(cell) < self.schedule.cell_num):
+                    self.finish_cell(int(cell), False)
+        self.get_seq()
+
+    def new_participant(self):
+        """get a new sequence and reset the information for the next
+        participant"""
+        self.get_seq()
+        self.reset_ppt()
 
     def set_id(self):
         """The ID is defaulted to the same as participant sequence."""
@@ -48,27 +160,34 @@ class Recorders:
         return lines
 
     def get_seq(self):
-        """get the sequence of current participant"""
-        lines = self.read_csv()
-        current_ppt_seq = len(lines)
+        """get the sequence of current participant
+
+        The sequence is allocated by the storage, so concurrent stations
+        never get the same sequence.
+        """
+        current_ppt_seq = self.storage.allocate_seq()
         self.ppt_seq = current_ppt_seq
 
+    def count_ppt(self):
+        """count the participants already recorded in the data file
+
+        Returns:
+            an int, amount of participants in the data file
+        """
+        return self.storage.count_ppt()
+
     def get_header(self):
-        """set the header based on the condition num for each participant"""
-        header = ["sequence",
-                  "ID",
-                  "completed",
-                  "age",
-                  "gender",
-                  "education_level",
-                  "race"]
-        trial_info = ["condition",
-                      "urn_positions",
-                      "choice",
-                      "ball_color"]
+        """set the header based on the condition num for each participant
+
+        The header is taken from the compiled plan of the design if any,
+        see exp_plan.py.
+        """
+        if self.plan is not None:
+            return self.plan.header(self.condition_num)
+        header = list(self.ppt_info)
         for i in range(1, self.condition_num + 1):
             prefix = str(i) + "_"
-            for info in trial_info:
+            for info in self.trial_info:
                 header.append(prefix + info)
         return header
 
@@ -83,25 +202,92 @@ class Recorders:
         self.ppt_data = [str(self.ppt_seq),
                          str(self.ppt_id),
                          str(self.ppt_cmplt),
+                         str(self.ppt_seed),
+                         str(self.ppt_cell),
                          str(self.ppt_age),
                          self.ppt_gender,
                          self.ppt_edu,
                          self.ppt_race]
+        self.write_journal()
 
     def append_trial_data(self, condition_name, urn_positions, choice,
-                          ball_color):
+                          choice_kind, ball_color, onset_ns=0, press_ns=0):
         """
 
         Args:
             condition_name: name of current condition
             urn_positions: positions (i.e. sequence) of urns
             choice: choice the participant
+            choice_kind: kind of the chosen urn, see Urns.kind
             ball_color: color of the ball drawn by the participant
+            onset_ns: time the trial page was shown
+            press_ns: time the participant pressed the button
 
+        The animation times are filled in by record_animation.
         """
-        self.ppt_data += [condition_name, urn_positions, choice, ball_color]
+        self.ppt_data += [condition_name, urn_positions, choice, choice_kind,
+                          ball_color, str(onset_ns), str(press_ns), "0", "0"]
+        self.write_journal()
+        if metrics.enabled:
+            metrics.inc("exp_choices_total",
+                        (("condition", condition_name), ("urn", choice)))
+
+    def record_animation(self, anim_start_ns, anim_end_ns):
+        """record the animation times of the last trial
+
+        Args:
+            anim_start_ns: time the ball animation started
+            anim_end_ns: time the ball animation finished
+        """
+        self.ppt_data[-2] = str(anim_start_ns)
+        self.ppt_data[-1] = str(anim_end_ns)
+        self.write_journal()
+
+    def write_journal(self):
+        """append a copy of the row to the journal, if any"""
+        if self.journal:
+            self.journal.append(self.ppt_data)
 
     def data_to_csv(self):
-        """append experiment data to csv"""
-        data_file = open(self.data_path, "a")
-        data_file.write(','.join(self.ppt_data) + '\n')
+        """append experiment data to the data file
+
+        For the csv storage the row is appended by a single write under the
+        file lock, then flushed and closed, so rows of concurrent stations
+        never interleave. The journal is emptied once the row is written,
+        and the participant is counted in the schedule and the metrics.
+        """
+        start = time.perf_counter()
+        self.storage.write(self.ppt_data)
+        write_seconds = time.perf_counter() - start
+        if self.journal:
+            self.journal.commit()
+        self.finish_cell(self.ppt_cell, self.ppt_cmplt == 1)
+        if metrics.enabled:
+            # rows written later are timed by their writer
+            if getattr(self.storage, "writes_later", False):
+                write_seconds = None
+            self.count_finished(write_seconds)
+
+    def count_finished(self, write_seconds):
+        """count the participant whose row was written in the metrics
+
+        Args:
+            write_seconds: time taken to write the row, None if not known
+        """
+        if write_seconds is not None:
+            metrics.observe("exp_write_seconds", write_seconds)
+        if self.ppt_cmplt == 1:
+            metrics.inc("exp_participants_completed_total")
+        else:
+            metrics.inc("exp_participants_incomplete_total")
+        metrics.update()
+
+    def close(self):
+        """flush and close the storage, the journal, the schedule and the
+        metrics"""
+        self.storage.close()
+        if self.journal:
+            self.journal.close()
+        metrics.close()
+        if self.schedule is not None:
+            self.schedule.close()
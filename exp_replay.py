@@ -0,0 +1,296 @@
+"""replay of recorded sessions
+
+Every session is randomized from the seed and the cell recorded with
+the data (see Settings.start_session), so the urn positions, the trial
+order and the balls drawn can be generated again from them and the
+choices of the participant. The replayed rows are compared with the
+recorded rows and every difference is reported.
+
+Sessions are replayed headlessly, thousands per second, or through the
+experiment window with synthetic clicks (--window, offscreen by default),
+where the times of the replayed session are new and not compared:
+
+    python exp_replay.py within_data.csv
+    python exp_replay.py within_data.csv --window --limit 20
+"""
+import argparse
+import os
+import time
+from exp_analysis import design_of, iter_rows, read_header
+from exp_binary import BinaryResults, field_of
+from exp_recorder import Recorders
+from exp_setting import Settings
+from exp_storage import MemoryStorage, split_header
+from exp_urn import draw_ball
+
+TIME_FIELDS = ("onset_ns", "press_ns", "anim_start_ns", "anim_end_ns")
+
+
+def iter_recorded(path):
+    """read the recorded rows of a csv or binary data file
+
+    Yields:
+        row: a dict, {column name: value}, without the columns the
+             participant did not reach
+    """
+    if path.endswith(".bin"):
+        results = BinaryResults(path)
+        for row in results:
+            yield dict(zip(results.header, row))
+    else:
+        for row, _ in iter_rows(path):
+            yield row
+
+
+def recorded_design(path):
+    """get the design of a csv or binary data file, see design_of"""
+    if path.endswith(".bin"):
+        header = BinaryResults(path).header
+    else:
+        header, _ = read_header(path)
+    _, _, trial_num = split_header(header)
+    return design_of(path, trial_num)
+
+
+def wait_for_page(window, index, timeout=10.0):
+    """process events until the window leaves the page index
+
+    Returns:
+        time.perf_counter_ns() when the next page was shown
+    """
+    from PyQt6.QtWidgets import QApplication
+
+    deadline = time.perf_counter() + timeout
+    while window.stackedWidget.currentIndex() == index:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"page {index} was not left in {timeout} s")
+        QApplication.processEvents()
+    QApplication.processEvents()
+    return time.perf_counter_ns()
+
+
+class Replays:
+    """class of replays of recorded sessions"""
+
+    def __init__(self, setting):
+        """initialize the replays
+
+        Args:
+            setting: setting of the experiment the data were recorded with
+        """
+        self.setting = setting
+        self.recorder = Recorders(setting, MemoryStorage(keep_rows=False))
+        self.header = self.recorder.header
+        self.replayed = 0
+        self.skipped = 0
+        self.mismatched = 0
+        # (sequence, column, recorded value, replayed value)
+        self.mismatches = []
+        self.elapsed = 0.0
+
+    def start(self, row):
+        """start the session of a recorded participant again"""
+        recorder = self.recorder
+        recorder.ppt_seq = int(row["sequence"])
+        recorder.reset_ppt()
+        recorder.ppt_id = row["ID"]
+        recorder.ppt_data[1] = row["ID"]
+        # recorded before the cell was recorded with the data, or without
+        # schedule
+        cell = int(row.get("cell") or -1)
+        self.setting.start_session(recorder, int(row["seed"]), cell)
+
+    def replay_headless(self, row):
+        """regenerate the row of a recorded participant
+
+        Args:
+            row: a recorded row, see iter_recorded
+
+        Returns:
+            the replayed row, a list of str
+        """
+        self.start(row)
+        recorder = self.recorder
+        if "age" in row:
+            recorder.ppt_age = row["age"]
+            recorder.ppt_gender = row["gender"]
+            recorder.ppt_edu = row["education_level"]
+            recorder.ppt_race = row["race"]
+            recorder.append_demographics()
+        for i, condition in enumerate(self.setting.order, 1):
+            prefix = str(i) + "_"
+            choice = row.get(prefix + "choice")
+            if not row.get(prefix + "condition") or choice is None:
+                break
+            if choice in condition.urn_index:
+                ball_color = draw_ball(condition, choice)
+                choice_kind = condition.urn_index[choice].kind
+            else:
+                ball_color = ""
+                choice_kind = ""
+            recorder.append_trial_data(condition.name,
+                                       condition.urn_positions,
+                                       choice,
+                                       choice_kind,
+                                       ball_color,
+                                       row.get(prefix + "onset_ns", "0"),
+                                       row.get(prefix + "press_ns", "0"))
+            recorder.record_animation(row.get(prefix + "anim_start_ns", "0"),
+                                      row.get(prefix + "anim_end_ns", "0"))
+        if row.get("completed") == "1":
+            recorder.completed()
+        return recorder.ppt_data
+
+    def replay_window(self, row):
+        """replay a recorded participant through the experiment window,
+        clicking the recorded answers and urns
+
+        Args:
+            row: a recorded row, see iter_recorded
+
+        Returns:
+            the replayed row, a list of str
+        """
+        # imported here, so headless replays do not need PyQt
+        from exp_window import ExperimentWindow
+
+        self.start(row)
+        window = ExperimentWindow(self.setting.set_trials(), self.setting,
+                                  self.recorder)
+        window.show()
+        pages = []
+        if "age" in row:
+            window.checkBox.setChecked(True)
+            window.age.setValue(int(row["age"]))
+            window.gender.setCurrentText(row["gender"])
+            window.education.setCurrentText(row["education_level"])
+            window.race.setCurrentText(row["race"])
+            pages = [window.pushButton_1, window.pushButton_2,
+                     window.pushButton_3]
+        for button in pages:
+            index = window.stackedWidget.currentIndex()
+            button.click()
+            wait_for_page(window, index)
+        for i in range(1, len(window.trials) + 1):
+            choice = row.get(str(i) + "_choice")
+            trial = window.current_trial() if pages else None
+            if trial is None or choice not in trial.button_index:
+                break
+            index = window.stackedWidget.currentIndex()
+            trial.button_index[choice].click()
+            wait_for_page(window, index)
+        window.close()
+        window.deleteLater()
+        return self.recorder.ppt_data
+
+    def compare(self, row, replayed, ignored=()):
+        """compare a recorded row with its replay
+
+        Args:
+            row: a recorded row, see iter_recorded
+            replayed: the replayed row, a list of str
+            ignored: fields not compared, e.g. TIME_FIELDS
+
+        Returns:
+            True if the rows are the same
+        """
+        replayed = dict(zip(self.header, replayed))
+        same = True
+        for name in self.header:
+            if field_of(name) in ignored:
+                continue
+            if name not in row and (
+                    name in Recorders.ppt_info or
+                    field_of(name) == "choice_kind" and
+                    "1_choice_kind" not in row):
+                # recorded before the column was recorded with the data
+                continue
+            recorded_value = row.get(name)
+            replayed_value = replayed.get(name)
+            if recorded_value != replayed_value:
+                self.mismatches.append((row.get("sequence"), name,
+                                        recorded_value, replayed_value))
+                same = False
+        return same
+
+    def run(self, rows, window=False, limit=None):
+        """replay recorded rows and compare them
+
+        Args:
+            rows: recorded rows, see iter_recorded
+            window: True to replay through the experiment window
+            limit: maximum amount of sessions replayed, None for all
+        """
+        start = time.perf_counter()
+        for row in rows:
+            if limit is not None and self.replayed >= limit:
+                break
+            if not row.get("seed"):
+                # recorded before the seed was recorded with the data
+                self.skipped += 1
+                continue
+            if window:
+                try:
+                    replayed = self.replay_window(row)
+                except RuntimeError as error:
+                    # e.g. a recorded answer the window does not offer
+                    self.mismatches.append((row.get("sequence"), "page",
+                                            "", str(error)))
+                    self.replayed += 1
+                    self.mismatched += 1
+                    continue
+                same = self.compare(row, replayed, TIME_FIELDS)
+            else:
+                replayed = self.replay_headless(row)
+                same = self.compare(row, replayed)
+            self.replayed += 1
+            self.mismatched += not same
+        self.elapsed += time.perf_counter() - start
+
+    def rate(self):
+        """sessions replayed per minute"""
+        if not self.elapsed:
+            return 0.0
+        return self.replayed / self.elapsed * 60
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_path", help="csv or binary (.bin) data file")
+    parser.add_argument("--window", action="store_true",
+                        help="replay through the experiment window")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--anim-ms", type=int, default=1,
+                        help="duration of the ball animation with --window")
+    parser.add_argument("--show", type=int, default=20,
+                        help="amount of mismatches printed")
+    args = parser.parse_args()
+
+    setting = Settings()
+    setting.between = recorded_design(args.data_path) == "between"
+    setting.data_path = args.data_path
+    setting.anim_duration = args.anim_ms
+    replays = Replays(setting)
+    if args.window:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt6.QtWidgets import QApplication
+        app = QApplication([])
+    replays.run(iter_recorded(args.data_path), args.window, args.limit)
+    if args.window:
+        app.quit()
+
+    print(f"{replays.replayed} sessions replayed in {replays.elapsed:.2f} s "
+          f"({replays.rate():.0f} sessions/min), {replays.skipped} without "
+          f"seed skipped, {replays.mismatched} mismatched")
+    for sequence, name, recorded_value, replayed_value in \
+            replays.mismatches[:args.show]:
+        print(f"  participant {sequence}, {name}: recorded "
+              f"{recorded_value!r}, replayed {replayed_value!r}")
+    if replays.mismatched:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
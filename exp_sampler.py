@@ -0,0 +1,165 @@
+"""samplers of balls from urns with many colors and many balls
+
+AliasTables draws with replacement in constant time, whatever the amount
+of colors, from a table built once per composition of an urn (Vose's
+alias method, in integer arithmetic so the probabilities are exact for
+any amount of balls). BallBags draws without replacement in logarithmic
+time, keeping the balls left of each color in a Fenwick tree.
+
+Both take the random number generator to use, the random module or a
+random.Random object, see Urns.draw in exp_urn.py.
+"""
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class AliasTables:
+    """class of alias table of one composition of an urn"""
+
+    def __init__(self, color_num):
+        """build the table
+
+        Args:
+            color_num: a list containing int indicating the amount of each
+                       color
+        """
+        n = len(color_num)
+        total = sum(color_num)
+        if n == 0 or total <= 0:
+            raise ValueError("an urn without balls")
+        # color i is kept with probability prob[i] / total, or else its
+        # alias is drawn, so every column of the table weighs total / n
+        scaled = [num * n for num in color_num]
+        self.prob = [total] * n
+        self.alias = list(range(n))
+        self.total = total
+        small = [i for i in range(n) if scaled[i] < total]
+        large = [i for i in range(n) if scaled[i] >= total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= total - scaled[less]
+            if scaled[more] < total:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rng=random):
+        """draw one ball
+
+        Args:
+            rng: the random module or a random.Random object
+
+        Returns:
+            index of the color
+        """
+        i, x = divmod(rng.randrange(len(self.prob) * self.total), self.total)
+        return i if x < self.prob[i] else self.alias[i]
+
+    def sample_batch(self, batch, rng=None):
+        """draw batch balls at once, with NumPy
+
+        Args:
+            batch: amount of draws
+            rng: a numpy.random.Generator, defaulted to a new one
+
+        Returns:
+            an int array of shape (batch,), indices of the colors
+        """
+        if np is None:
+            raise ImportError("batch sampling needs NumPy")
+        if rng is None:
+            rng = np.random.default_rng()
+        prob = np.asarray(self.prob, dtype=np.int64)
+        alias = np.asarray(self.alias, dtype=np.int64)
+        i = rng.integers(0, len(prob), batch)
+        x = rng.integers(0, self.total, batch)
+        return np.where(x < prob[i], i, alias[i])
+
+
+# alias tables shared by urns of the same composition, as urns are built
+# again for every participant
+table_cache = {}
+TABLE_CACHE_SIZE = 4096
+
+
+def alias_table(color_num):
+    """get the alias table of a composition, built once
+
+    Args:
+        color_num: a list containing int indicating the amount of each
+                   color
+
+    Returns:
+        an AliasTables object
+    """
+    key = tuple(color_num)
+    table = table_cache.get(key)
+    if table is None:
+        if len(table_cache) >= TABLE_CACHE_SIZE:
+            table_cache.clear()
+        table = table_cache[key] = AliasTables(key)
+    return table
+
+
+class BallBags:
+    """class of balls left in an urn drawn without replacement"""
+
+    def __init__(self, color_num):
+        """put every ball in the bag
+
+        Args:
+            color_num: a list containing int indicating the amount of each
+                       color
+        """
+        self.size = len(color_num)
+        self.left = sum(color_num)
+        # tree[i] holds the balls of the colors i - lowbit(i) + 1 .. i
+        self.tree = [0] + list(color_num)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+        self.top = 1
+        while self.top * 2 <= self.size:
+            self.top *= 2
+
+    def __len__(self):
+        return self.left
+
+    def sample(self, rng=random):
+        """draw one ball and keep it out of the bag
+
+        Args:
+            rng: the random module or a random.Random object
+
+        Returns:
+            index of the color
+        """
+        if self.left <= 0:
+            raise ValueError("no balls left in the urn")
+        ball = rng.randrange(self.left)
+        # find the color of the ball by walking down the tree
+        i = 0
+        step = self.top
+        while step:
+            if i + step <= self.size and self.tree[i + step] <= ball:
+                i += step
+                ball -= self.tree[i]
+            step //= 2
+        color = i
+        i += 1
+        while i <= self.size:
+            self.tree[i] -= 1
+            i += i & -i
+        self.left -= 1
+        return color
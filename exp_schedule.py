@@ -0,0 +1,232 @@
+"""balanced counterbalancing schedule of the participants
+
+Every participant is assigned a cell of the design instead of a shuffled
+trial order and urn positions:
+
+    - within-subject, the trial order is a row of a balanced Latin square
+      (Williams design), so every condition is presented at every
+      position, and right after every other condition, equally often
+    - between-subject, the condition is an entry of the counterbalancing
+      table of the plan (see exp_plan.py)
+    - the urns of every condition are rotated to a row of a cyclic Latin
+      square, so every urn is shown at every position equally often, the
+      row offset by the index of the condition, so the order of the urns
+      also changes between the trials of a participant
+
+cell = group * position_num + position row, where the group is the row
+of the trial orders or the entry of the counterbalancing table.
+
+Cells are handed out in turn from a counter table persisted next to the
+data file and shared by the stations under a file lock. The cell of a
+participant who did not complete the experiment is queued and handed out
+again before the next new cell, so the completed participants stay
+balanced. Allocating a cell reads and writes a few fixed-width records,
+whatever the amount of cells and participants. Print the balance:
+
+    python exp_schedule.py within_data.csv.schedule
+"""
+import argparse
+import contextlib
+import io
+import math
+import os
+import struct
+from exp_lock import FileLock
+
+MAGIC = b"EXPSCH1\n"
+# magic, amount of cells, next new cell, head and tail of the queue of
+# cells to hand out again
+HEAD = struct.Struct("<8sqqqq")
+# participants the cell was handed out to, completed participants
+COUNTS = struct.Struct("<qq")
+QUEUED = struct.Struct("<q")
+
+
+def williams_rows(n):
+    """amount of rows of the balanced Latin square of n conditions"""
+    if n > 1 and n % 2:
+        return 2 * n
+    return n
+
+
+def williams_order(n, row):
+    """get a row of the balanced Latin square of n conditions
+
+    The first row is 0, 1, n-1, 2, n-2, ..., the next rows add the row
+    number to it, and for an odd n the rows are followed by their
+    reverses.
+
+    Args:
+        n: amount of conditions
+        row: row number, from 0 to williams_rows(n) - 1
+
+    Returns:
+        a list of condition indices, in the order presented
+    """
+    first = [0]
+    low, high = 1, n - 1
+    while low <= high:
+        first.append(low)
+        low += 1
+        if low <= high:
+            first.append(high)
+            high -= 1
+    order = [(index + row) % n for index in first]
+    if row >= n:
+        order.reverse()
+    return order
+
+
+def position_num(urn_nums):
+    """amount of rows of urn positions, balanced for every condition
+
+    Args:
+        urn_nums: amount of urns of every condition
+
+    Returns:
+        the least common multiple of the amounts of urns
+    """
+    rows = 1
+    for urn_num in urn_nums:
+        rows = rows * urn_num // math.gcd(rows, urn_num)
+    return rows
+
+
+def rotate(urns, row):
+    """rotate urns, in place, to a row of the cyclic Latin square"""
+    shift = row % len(urns)
+    urns[:] = urns[shift:] + urns[:shift]
+
+
+class Schedules:
+    """class of counter table of the cells"""
+
+    def __init__(self, cell_num, path=None):
+        """open the counter table, creating it if no such file
+
+        Args:
+            cell_num: amount of cells of the design, see Settings.cell_num
+            path: counter table file path, None to keep it in memory
+        """
+        self.cell_num = cell_num
+        self.path = path
+        if path is None:
+            self.file = io.BytesIO()
+            self.lock = contextlib.nullcontext()
+        else:
+            self.lock = FileLock(path + ".lock")
+            with self.lock:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+                self.file = os.fdopen(fd, "r+b", buffering=0)
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            if self.file.tell() == 0:
+                self.file.write(HEAD.pack(MAGIC, cell_num, 0, 0, 0) +
+                                bytes(COUNTS.size * cell_num))
+            magic, stored_num, _, _, _ = self.read_head()
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a schedule")
+        if stored_num != cell_num:
+            raise ValueError(f"{path} has {stored_num} cells, the design "
+                             f"has {cell_num}; remove it to start a new "
+                             f"schedule")
+
+    def read_head(self):
+        self.file.seek(0)
+        return HEAD.unpack(self.file.read(HEAD.size))
+
+    def write_head(self, next_cell, head, tail):
+        self.file.seek(0)
+        self.file.write(HEAD.pack(MAGIC, self.cell_num, next_cell, head,
+                                  tail))
+
+    def add_counts(self, cell, issued, completed):
+        offset = HEAD.size + cell * COUNTS.size
+        self.file.seek(offset)
+        counts = COUNTS.unpack(self.file.read(COUNTS.size))
+        self.file.seek(offset)
+        self.file.write(COUNTS.pack(counts[0] + issued,
+                                    counts[1] + completed))
+
+    def queued_offset(self, i):
+        return HEAD.size + self.cell_num * COUNTS.size + i * QUEUED.size
+
+    def allocate(self):
+        """hand out the cell of the next participant
+
+        Returns:
+            an int, from 0 to cell_num - 1
+        """
+        with self.lock:
+            _, _, next_cell, head, tail = self.read_head()
+            if head < tail:
+                self.file.seek(self.queued_offset(head))
+                cell, = QUEUED.unpack(self.file.read(QUEUED.size))
+                head += 1
+                if head == tail:
+                    # the queue is drained, reuse its space
+                    head = tail = 0
+            else:
+                cell = next_cell % self.cell_num
+                next_cell += 1
+            self.write_head(next_cell, head, tail)
+            self.add_counts(cell, 1, 0)
+        return cell
+
+    def finish(self, cell, completed):
+        """count a completed participant, or queue the cell to be handed
+        out again
+
+        Args:
+            cell: cell of the participant
+            completed: True if the participant completed all the trials
+        """
+        with self.lock:
+            if completed:
+                self.add_counts(cell, 0, 1)
+                return
+            _, _, next_cell, head, tail = self.read_head()
+            if head == tail:
+                head = tail = 0
+            self.file.seek(self.queued_offset(tail))
+            self.file.write(QUEUED.pack(cell))
+            self.write_head(next_cell, head, tail + 1)
+
+    def counts(self):
+        """get the counts of every cell
+
+        Returns:
+            a list of (participants handed the cell, completed)
+        """
+        with self.lock:
+            self.file.seek(HEAD.size)
+            data = self.file.read(COUNTS.size * self.cell_num)
+        return list(COUNTS.iter_unpack(data))
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("schedule_path")
+    args = parser.parse_args()
+
+    with open(args.schedule_path, "rb") as schedule_file:
+        _, cell_num, _, head, tail = HEAD.unpack(
+            schedule_file.read(HEAD.size))
+    schedule = Schedules(cell_num, args.schedule_path)
+    counts = schedule.counts()
+    schedule.close()
+    completed = [done for _, done in counts]
+    for cell, (issued, done) in enumerate(counts):
+        print(f"cell {cell}: {issued} handed out, {done} completed")
+    print(f"{cell_num} cells, {sum(completed)} completed, from "
+          f"{min(completed)} to {max(completed)} per cell, "
+          f"{tail - head} cells queued to be handed out again")
+
+
+if __name__ == "__main__":
+    main()
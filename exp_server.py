@@ -0,0 +1,575 @@
+"""asyncio session server of the experiment
+
+Hosts the flow of the experiment window (consent, demographics,
+instruction, the trials of Settings.set_trials and the debrief) for many
+concurrent participants from one process, so a station only needs a
+browser or a thin client. Requests and responses are JSON over HTTP/1.1
+with keep-alive:
+
+    POST   /sessions                  start a session
+    GET    /sessions/<id>             current page
+    POST   /sessions/<id>/consent     {"agree": true}
+    POST   /sessions/<id>/demographics
+                                      {"age": 20, "gender": "Female",
+                                       "education_level": "...",
+                                       "race": "..."}
+    POST   /sessions/<id>/start       leave the instruction page
+    POST   /sessions/<id>/choose      {"urn": "urn_2_random"}
+    DELETE /sessions/<id>             quit, recording what was done
+
+Sessions without a request for --idle-timeout seconds are quit the same
+way, so an abandoned session hands its cell of the schedule out again.
+
+Every session has its own settings and recorder, and all the rows,
+sequences and cells of the schedule go through one writer thread, so the
+data file has a single serialized writer:
+
+    python exp_server.py --port 8765 --storage csv
+"""
+import argparse
+import asyncio
+import copy
+import json
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from exp_condition import urn_letter
+from exp_metrics import metrics
+from exp_recorder import Recorders
+from exp_schedule import Schedules
+from exp_setting import Settings
+from exp_storage import MemoryStorage, open_storage
+from exp_urn import draw_ball
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Content Too Large"}
+
+# the answers and the clicks of a session are small, larger requests are
+# refused before they are read
+MAX_BODY = 64 * 1024
+MAX_HEADERS = 100
+
+
+class QueuedStorage:
+    """class of storage of one session, handing its row to the writer of
+    the server (see the storage interface in exp_storage.py)"""
+
+    # the row is timed when the writer writes it, see write_batch
+    writes_later = True
+
+    def __init__(self, server, seq):
+        """
+        Args:
+            server: the SessionServers object writing the data file
+            seq: sequence allocated for the session by the writer
+        """
+        self.server = server
+        self.seq = seq
+
+    def init(self, header):
+        """the data file is initialized by the server"""
+
+    def allocate_seq(self):
+        return self.seq
+
+    def count_ppt(self):
+        # the storage is only used in the writer thread
+        return self.server.executor.submit(
+            self.server.storage.count_ppt).result()
+
+    def write(self, row):
+        self.server.rows.put_nowait(list(row))
+
+    def flush(self):
+        """rows are written by the server, nothing to flush"""
+
+    def close(self):
+        """rows are written by the server, nothing to close"""
+
+
+class QueuedSchedules:
+    """class of schedule of one session, handing its counts to the writer
+    of the server (see exp_schedule.py)"""
+
+    # the cells are counted in the metrics by the writer, see finish_cell
+    writes_later = True
+
+    def __init__(self, server):
+        """
+        Args:
+            server: the SessionServers object keeping the schedule
+        """
+        self.server = server
+
+    def allocate(self):
+        raise RuntimeError("cells are allocated by the server")
+
+    def finish(self, cell, completed):
+        self.server.executor.submit(self.server.finish_cell, cell,
+                                    completed)
+
+    def close(self):
+        """the schedule is closed by the server"""
+
+
+class RequestErrors(Exception):
+    """class of errors answered to the client"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Sessions:
+    """class of the session of one participant"""
+
+    def __init__(self, session_id, setting, recorder):
+        self.session_id = session_id
+        self.setting = setting
+        self.recorder = recorder
+        self.trials = setting.order
+        # "consent", "demographics", "instruction", "trial" or "debrief"
+        self.page = "consent"
+        self.trial_index = 0
+        self.onset_ns = 0
+        self.last_seen = time.monotonic()
+
+    def state(self):
+        """get the current page, as sent to the client"""
+        state = {"session": self.session_id,
+                 "sequence": self.recorder.ppt_seq,
+                 "page": self.page}
+        if self.page == "trial":
+            condition = self.trials[self.trial_index]
+            state["trial"] = self.trial_index + 1
+            state["trials"] = len(self.trials)
+            state["condition"] = condition.name
+            state["urns"] = [
+                {"name": urn.name,
+                 "instruction": urn.set_instruction(
+                     "Urn " + urn_letter(i))}
+                for i, urn in enumerate(condition.urns)]
+        return state
+
+    def expect(self, page):
+        if self.page != page:
+            raise RequestErrors(400, f"the session is on the {self.page} "
+                                     f"page, not {page}")
+
+    def consent(self, body):
+        self.expect("consent")
+        if body.get("agree") is not True:
+            raise RequestErrors(400, "Please tick the check box.")
+        self.page = "demographics"
+
+    def demographics(self, body):
+        """check and record the answers, as ExperimentWindow.to_trials"""
+        self.expect("demographics")
+        try:
+            age = int(body.get("age", 0))
+        except (TypeError, ValueError):
+            raise RequestErrors(400, "age must be a number")
+        if age < self.setting.min_age:
+            raise RequestErrors(400, "Sorry, you are not eligible for this "
+                                     "experiment for the reason of age.")
+        for name in ["gender", "education_level", "race"]:
+            if not body.get(name):
+                raise RequestErrors(400, f"Please fill in {name} "
+                                         f"information.")
+        recorder = self.recorder
+        recorder.ppt_age = age
+        recorder.ppt_gender = str(body["gender"])
+        recorder.ppt_edu = str(body["education_level"])
+        recorder.ppt_race = str(body["race"])
+        recorder.append_demographics()
+        self.page = "instruction"
+
+    def start(self, body):
+        self.expect("instruction")
+        self.page = "trial"
+        self.onset_ns = time.perf_counter_ns()
+
+    def choose(self, body):
+        """record the chosen urn and draw a ball, as
+        ExperimentWindow.choose_urn
+
+        Returns:
+            ball_color: color of the ball drawn
+        """
+        press_ns = time.perf_counter_ns()
+        self.expect("trial")
+        condition = self.trials[self.trial_index]
+        urn_name = body.get("urn")
+        if urn_name not in condition.urn_index:
+            raise RequestErrors(400, f"no urn {urn_name!r} in this trial")
+        ball_color = draw_ball(condition, urn_name)
+        self.recorder.append_trial_data(condition.name,
+                                        condition.urn_positions,
+                                        urn_name,
+                                        condition.urn_index[urn_name].kind,
+                                        ball_color,
+                                        self.onset_ns,
+                                        press_ns)
+        self.trial_index += 1
+        if self.trial_index == len(self.trials):
+            self.page = "debrief"
+            self.recorder.completed()
+            self.recorder.data_to_csv()
+        else:
+            self.onset_ns = time.perf_counter_ns()
+        return ball_color
+
+    def quit(self):
+        """record what was done, as ExperimentWindow.closeEvent"""
+        if self.recorder.ppt_cmplt != 1:
+            self.recorder.data_to_csv()
+
+
+class SessionServers:
+    """class of the asyncio server of the sessions"""
+
+    def __init__(self, setting, storage=None, idle_timeout=1800):
+        """
+        Args:
+            setting: setting of the experiment, copied for every session
+            storage: storage of the data, see exp_storage.py, defaulted to
+                     the storage chosen in the settings, opened in the
+                     writer thread by start, with the schedule of the
+                     cells next to the data file (else in memory)
+            idle_timeout: seconds without a request after which a session
+                          is quit, None to keep the sessions until stop
+        """
+        self.setting = setting
+        self.idle_timeout = idle_timeout
+        schedule_path = None
+        if storage is None:
+            schedule_path = setting.data_path + ".schedule"
+        self.storage = storage
+        self.schedule = None
+        if setting.counterbalance:
+            self.schedule = Schedules(setting.cell_num(), schedule_path)
+        self.header = Recorders(
+            setting, MemoryStorage(keep_rows=False)).header
+        # every call to the storage runs in this one thread, in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.rows = None
+        self.writer = None
+        self.reaper = None
+        self.server = None
+        # {session id: Sessions}
+        self.sessions = {}
+
+    async def call(self, function, *args):
+        """run a call to the storage in the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    def finish_cell(self, cell, completed):
+        """count a participant in the schedule, in the writer thread"""
+        self.schedule.finish(cell, completed)
+        if metrics.enabled:
+            metrics.set_cells(self.schedule.counts())
+
+    def write_batch(self, rows):
+        """write the rows queued since the last write, in the writer
+        thread
+
+        Every row of the batch is counted in the metrics with the time
+        taken to write the batch.
+        """
+        start = time.perf_counter()
+        write_rows = getattr(self.storage, "write_rows", None)
+        if write_rows is not None:
+            write_rows(rows)
+        else:
+            for row in rows:
+                self.storage.write(row)
+        self.storage.flush()
+        if metrics.enabled:
+            write_seconds = time.perf_counter() - start
+            for _ in rows:
+                metrics.observe("exp_write_seconds", write_seconds)
+            metrics.update()
+
+    async def write_rows(self):
+        """the single writer task of the data file"""
+        while True:
+            rows = [await self.rows.get()]
+            while not self.rows.empty():
+                rows.append(self.rows.get_nowait())
+            try:
+                await self.call(self.write_batch, rows)
+            finally:
+                for _ in rows:
+                    self.rows.task_done()
+
+    def quit_session(self, session):
+        """quit a session, recording what was done, and forget it"""
+        session.quit()
+        del self.sessions[session.session_id]
+
+    async def expire_sessions(self):
+        """quit the sessions idle for longer than idle_timeout"""
+        while True:
+            await asyncio.sleep(min(self.idle_timeout / 4, 60))
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                if now - session.last_seen > self.idle_timeout:
+                    self.quit_session(session)
+
+    async def start(self, host="127.0.0.1", port=8765):
+        """initialize the data file and start listening
+
+        Returns:
+            the port listened to, e.g. the free port chosen for port 0
+        """
+        self.rows = asyncio.Queue()
+        if self.storage is None:
+            # e.g. a SQLite connection is only usable in its own thread
+            self.storage = await self.call(open_storage, self.setting)
+        await self.call(self.storage.init, self.header)
+        if metrics.enabled and self.schedule is not None:
+            metrics.set_cells(await self.call(self.schedule.counts))
+        self.writer = asyncio.create_task(self.write_rows())
+        if self.idle_timeout is not None:
+            self.reaper = asyncio.create_task(self.expire_sessions())
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """stop listening, record the open sessions and write every row"""
+        self.server.close()
+        await self.server.wait_closed()
+        if self.reaper is not None:
+            self.reaper.cancel()
+        for session in list(self.sessions.values()):
+            session.quit()
+        self.sessions = {}
+        await self.rows.join()
+        self.writer.cancel()
+        await self.call(self.storage.close)
+        metrics.close()
+        if self.schedule is not None:
+            await self.call(self.schedule.close)
+        self.executor.shutdown()
+
+    async def new_session(self):
+        seq = await self.call(self.storage.allocate_seq)
+        cell = -1
+        schedule = None
+        if self.schedule is not None:
+            cell = await self.call(self.schedule.allocate)
+            schedule = QueuedSchedules(self)
+        setting = copy.copy(self.setting)
+        recorder = Recorders(setting, QueuedStorage(self, seq), schedule)
+        setting.start_session(recorder, cell=cell)
+        session_id = secrets.token_hex(8)
+        session = Sessions(session_id, setting, recorder)
+        self.sessions[session_id] = session
+        return session
+
+    async def route(self, method, path, body):
+        """answer one request
+
+        Returns:
+            a dict sent to the client as JSON
+        """
+        parts = [part for part in path.split("/") if part]
+        if parts == ["sessions"]:
+            if method != "POST":
+                raise RequestErrors(405, "use POST to start a session")
+            session = await self.new_session()
+            return session.state()
+        if len(parts) < 2 or parts[0] != "sessions":
+            raise RequestErrors(404, "no such resource")
+        session = self.sessions.get(parts[1])
+        if session is None:
+            raise RequestErrors(404, "no such session")
+        session.last_seen = time.monotonic()
+        if len(parts) == 2:
+            if method == "GET":
+                return session.state()
+            if method == "DELETE":
+                self.quit_session(session)
+                return {"session": session.session_id, "page": "closed"}
+            raise RequestErrors(405, "use GET or DELETE on a session")
+        if method != "POST" or len(parts) != 3:
+            raise RequestErrors(404, "no such resource")
+        action = parts[2]
+        if action == "consent":
+            session.consent(body)
+        elif action == "demographics":
+            session.demographics(body)
+        elif action == "start":
+            session.start(body)
+        elif action == "choose":
+            ball_color = session.choose(body)
+            state = session.state()
+            state["ball_color"] = ball_color
+            if session.page == "debrief":
+                del self.sessions[session.session_id]
+            return state
+        else:
+            raise RequestErrors(404, "no such action: " + action)
+        return session.state()
+
+    async def handle(self, reader, writer):
+        """serve the requests of one connection, with keep-alive"""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except RequestErrors as error:
+                    # the rest of the connection can not be parsed
+                    writer.write(encode_response(
+                        error.status, {"error": str(error)}, False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, data = request
+                try:
+                    body = parse_body(data)
+                    status, answer = 200, await self.route(method, path,
+                                                           body)
+                except RequestErrors as error:
+                    status, answer = error.status, {"error": str(error)}
+                keep_alive = headers.get("connection", "") != "close"
+                writer.write(encode_response(status, answer, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    """read one HTTP request
+
+    Returns:
+        method, path, headers (lower case names), body bytes,
+        or None at the end of the connection
+
+    Raises:
+        RequestErrors: if the request line or a header is malformed or
+                       too long (400), or the body is too large (413)
+    """
+    line = await read_line(reader)
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise RequestErrors(400, "malformed request line")
+    headers = {}
+    for _ in range(MAX_HEADERS + 1):
+        line = await read_line(reader)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise RequestErrors(400, "too many headers")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise RequestErrors(400, "Content-Length must be a non-negative "
+                                 "number")
+    if length > MAX_BODY:
+        raise RequestErrors(413, f"the body must not be larger than "
+                                 f"{MAX_BODY} bytes")
+    data = await reader.readexactly(length) if length else b""
+    return method, path, headers, data
+
+
+async def read_line(reader):
+    """read one line of the request head
+
+    Raises:
+        RequestErrors: if the line is longer than the limit of the reader
+    """
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError):
+        # the reader is left in the middle of the line
+        raise RequestErrors(400, "request line or header too long")
+
+
+def parse_body(data):
+    """parse the JSON object of a request, {} if no body"""
+    if not data:
+        return {}
+    try:
+        body = json.loads(data)
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise RequestErrors(400, "the body must be a JSON object")
+    return body
+
+
+def encode_response(status, answer, keep_alive=True):
+    """encode a JSON answer as an HTTP response"""
+    body = json.dumps(answer).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n")
+    return head.encode("latin-1") + body
+
+
+async def serve(setting, host, port, idle_timeout=1800):
+    server = SessionServers(setting, idle_timeout=idle_timeout)
+    port = await server.start(host, port)
+    print(f"serving {setting.data_path} on http://{host}:{port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--between", action="store_true",
+                        help="between-subject instead of within-subject")
+    parser.add_argument("--storage", choices=["csv", "sqlite", "binary"],
+                        default="csv")
+    parser.add_argument("--data", default=None,
+                        help="data file, defaulted to Settings.data_path")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="master seed, see Settings.seed")
+    parser.add_argument("--idle-timeout", type=float, default=1800,
+                        help="seconds without a request before a session "
+                             "is quit, 0 to keep the sessions")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="port of the metrics endpoint, see "
+                             "exp_metrics.py")
+    parser.add_argument("--metrics-path", default=None,
+                        help="metrics file in the Prometheus text format")
+    args = parser.parse_args()
+
+    setting = Settings()
+    setting.between = args.between
+    setting.storage = args.storage
+    setting.data_path = args.data or setting.set_data_path()
+    setting.seed = args.seed
+    setting.metrics_port = args.metrics_port
+    setting.metrics_path = args.metrics_path
+    try:
+        asyncio.run(serve(setting, args.host, args.port,
+                          args.idle_timeout or None))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,21 @@
-from random import shuffle
-from exp_urn import RandomUrns, FixUrns
-from exp_condition import Conditions
-from exp_trial import Trials
+import hashlib
+import random
+from exp_plan import load_plan
+from exp_schedule import position_num, rotate, williams_order, williams_rows
+
+
+def participant_seed(master_seed, ppt_seq):
+    """derive the seed of the stream of a participant
+
+    Args:
+        master_seed: seed of the experiment, see Settings.seed
+        ppt_seq: sequence of the participant
+
+    Returns:
+        seed: a non-negative int of 63 bits, recorded with the data
+    """
+    key = repr((master_seed, ppt_seq)).encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big") >> 1
 
 
 class Settings:
@@ -16,16 +30,57 @@ class Settings:
         between: True, if between-subject design,
                  False, if within-subject design
         min_age: minimum age to participate the experiment
-        data_path: csv data file path
+        storage: "csv" to record into a csv file,
+                 "sqlite" to record into a SQLite database,
+                 "binary" to record into a fixed-width binary file
+        data_path: data file path
         ui_path: ui file path
         image_path: urn image path
         pages_before_trials: amount of pages before the trials
+        design_path: design file path, the urns and conditions of the
+                     experiment (see exp_plan.py)
+        plan: compiled plan of the design file, None if the conditions
+              are built otherwise
         conditions: amount of conditions
         trial_geo_list: geometric information for trials
+        lazy_trials: True, if trial widgets are built when the participant
+                     is about to reach them,
+                     False, if all of them are built at startup
+        latency_path: path of the report of latency added by the user
+                      interface (see exp_latency.py), None to disable
+        kiosk: True, if the window starts over with the next participant
+               after the final page, without relaunching
+        kiosk_delay_ms: time the final page is shown in kiosk mode
+        anim_duration: duration of the ball animation in milliseconds
+        metrics_path: path of the metrics file in the Prometheus text
+                      format (see exp_metrics.py), None to disable
+        metrics_port: port of the local HTTP endpoint of the metrics,
+                      None to disable
+        metrics_interval: minimum seconds between writes of the metrics
+                          file
+        journal_interval: seconds between the fsyncs of the write-ahead
+                          journal of the participant (see exp_journal.py),
+                          0 to fsync every trial, None to disable
+        seed: master seed, the stream of each participant is derived from
+              it and the participant sequence (see start_session),
+              None for an unpredictable seed per participant
+        rng: random number generator of the current participant
+        order: conditions in the order presented to the current
+               participant, None to shuffle them in set_trials
+        counterbalance: True, if the trial order, the urn positions and
+                        the condition (if between-subject design) come
+                        from the cell of the participant in the balanced
+                        schedule (see exp_schedule.py),
+                        False, if they are shuffled
+        position_row: row of the urn positions of the current
+                      participant, None to shuffle the urns
+        position_num: amount of rows of urn positions
+        condition_total: amount of conditions of the design
 
         """
         self.between = False
         self.min_age = 18
+        self.storage = "csv"
         self.data_path = self.set_data_path()
         self.ui_path = 'experiment.ui'
         self.image_path = "images/"
@@ -33,97 +88,202 @@ class Settings:
         self.ball_path = self.image_path + "ball_"
         self.ball_file_extension = ".png"
         self.pages_before_trials = 3
+        self.seed = None
+        self.rng = random
+        self.order = None
+        self.counterbalance = True
+        self.position_row = None
+        self.design_path = "design.json"
+        self.plan = self.load_plan()
         self.conditions = self.set_conditions()
+        self.position_num = position_num(
+            [len(condition.urns) for condition in self.conditions])
+        self.condition_total = len(self.conditions)
         self.trial_geo_list = [100, 100, 800, 600]
+        self.lazy_trials = True
+        self.latency_path = None
+        self.kiosk = False
+        self.kiosk_delay_ms = 10000
+        self.anim_duration = 1000
+        self.journal_interval = 0.2
+        self.metrics_path = None
+        self.metrics_port = None
+        self.metrics_interval = 1.0
 
     def set_data_path(self):
-        data_path = "data.csv"
+        if self.storage == "sqlite":
+            data_path = "data.db"
+        elif self.storage == "binary":
+            data_path = "data.bin"
+        else:
+            data_path = "data.csv"
         if self.between:
             data_path = "between_" + data_path
         else:
             data_path = "within_" + data_path
         return data_path
 
+    def load_plan(self):
+        """get the compiled plan of the design file, see exp_plan.py"""
+        return load_plan(self.design_path)
+
     def set_conditions(self):
         """ get conditions for this experiment
 
-        Instantiate urn object and condition object you need in this experiment
-        You could instantiate as many urns or conditions as you want,
-        which makes it very easy to extend the experiment
-        See exp_urn.py, exp_condition.py for reference
+        Instantiate urn object and condition object of the design file,
+        from its compiled plan. Declare as many urns or conditions as you
+        want in the design file, which makes it very easy to extend the
+        experiment
+        See design.json, exp_plan.py, exp_urn.py, exp_condition.py for
+        reference
 
         return:
             a list containing condition object
         """
-        urn_2_random = RandomUrns("urn_2_random",
-                                  ["blue", "red"],
-                                  2,
-                                  self.urn_path)
-        urn_2_equal = FixUrns("urn_2_equal",
-                              ["blue", "red"],
-                              [1, 1],
-                              self.urn_path)
-        urn_10_random = RandomUrns("urn_10_random",
-                                   ["blue", "red"],
-                                   10,
-                                   self.urn_path)
-        urn_10_equal = FixUrns("urn_10_equal",
-                               ["blue", "red"],
-                               [5, 5],
-                               self.urn_path)
-        urn_100_random = RandomUrns("urn_100_random",
-                                    ["blue", "red"],
-                                    100,
-                                    self.urn_path)
-        urn_100_equal = FixUrns("urn_100_equal",
-                                ["blue", "red"],
-                                [50, 50],
-                                self.urn_path)
-
-        urns1 = [urn_2_random, urn_2_equal]
-        urns2 = [urn_10_random, urn_10_equal]
-        urns3 = [urn_100_random, urn_100_equal]
-
-        shuffle(urns1)
-        shuffle(urns2)
-        shuffle(urns3)
-
-        condition1 = Conditions("size2", urns1)
-        condition2 = Conditions("size10", urns2)
-        condition3 = Conditions("size100", urns3)
-
-        return [condition1, condition2, condition3]
-
-    def choose_condition(self, recorder):
+        return self.plan.build(self.rng, self.urn_path, self.arrange_urns)
+
+    def arrange_urns(self, urns, condition_index=0):
+        """put the urns of a condition in their positions, in place
+
+        The urns are rotated to self.position_row, offset by the index of
+        the condition, so the order of the urns also changes between the
+        trials of a participant, or shuffled if None.
+
+        Args:
+            urns: the urns of the condition
+            condition_index: index of the condition in the design
+        """
+        if self.position_row is None:
+            self.rng.shuffle(urns)
+        else:
+            rotate(urns, self.position_row + condition_index)
+
+    def cell_num(self):
+        """ get the amount of cells of the balanced schedule
+
+        return:
+            an int, rows of the trial orders (within-subject design) or
+            entries of the counterbalancing table (between-subject
+            design), times the rows of urn positions
+        """
+        if not self.between:
+            groups = williams_rows(self.condition_total)
+        elif self.plan is not None:
+            groups = len(self.plan.cells)
+        else:
+            groups = self.condition_total
+        return groups * self.position_num
+
+    def choose_condition(self, recorder, cell=-1):
         """choose the condition for participants sequentially
         if between-subject design
 
+        The condition is the one of the cell of the participant. Without
+        a cell, the participants before the current one are counted from
+        its sequence, which is unique across stations, and assigned in
+        turn to the cells of the counterbalancing table of the plan.
         """
         # amount of conditions
         condition_num = len(self.conditions)
         if self.between:
-            lines = recorder.read_csv()
-            existing_ppt = len(lines) - 1
-            index = existing_ppt % condition_num
+            existing_ppt = recorder.ppt_seq - 1
+            group = cell // self.position_num
+            if cell >= 0 and self.plan is not None:
+                index = self.plan.cells[group]
+            elif cell >= 0:
+                index = group
+            elif self.plan is not None:
+                index = self.plan.cell(existing_ppt)
+            else:
+                index = existing_ppt % condition_num
             current_condition = self.conditions[index]
             self.conditions = [current_condition]
 
+    def trial_order(self, cell=-1):
+        """ get the conditions in the order presented to the participant
+
+        Args:
+            cell: cell of the participant in the balanced schedule,
+                  -1 to shuffle the conditions
+
+        return:
+            a list containing condition objects, in the row of the
+            balanced Latin square of the cell, or shuffled
+        """
+        conditions = list(self.conditions)
+        if cell < 0:
+            self.rng.shuffle(conditions)
+            return conditions
+        row = cell // self.position_num % williams_rows(len(conditions))
+        return [conditions[i] for i in williams_order(len(conditions), row)]
+
+    def start_session(self, recorder, seed=None, cell=None):
+        """randomize everything for the current participant at once
+
+        The urn positions, the condition (if between-subject design) and
+        the trial order are the ones of the cell of the participant in
+        the balanced schedule (see exp_schedule.py). The urn mixtures, and
+        without schedule the rest, and a ball of every urn are drawn from
+        one stream seeded for the participant, so the session can be
+        replayed from the seed and the cell recorded with the data.
+
+        Args:
+            recorder: recorder of the experiment, with the sequence of the
+                      participant
+            seed: seed of the stream, defaulted to the one derived from
+                  self.seed and the participant sequence
+            cell: cell of the participant, defaulted to the next cell of
+                  the schedule of the recorder if self.counterbalance,
+                  -1 for no cell
+        """
+        if seed is None:
+            if self.seed is None:
+                seed = random.SystemRandom().getrandbits(63)
+            else:
+                seed = participant_seed(self.seed, recorder.ppt_seq)
+        if cell is None:
+            cell = recorder.allocate_cell() if self.counterbalance else -1
+        recorder.set_seed(seed)
+        recorder.set_cell(cell)
+        recorder.session_started()
+        self.rng = random.Random(seed)
+        self.position_row = None
+        if cell >= 0:
+            self.position_row = cell % self.position_num
+        self.conditions = self.set_conditions()
+        self.choose_condition(recorder, cell)
+        self.order = self.trial_order(cell)
+        for condition in self.conditions:
+            condition.draws = {urn.name: urn.draw(self.rng)
+                               for urn in condition.urns}
+
     def set_trials(self):
         """ get trials for this experiment
 
-        Instantiate trials object
+        Instantiate trials object, or pending trials object if
+        self.lazy_trials, in the order of start_session
         See exp_trial.py for reference
 
         return:
             a list containing trial objects
         """
+        # imported here, so the settings can be used without PyQt
+        # (see exp_simulation.py)
+        from exp_trial import Trials, PendingTrials
+
         trials = []
-        i = 1
-        for condition in self.conditions:
-            trial = Trials("trial" + str(i), condition, self.trial_geo_list)
+        order = self.order
+        if order is None:
+            order = self.trial_order()
+        for condition in order:
+            i = self.conditions.index(condition) + 1
+            if self.lazy_trials:
+                trial = PendingTrials("trial" + str(i), condition,
+                                      self.trial_geo_list)
+            else:
+                trial = Trials("trial" + str(i), condition,
+                               self.trial_geo_list)
             trials.append(trial)
-            i += 1
-        shuffle(trials)
         return trials
 
     def condition_num_per_ppt(self):
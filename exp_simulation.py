@@ -0,0 +1,198 @@
+"""headless simulation of the experiment
+
+Synthetic participants go through the same settings, conditions, urns,
+draw_ball and recorders as in the PyQt experiment window, without
+importing PyQt, e.g. for power analysis before recruiting:
+
+    python exp_simulation.py --participants 100000 --aversion 2=0.6 100=0.7
+"""
+import argparse
+import random
+import time
+from exp_recorder import Recorders
+from exp_setting import Settings
+from exp_columnar import TrialStores
+from exp_storage import MemoryStorage, SqliteStorage
+from exp_urn import FixUrns, draw_ball
+
+
+class ChoiceModels:
+    """class of choice models of synthetic participants
+
+    A participant chooses a fix-mix urn with a probability depending on
+    the size of the urns in the condition, otherwise a random-mix urn.
+    A probability of 0.5 means no ambiguity aversion.
+    """
+
+    def __init__(self, aversion=None, default=0.5, rng=random):
+        """initialize the choice model
+
+        Args:
+            aversion: a dict, {urn size: probability of choosing a fix-mix
+                      urn}
+            default: probability for sizes not in aversion
+            rng: random number generator, defaulted to the random module
+        """
+        self.aversion = aversion or {}
+        self.default = default
+        self.rng = rng
+
+    def choose(self, condition):
+        """choose an urn of the condition
+
+        Args:
+            condition: condition of the trial
+
+        Returns:
+            urn: the chosen urn
+        """
+        fix_urns = [urn for urn in condition.urns if isinstance(urn, FixUrns)]
+        random_urns = [urn for urn in condition.urns
+                       if not isinstance(urn, FixUrns)]
+        if not fix_urns or not random_urns:
+            return self.rng.choice(condition.urns)
+        size = fix_urns[0].size
+        probability = self.aversion.get(size, self.default)
+        if self.rng.random() < probability:
+            return self.rng.choice(fix_urns)
+        return self.rng.choice(random_urns)
+
+
+class Simulations:
+    """class of headless simulations of the experiment"""
+
+    def __init__(self, setting, recorder, model):
+        """initialize the simulation
+
+        Args:
+            setting: setting of the experiment
+            recorder: recorder of the experiment
+            model: choice model of the participants
+        """
+        self.setting = setting
+        self.recorder = recorder
+        self.model = model
+        # {(condition name, "fix" or "random"): amount of choices}
+        self.choices = {}
+        self.ppt_num = 0
+        self.elapsed = 0.0
+
+    def run_participant(self):
+        """simulate one participant, from demographics to the last trial"""
+        setting = self.setting
+        recorder = self.recorder
+        setting.start_session(recorder)
+
+        recorder.ppt_age = setting.min_age
+        recorder.ppt_gender = "simulated"
+        recorder.ppt_edu = "simulated"
+        recorder.ppt_race = "simulated"
+        recorder.append_demographics()
+
+        for condition in setting.order:
+            urn = self.model.choose(condition)
+            ball_color = draw_ball(condition, urn.name)
+            recorder.append_trial_data(condition.name,
+                                       condition.urn_positions,
+                                       urn.name,
+                                       urn.kind,
+                                       ball_color)
+            key = (condition.name, urn.kind)
+            self.choices[key] = self.choices.get(key, 0) + 1
+
+        recorder.completed()
+        recorder.data_to_csv()
+        self.ppt_num += 1
+
+    def run(self, ppt_num):
+        """simulate ppt_num participants
+
+        Args:
+            ppt_num: amount of participants
+        """
+        start = time.perf_counter()
+        for i in range(ppt_num):
+            if i:
+                self.recorder.new_participant()
+            self.run_participant()
+        self.recorder.storage.flush()
+        self.elapsed += time.perf_counter() - start
+
+    def rate(self):
+        """participants simulated per second"""
+        if not self.elapsed:
+            return 0.0
+        return self.ppt_num / self.elapsed
+
+    def summary(self):
+        """get the proportion of fix-mix choices in each condition
+
+        Returns:
+            a dict, {condition name: (amount of trials, proportion)}
+        """
+        summary = {}
+        names = sorted({name for name, _ in self.choices})
+        for name in names:
+            fix = self.choices.get((name, "fix"), 0)
+            total = fix + self.choices.get((name, "random"), 0)
+            summary[name] = (total, fix / total)
+        return summary
+
+
+def parse_aversion(items):
+    """parse items like "2=0.6" into {2: 0.6}"""
+    aversion = {}
+    for item in items:
+        size, _, probability = item.partition("=")
+        aversion[int(size)] = float(probability)
+    return aversion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--participants", type=int, default=10000)
+    parser.add_argument("--between", action="store_true",
+                        help="between-subject instead of within-subject")
+    parser.add_argument("--aversion", nargs="*", default=[],
+                        help="probabilities of choosing the fix-mix urn per "
+                             "urn size, e.g. 2=0.6 10=0.65")
+    parser.add_argument("--default", type=float, default=0.5,
+                        help="probability for sizes not given in --aversion")
+    parser.add_argument("--data", default=None,
+                        help="SQLite file to record into, in memory if "
+                             "omitted")
+    parser.add_argument("--batch", type=int, default=10000,
+                        help="rows per transaction when recording to --data")
+    parser.add_argument("--store", default=None,
+                        help="columnar store file to save the rows to, "
+                             "see exp_columnar.py")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    setting = Settings()
+    setting.between = args.between
+    setting.seed = args.seed
+    if args.data:
+        storage = SqliteStorage(args.data, batch_size=args.batch)
+    elif args.store:
+        storage = TrialStores()
+    else:
+        storage = MemoryStorage(keep_rows=False)
+    recorder = Recorders(setting, storage)
+    model = ChoiceModels(parse_aversion(args.aversion), args.default)
+
+    simulation = Simulations(setting, recorder, model)
+    simulation.run(args.participants)
+    recorder.close()
+    if args.store:
+        storage.save(args.store)
+
+    for name, (total, proportion) in simulation.summary().items():
+        print(f"{name}: {total} trials, fix-mix chosen {proportion:.3f}")
+    print(f"{simulation.ppt_num} participants in {simulation.elapsed:.2f} s "
+          f"({simulation.rate():.0f} participants/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""bootstrap and permutation tests of ambiguity aversion
+
+Works on the data written by the recorders, see exp_analysis.py. A choice
+is coded 1 if the participant chose the fix-mix urn and 0 if the
+random-mix urn, by the kind recorded with the choice. For every condition
+the proportion of fix-mix choices gets a bootstrap confidence interval,
+and for every pair of conditions (size effects, e.g. size2 vs size100)
+the difference of proportions gets a bootstrap confidence interval and a
+permutation p-value. Within-subject data are paired by participant;
+between-subject data are not.
+
+Resampling is done with NumPy in chunks of a fixed size, so memory stays
+bounded for any amount of resamples, and may be spread over processes:
+
+    python exp_stats.py within_data.csv --resamples 100000 --workers 4
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import numpy as np
+from exp_analysis import iter_trials
+
+
+def load_choices(path):
+    """read the choices of every participant in every condition
+
+    Args:
+        path: path of the csv data file
+
+    Returns:
+        design: "within" or "between"
+        choices: a dict, {condition: {sequence: 1 if fix-mix else 0}}
+
+    Raises:
+        ValueError: if the kind of a chosen urn is not known, e.g. data
+                    recorded without choice_kind and urns named otherwise
+    """
+    design = "within"
+    choices = {}
+    for trial in iter_trials(path):
+        design = trial["design"]
+        if trial["urn_type"] not in ("fix", "random"):
+            raise ValueError(f"{path}: the kind of the urn "
+                             f"{trial['choice']!r} of participant "
+                             f"{trial['sequence']} is not known")
+        fix = 1 if trial["urn_type"] == "fix" else 0
+        choices.setdefault(trial["condition"], {})[trial["sequence"]] = fix
+    return design, choices
+
+
+def paired_differences(choices_a, choices_b):
+    """get the differences of participants who did both conditions"""
+    common = sorted(set(choices_a) & set(choices_b))
+    return np.array([choices_a[seq] - choices_b[seq] for seq in common],
+                    dtype=np.float64)
+
+
+def chunk_counts(total, chunk_size):
+    """split total resamples into chunks of at most chunk_size"""
+    while total > 0:
+        yield min(chunk_size, total)
+        total -= chunk_size
+
+
+def resample_statistics(kind, arrays, count, chunk_size, seed):
+    """compute count resampled statistics, chunk_size at a time
+
+    Args:
+        kind: "bootstrap_mean" of one array,
+              "bootstrap_difference" of the means of two arrays,
+              "permute_difference" of the means of two arrays,
+              "sign_flip_mean" of paired differences
+        arrays: the data, one or two float arrays
+        count: amount of resamples
+        chunk_size: amount of resamples held in memory at once
+        seed: seed of the numpy random generator
+
+    Returns:
+        statistics: a float array of shape (count,)
+    """
+    rng = np.random.default_rng(seed)
+    statistics = np.empty(count, dtype=np.float64)
+    start = 0
+    for size in chunk_counts(count, chunk_size):
+        if kind == "bootstrap_mean":
+            x, = arrays
+            index = rng.integers(0, len(x), (size, len(x)))
+            chunk = x[index].mean(axis=1)
+        elif kind == "bootstrap_difference":
+            x, y = arrays
+            chunk = (x[rng.integers(0, len(x), (size, len(x)))].mean(axis=1)
+                     - y[rng.integers(0, len(y), (size, len(y)))].mean(axis=1))
+        elif kind == "permute_difference":
+            x, y = arrays
+            pooled = np.tile(np.concatenate([x, y]), (size, 1))
+            pooled = rng.permuted(pooled, axis=1)
+            chunk = (pooled[:, :len(x)].mean(axis=1)
+                     - pooled[:, len(x):].mean(axis=1))
+        elif kind == "sign_flip_mean":
+            d, = arrays
+            signs = rng.integers(0, 2, (size, len(d))) * 2 - 1
+            chunk = (signs * d).mean(axis=1)
+        else:
+            raise ValueError("unknown resampling: " + kind)
+        statistics[start:start + size] = chunk
+        start += size
+    return statistics
+
+
+class Resamplers:
+    """class of chunked resampling, optionally spread over processes
+
+    The process pool is started on the first run and reused by the next
+    ones, close it with close() or by using the resamplers in a with
+    statement.
+    """
+
+    def __init__(self, chunk_size=10000, workers=1, seed=None,
+                 executor=None):
+        """
+        Args:
+            chunk_size: amount of resamples held in memory at once per
+                        process
+            workers: amount of processes, 1 to resample in this process
+            seed: seed of the whole analysis
+            executor: a process pool to resample in, shut down by its
+                      owner, defaulted to one of workers processes owned
+                      by the resamplers
+        """
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.executor = executor
+        self.owns_executor = executor is None
+
+    def run(self, kind, arrays, count):
+        """compute count resampled statistics, see resample_statistics"""
+        if self.workers <= 1:
+            seed, = self.seed_sequence.spawn(1)
+            return resample_statistics(kind, arrays, count,
+                                       self.chunk_size, seed)
+        seeds = self.seed_sequence.spawn(self.workers)
+        counts = [count // self.workers + (i < count % self.workers)
+                  for i in range(self.workers)]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        parts = self.executor.map(resample_statistics,
+                                  [kind] * self.workers,
+                                  [arrays] * self.workers,
+                                  counts,
+                                  [self.chunk_size] * self.workers,
+                                  seeds)
+        return np.concatenate(list(parts))
+
+    def close(self):
+        """shut down the process pool, if the resamplers started it"""
+        if self.owns_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def bootstrap_ci(self, statistics, alpha):
+        """percentile confidence interval"""
+        low, high = np.quantile(statistics, [alpha / 2, 1 - alpha / 2])
+        return float(low), float(high)
+
+    def proportion(self, x, count, alpha=0.05):
+        """bootstrap confidence interval of a proportion
+
+        Returns:
+            estimate, low, high
+        """
+        statistics = self.run("bootstrap_mean", (x,), count)
+        return (float(x.mean()),) + self.bootstrap_ci(statistics, alpha)
+
+    def difference(self, x, y, paired, count, alpha=0.05):
+        """bootstrap confidence interval and permutation p-value of the
+        difference of two proportions
+
+        Args:
+            x, y: choices in two conditions, or for paired data the
+                  differences as x and None as y
+            paired: True for within-subject data
+            count: amount of resamples and of permutations
+
+        Returns:
+            estimate, low, high, p_value
+        """
+        if paired:
+            observed = x.mean()
+            bootstrap = self.run("bootstrap_mean", (x,), count)
+            null = self.run("sign_flip_mean", (x,), count)
+        else:
+            observed = x.mean() - y.mean()
+            bootstrap = self.run("bootstrap_difference", (x, y), count)
+            null = self.run("permute_difference", (x, y), count)
+        extreme = np.count_nonzero(np.abs(null) >= abs(observed) - 1e-12)
+        p_value = (extreme + 1) / (count + 1)
+        return ((float(observed),) + self.bootstrap_ci(bootstrap, alpha)
+                + (p_value,))
+
+
+def analyze(path, resamplers, count, alpha=0.05):
+    """test the proportions and the size effects of a data file
+
+    Returns:
+        proportions: a list of (condition, n, estimate, low, high)
+        effects: a list of (condition a, condition b, n, estimate, low,
+                 high, p_value)
+    """
+    design, choices = load_choices(path)
+    paired = design == "within"
+    proportions = []
+    for condition in sorted(choices):
+        x = np.array(list(choices[condition].values()), dtype=np.float64)
+        proportions.append((condition, len(x))
+                           + resamplers.proportion(x, count, alpha))
+    effects = []
+    for a, b in combinations(sorted(choices), 2):
+        if paired:
+            x = paired_differences(choices[a], choices[b])
+            y = None
+            n = len(x)
+        else:
+            x = np.array(list(choices[a].values()), dtype=np.float64)
+            y = np.array(list(choices[b].values()), dtype=np.float64)
+            n = len(x) + len(y)
+        if n == 0:
+            continue
+        effects.append((a, b, n)
+                       + resamplers.difference(x, y, paired, count, alpha))
+    return proportions, effects
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_path")
+    parser.add_argument("--resamples", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    with Resamplers(args.chunk_size, args.workers, args.seed) as resamplers:
+        proportions, effects = analyze(args.data_path, resamplers,
+                                       args.resamples, args.alpha)
+    level = round((1 - args.alpha) * 100)
+    print(f"proportion of fix-mix choices, {level}% bootstrap CI:")
+    for condition, n, estimate, low, high in proportions:
+        print(f"  {condition} (n={n}): {estimate:.3f} [{low:.3f}, {high:.3f}]")
+    print(f"size effects, difference of proportions, {level}% bootstrap CI, "
+          f"permutation p:")
+    for a, b, n, estimate, low, high, p_value in effects:
+        print(f"  {a} - {b} (n={n}): {estimate:+.3f} "
+              f"[{low:+.3f}, {high:+.3f}], p={p_value:.4g}")
+
+
+if __name__ == "__main__":
+    main()
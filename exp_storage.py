@@ -0,0 +1,378 @@
+import os
+import sqlite3
+from exp_index import DataIndex
+from exp_lock import FileLock, append_line
+
+
+def split_header(header):
+    """split the wide header into participant fields and trial fields
+
+    Args:
+        header: header of the wide data, e.g. from Recorders.get_header
+
+    Returns:
+        ppt_fields: names of the participant columns
+        trial_fields: names of the per-trial columns, without prefix
+        trial_num: amount of trials per participant
+    """
+    ppt_fields = []
+    trial_fields = []
+    trial_num = 0
+    for name in header:
+        prefix, _, field = name.partition("_")
+        if prefix.isdigit():
+            trial_num = max(trial_num, int(prefix))
+            if field not in trial_fields:
+                trial_fields.append(field)
+        else:
+            ppt_fields.append(name)
+    return ppt_fields, trial_fields, trial_num
+
+
+class CsvStorage:
+    """class of csv storage of the recorders
+
+    One wide row per participant, appended under a file lock and counted
+    by a sidecar index (see exp_lock.py, exp_index.py).
+    """
+
+    def __init__(self, data_path):
+        """initialize the storage
+
+        Args:
+            data_path: csv data file path
+        """
+        self.data_path = data_path
+        self.index = DataIndex(data_path)
+        self.lock = FileLock(data_path + ".lock")
+
+    def init(self, header):
+        """create a new csv file with the header if no such file
+
+        Args:
+            header: header of the csv file
+
+        Raises:
+            ValueError: if the csv file was written with another header
+        """
+        line = ','.join(header) + '\n'
+        with self.lock:
+            if (not os.path.exists(self.data_path)
+                    or os.path.getsize(self.data_path) == 0):
+                append_line(self.data_path, line)
+                return
+            with open(self.data_path, "r") as data_file:
+                if data_file.readline() != line:
+                    raise ValueError(self.data_path + " was written with "
+                                     "another header, choose another data "
+                                     "path")
+
+    def allocate_seq(self):
+        """hand out the sequence of the next participant"""
+        with self.lock:
+            return self.index.allocate()
+
+    def count_ppt(self):
+        """count the participants already recorded"""
+        with self.lock:
+            return self.index.sync() - 1
+
+    def has_seq(self, seq):
+        """check whether the row of a sequence is already recorded, by
+        reading the first column of the file
+
+        Args:
+            seq: sequence of the participant, a str
+        """
+        key = str(seq).encode() + b","
+        with self.lock, open(self.data_path, "rb") as data_file:
+            next(data_file, None)
+            return any(line.startswith(key) for line in data_file)
+
+    def write(self, row):
+        """append one participant row
+
+        Args:
+            row: a list of str, in the order of the header
+        """
+        with self.lock:
+            append_line(self.data_path, ','.join(row) + '\n')
+            self.index.sync()
+
+    def flush(self):
+        """rows are written through, nothing to flush"""
+
+    def close(self):
+        """rows are written through, nothing to close"""
+
+
+class SqliteStorage:
+    """class of SQLite storage of the recorders
+
+    Participants and trials are kept in two tables in WAL mode, so
+    sequences, condition counts and per-condition queries are index
+    lookups. Rows may be committed in batches for simulated bulk runs.
+    """
+
+    def __init__(self, data_path, batch_size=1):
+        """initialize the storage
+
+        Args:
+            data_path: database file path
+            batch_size: amount of rows written per transaction
+        """
+        self.data_path = data_path
+        self.batch_size = batch_size
+        self.pending = 0
+        self.header = []
+        self.ppt_fields = []
+        self.trial_fields = []
+        self.connection = sqlite3.connect(data_path, timeout=30.0,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    def init(self, header):
+        """create the tables if no such tables
+
+        Args:
+            header: header of the wide data, see Recorders.get_header
+
+        Raises:
+            ValueError: if the database was written with another header
+        """
+        if self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                "AND name = 'header'").fetchone() is not None:
+            self.load_header()
+            if self.header and self.header != list(header):
+                raise ValueError(self.data_path + " was written with "
+                                 "another header, choose another data path")
+        self.header = header
+        self.ppt_fields, self.trial_fields, _ = split_header(header)
+        ppt_columns = ", ".join('"' + field + '" TEXT'
+                                for field in self.ppt_fields[1:])
+        trial_columns = ", ".join('"' + field + '" TEXT'
+                                  for field in self.trial_fields)
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS header (
+                position INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE IF NOT EXISTS sequences (
+                sequence INTEGER PRIMARY KEY AUTOINCREMENT);
+            CREATE TABLE IF NOT EXISTS participants (
+                sequence INTEGER PRIMARY KEY, {ppt_columns});
+            CREATE TABLE IF NOT EXISTS trials (
+                sequence INTEGER, trial INTEGER, {trial_columns},
+                PRIMARY KEY (sequence, trial));
+            CREATE INDEX IF NOT EXISTS trials_condition
+                ON trials (condition, choice);
+            """)
+        self.begin()
+        self.connection.execute("DELETE FROM header")
+        self.connection.executemany("INSERT INTO header VALUES (?, ?)",
+                                    enumerate(header))
+        self.commit()
+
+    def load_header(self):
+        """read the header stored by init, for a database opened only to
+        be queried or exported"""
+        rows = self.connection.execute(
+            "SELECT name FROM header ORDER BY position").fetchall()
+        self.header = [name for name, in rows]
+        self.ppt_fields, self.trial_fields, _ = split_header(self.header)
+
+    def begin(self):
+        """open a transaction if none is open"""
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        """commit the open transaction, if any"""
+        if self.connection.in_transaction:
+            self.connection.execute("COMMIT")
+        self.pending = 0
+
+    def allocate_seq(self):
+        """hand out the sequence of the next participant"""
+        self.begin()
+        cursor = self.connection.execute(
+            "INSERT INTO sequences DEFAULT VALUES")
+        if self.batch_size <= 1:
+            self.commit()
+        return cursor.lastrowid
+
+    def count_ppt(self):
+        """count the participants already recorded"""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM participants").fetchone()[0]
+
+    def has_seq(self, seq):
+        """check whether the row of a sequence is already recorded
+
+        Args:
+            seq: sequence of the participant, a str
+        """
+        return self.connection.execute(
+            "SELECT 1 FROM participants WHERE sequence = ?",
+            (int(seq),)).fetchone() is not None
+
+    def condition_counts(self):
+        """count the trials and choices recorded for each condition
+
+        Returns:
+            a dict, {(condition, choice): amount of trials}
+        """
+        rows = self.connection.execute(
+            "SELECT condition, choice, COUNT(*) FROM trials "
+            "GROUP BY condition, choice")
+        return {(condition, choice): count
+                for condition, choice, count in rows}
+
+    def condition_trials(self, condition):
+        """get the trials recorded for one condition
+
+        Args:
+            condition: name of the condition
+
+        Returns:
+            a list of tuples (sequence, trial, *trial fields)
+        """
+        return self.connection.execute(
+            "SELECT * FROM trials WHERE condition = ? "
+            "ORDER BY sequence, trial", (condition,)).fetchall()
+
+    def write(self, row):
+        """insert one participant row
+
+        Args:
+            row: a list of str, in the order of the header
+        """
+        ppt_num = len(self.ppt_fields)
+        trial_size = len(self.trial_fields)
+        ppt_row = row[:ppt_num] + [""] * (ppt_num - len(row))
+        trial_rows = []
+        for start in range(ppt_num, len(row), trial_size):
+            trial = row[start:start + trial_size]
+            trial += [""] * (trial_size - len(trial))
+            trial_rows.append([ppt_row[0],
+                               (start - ppt_num) // trial_size + 1] + trial)
+
+        marks = ", ".join("?" * len(ppt_row))
+        trial_marks = ", ".join("?" * (trial_size + 2))
+        self.begin()
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO participants VALUES ({marks})", ppt_row)
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO trials VALUES ({trial_marks})",
+            trial_rows)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def flush(self):
+        """commit the rows written so far"""
+        self.commit()
+
+    def close(self):
+        """commit the rows written so far and close the database"""
+        self.commit()
+        self.connection.close()
+
+    def export_csv(self, csv_path):
+        """export the data in the csv layout of Recorders.get_header
+
+        Args:
+            csv_path: path of the csv file to write
+        """
+        self.flush()
+        if not self.header:
+            self.load_header()
+        trial_size = len(self.trial_fields)
+        with open(csv_path, "w") as csv_file:
+            csv_file.write(','.join(self.header) + '\n')
+            participants = self.connection.execute(
+                "SELECT * FROM participants ORDER BY sequence")
+            for ppt_row in participants.fetchall():
+                row = [str(value) for value in ppt_row]
+                trials = self.connection.execute(
+                    "SELECT * FROM trials WHERE sequence = ? ORDER BY trial",
+                    (ppt_row[0],))
+                for trial in trials:
+                    row += [value or "" for value in trial[2:2 + trial_size]]
+                csv_file.write(','.join(row) + '\n')
+
+
+class MemoryStorage:
+    """class of in-memory storage of the recorders
+
+    Used by simulations which do not need a data file. Rows are kept in a
+    list, unless keep_rows is False, in which case they are only counted.
+    """
+
+    def __init__(self, keep_rows=True):
+        """initialize the storage
+
+        Args:
+            keep_rows: True to keep the rows written, False to drop them
+        """
+        self.keep_rows = keep_rows
+        self.header = []
+        self.rows = []
+        self.row_num = 0
+        self.next_seq = 1
+
+    def init(self, header):
+        """remember the header
+
+        Args:
+            header: header of the wide data, see Recorders.get_header
+        """
+        self.header = header
+
+    def allocate_seq(self):
+        """hand out the sequence of the next participant"""
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def count_ppt(self):
+        """count the participants already recorded"""
+        return self.row_num
+
+    def has_seq(self, seq):
+        """check whether the row of a sequence is kept, always False if
+        the rows are only counted"""
+        return any(row[0] == str(seq) for row in self.rows)
+
+    def write(self, row):
+        """keep one participant row
+
+        Args:
+            row: a list of str, in the order of the header
+        """
+        self.row_num += 1
+        if self.keep_rows:
+            self.rows.append(list(row))
+
+    def flush(self):
+        """rows are kept in memory, nothing to flush"""
+
+    def close(self):
+        """rows are kept in memory, nothing to close"""
+
+
+def open_storage(setting):
+    """open the storage chosen in the settings
+
+    Args:
+        setting: setting of the experiment, see Settings.storage
+
+    Returns:
+        a CsvStorage, SqliteStorage or BinaryStorage object
+    """
+    if setting.storage == "sqlite":
+        return SqliteStorage(setting.data_path)
+    if setting.storage == "binary":
+        from exp_binary import BinaryStorage
+        return BinaryStorage(setting.data_path)
+    return CsvStorage(setting.data_path)
@@ -0,0 +1,278 @@
+"""parallel sweeps of headless simulations over experiment designs
+
+Every cell of the sweep (urn sizes x amount of colors x design x sample
+size) is an independent simulation, see exp_simulation.py. The cells are
+run in a process pool, each with its own random seed derived from the
+master seed and the cell, so results do not depend on which worker ran
+which cell. Results are streamed back as cells finish and merged into one
+summary table:
+
+    python exp_sweep.py --sizes 2,10,100 2,20,200 --colors 2 4 \\
+        --participants 50 100 --designs within between --replicates 200
+"""
+import argparse
+import csv
+import hashlib
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from exp_condition import Conditions
+from exp_recorder import Recorders
+from exp_setting import Settings
+from exp_simulation import ChoiceModels, Simulations, parse_aversion
+from exp_storage import MemoryStorage
+from exp_urn import RandomUrns, FixUrns
+
+# colors with a ball image come first, see images/
+BALL_COLORS = ["blue", "red", "green", "yellow"]
+
+SUMMARY_FIELDS = ["cell", "sizes", "colors", "design", "participants",
+                  "replicates", "condition", "trials", "fix_proportion",
+                  "power", "seed", "seconds"]
+
+
+def color_names(color_num):
+    """get color_num color names, e.g. for a design with many colors"""
+    names = BALL_COLORS[:color_num]
+    for i in range(len(names), color_num):
+        names.append("color" + str(i + 1))
+    return names
+
+
+class SweepSettings(Settings):
+    """class of settings of one sweep cell
+
+    Conditions are built from the urn sizes and amount of colors of the
+    cell instead of the fixed design of Settings.set_conditions.
+    """
+
+    def __init__(self, sizes, color_num, between):
+        """
+        Args:
+            sizes: urn sizes, one condition per size
+            color_num: amount of colors in every urn
+            between: True, if between-subject design
+        """
+        self.sizes = sizes
+        self.colors = color_names(color_num)
+        super().__init__()
+        self.between = between
+        self.data_path = self.set_data_path()
+
+    def load_plan(self):
+        """the conditions are built from the cell, not a design file"""
+        return None
+
+    def set_conditions(self):
+        """get one condition per urn size, with a random-mix urn and an
+        equal fix-mix urn"""
+        color_num = len(self.colors)
+        conditions = []
+        for index, size in enumerate(self.sizes):
+            if size % color_num:
+                raise ValueError(f"urn size {size} can not be split equally "
+                                 f"into {color_num} colors")
+            urns = [RandomUrns("urn_" + str(size) + "_random",
+                               self.colors, size, self.urn_path, self.rng),
+                    FixUrns("urn_" + str(size) + "_equal",
+                            self.colors, [size // color_num] * color_num,
+                            self.urn_path)]
+            self.arrange_urns(urns, index)
+            conditions.append(Conditions("size" + str(size), urns))
+        return conditions
+
+
+def cell_seed(master_seed, cell):
+    """derive the seed of a cell from the master seed and the cell
+
+    The index of the cell is left out, so a cell keeps its seed when the
+    grid of the sweep changes around it.
+
+    Args:
+        master_seed: seed of the whole sweep
+        cell: a dict describing the cell
+
+    Returns:
+        seed: an int
+    """
+    key = repr((master_seed, sorted(
+        (name, value) for name, value in cell.items()
+        if name != "index"))).encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
+
+
+def significant(fix, total, z=1.959964):
+    """two-sided test of a proportion of fix-mix choices against 0.5"""
+    if not total:
+        return False
+    return abs(fix - total / 2) / math.sqrt(total / 4) > z
+
+
+def run_cell(cell, master_seed, aversion, default):
+    """simulate the replicates of one cell
+
+    Args:
+        cell: a dict with the keys sizes, colors, design, participants,
+              replicates
+        master_seed: seed of the whole sweep
+        aversion: a dict, {urn size: probability of choosing a fix-mix urn}
+        default: probability for sizes not in aversion
+
+    Returns:
+        rows: summary rows of the cell, one per condition
+    """
+    seed = cell_seed(master_seed, cell)
+    # the choice model uses the random module, the sessions use streams
+    # derived from the seed of the replicate, see Settings.start_session
+    random.seed(seed)
+    start = time.perf_counter()
+    setting = SweepSettings(cell["sizes"], cell["colors"],
+                            cell["design"] == "between")
+    model = ChoiceModels(aversion, default)
+    # {condition name: [trials, fix choices, significant replicates]}
+    totals = {}
+    for replicate in range(cell["replicates"]):
+        setting.seed = (seed, replicate)
+        recorder = Recorders(setting, MemoryStorage(keep_rows=False))
+        simulation = Simulations(setting, recorder, model)
+        simulation.run(cell["participants"])
+        for name in {name for name, _ in simulation.choices}:
+            fix = simulation.choices.get((name, "fix"), 0)
+            total = fix + simulation.choices.get((name, "random"), 0)
+            counts = totals.setdefault(name, [0, 0, 0])
+            counts[0] += total
+            counts[1] += fix
+            counts[2] += significant(fix, total)
+    seconds = time.perf_counter() - start
+
+    rows = []
+    for name in sorted(totals):
+        total, fix, hits = totals[name]
+        rows.append({"cell": cell["index"],
+                     "sizes": " ".join(str(size) for size in cell["sizes"]),
+                     "colors": cell["colors"],
+                     "design": cell["design"],
+                     "participants": cell["participants"],
+                     "replicates": cell["replicates"],
+                     "condition": name,
+                     "trials": total,
+                     "fix_proportion": fix / total,
+                     "power": hits / cell["replicates"],
+                     "seed": seed,
+                     "seconds": round(seconds, 3)})
+    return rows
+
+
+def make_cells(size_sets, color_nums, designs, ppt_nums, replicates):
+    """get every combination of the swept factors
+
+    Returns:
+        cells: a list of dicts, see run_cell
+    """
+    cells = []
+    for i, (sizes, colors, design, ppt_num) in enumerate(
+            product(size_sets, color_nums, designs, ppt_nums)):
+        # fail before starting the pool, not in a worker
+        for size in sizes:
+            if size % colors:
+                raise ValueError(f"urn size {size} can not be split "
+                                 f"equally into {colors} colors")
+        cells.append({"index": i,
+                      "sizes": tuple(sizes),
+                      "colors": colors,
+                      "design": design,
+                      "participants": ppt_num,
+                      "replicates": replicates})
+    return cells
+
+
+def run_sweep(cells, master_seed=0, aversion=None, default=0.5,
+              workers=None):
+    """run the cells in a process pool
+
+    Args:
+        cells: cells of the sweep, see make_cells
+        master_seed: seed of the whole sweep
+        aversion: a dict, {urn size: probability of choosing a fix-mix urn}
+        default: probability for sizes not in aversion
+        workers: amount of processes, defaulted to the amount of cores
+
+    Yields:
+        rows: summary rows of each cell, as soon as the cell is finished
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_cell, cell, master_seed,
+                                   aversion or {}, default)
+                   for cell in cells]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def merge_rows(partial_rows):
+    """merge the rows of finished cells into one summary table
+
+    Args:
+        partial_rows: an iterable of lists of rows, e.g. from run_sweep
+
+    Returns:
+        a list of rows, sorted by cell and condition
+    """
+    rows = [row for cell_rows in partial_rows for row in cell_rows]
+    rows.sort(key=lambda row: (row["cell"], row["condition"]))
+    return rows
+
+
+def write_summary(rows, path):
+    """write the summary table as csv"""
+    with open(path, "w", newline="") as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["2,10,100"],
+                        help="comma separated urn sizes of each design")
+    parser.add_argument("--colors", nargs="+", type=int, default=[2])
+    parser.add_argument("--designs", nargs="+", default=["within"],
+                        choices=["within", "between"])
+    parser.add_argument("--participants", nargs="+", type=int,
+                        default=[100])
+    parser.add_argument("--replicates", type=int, default=100)
+    parser.add_argument("--aversion", nargs="*", default=[],
+                        help="e.g. 2=0.6 10=0.65, see exp_simulation.py")
+    parser.add_argument("--default", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="sweep_summary.csv")
+    args = parser.parse_args()
+
+    size_sets = [[int(size) for size in sizes.split(",")]
+                 for sizes in args.sizes]
+    cells = make_cells(size_sets, args.colors, args.designs,
+                       args.participants, args.replicates)
+    start = time.perf_counter()
+    finished = []
+    for cell_rows in run_sweep(cells, args.seed,
+                               parse_aversion(args.aversion), args.default,
+                               args.workers):
+        finished.append(cell_rows)
+        print(f"[{len(finished)}/{len(cells)}] cell {cell_rows[0]['cell']} "
+              f"done in {cell_rows[0]['seconds']} s")
+    elapsed = time.perf_counter() - start
+    rows = merge_rows(finished)
+    write_summary(rows, args.output)
+    cpu_seconds = sum(cell_rows[0]["seconds"] for cell_rows in finished)
+    print(f"{len(cells)} cells in {elapsed:.2f} s with {args.workers} "
+          f"workers, speedup {cpu_seconds / elapsed:.1f}x; "
+          f"summary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from PyQt6.QtWidgets import QWidget, QPushButton, QLabel, QGridLayout
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPixmap
+from exp_condition import urn_letter
+from exp_image import image_cache
 
 
 class Trials(QWidget):
@@ -20,8 +21,13 @@ class Trials(QWidget):
         self.condition_name = condition.name
         self.urns = condition.urns
         self.urn_positions = condition.urn_positions
+        self.urn_index = condition.urn_index
+        self.draws = condition.draws
         self.geo_list = geo_list
         self.image_labels = []
+        # {urn name: widget}, filled in load_images
+        self.label_index = {}
+        self.button_index = {}
         self.init_ui()
 
     def init_ui(self):
@@ -42,24 +48,20 @@ class Trials(QWidget):
         automatic layout
 
         """
-        alphabet = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J',
-                    'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T',
-                    'U', 'V', 'W', 'x', 'Y', 'Z']
         row = 0
         col = 0
         i = 0
+        urn_height = image_cache.urn_height(self.geo_list, len(self.urns))
         for urn in self.urns:
 
-            caption_text = 'Urn ' + alphabet[i]
+            caption_text = 'Urn ' + urn_letter(i)
 
             # create image labels
             image_label = QLabel(self)
             image_label.setObjectName("image_" + urn.name)
-            pixmap = QPixmap(urn.image_path)
-            image_label.setPixmap(pixmap.scaledToWidth(
-                int(self.geo_list[2] / len(self.urns))))
-            image_label.setPixmap(pixmap.scaledToHeight(
-                int(self.geo_list[3] / len(self.urns))))
+            # decoded and scaled once, see exp_image.py
+            pixmap = image_cache.pixmap(urn.image_path, height=urn_height)
+            image_label.setPixmap(pixmap)
             image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
             # create caption labels
@@ -79,6 +81,8 @@ class Trials(QWidget):
 
             # add them to layout
             self.image_labels.append((image_label, caption_label, urn_button))
+            self.label_index[urn.name] = image_label
+            self.button_index[urn.name] = urn_button
             self.layout.addWidget(image_label, row, col)
             self.layout.addWidget(caption_label, row + 1, col)
             self.layout.addWidget(instruction_label, row + 2, col)
@@ -90,3 +94,37 @@ class Trials(QWidget):
                 col = 0
                 row += 4
             i += 1
+
+
+class PendingTrials:
+    """class of trials not built yet
+
+    Holds what is needed to build the trial widget, so the widget is only
+    built when the participant is about to reach the trial.
+    """
+
+    def __init__(self, name, condition, geo_list):
+        """
+
+        Args:
+            name: name of this trial
+            condition: condition of this trial
+            geo_list: geometric information of this trial
+
+        """
+        self.name = name
+        self.condition = condition
+        self.condition_name = condition.name
+        self.urns = condition.urns
+        self.urn_positions = condition.urn_positions
+        self.urn_index = condition.urn_index
+        self.draws = condition.draws
+        self.geo_list = geo_list
+
+    def build(self):
+        """build the trial widget
+
+        Returns:
+            a Trials object
+        """
+        return Trials(self.name, self.condition, self.geo_list)
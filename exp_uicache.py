@@ -0,0 +1,68 @@
+import glob
+import hashlib
+import importlib.util
+import os
+from PyQt6 import uic
+
+
+def compile_ui(ui_path, cache_dir=None):
+    """compile a ui file to a python module, unless already compiled
+
+    The module name contains a hash of the ui file, so the module is
+    regenerated automatically whenever the ui file changes.
+
+    Args:
+        ui_path: path of the ui file
+        cache_dir: directory of the compiled modules, defaulted to
+                   __uicache__ next to the ui file
+
+    Returns:
+        module_path: path of the compiled module
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(ui_path), "__uicache__")
+    with open(ui_path, "rb") as ui_file:
+        digest = hashlib.sha256(ui_file.read()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(ui_path))[0]
+    module_path = os.path.join(cache_dir, "ui_" + stem + "_" + digest + ".py")
+    if os.path.exists(module_path):
+        return module_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale_path in glob.glob(os.path.join(cache_dir,
+                                             "ui_" + stem + "_*.py")):
+        os.remove(stale_path)
+    temp_path = module_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "w") as module_file:
+        uic.compileUi(ui_path, module_file)
+    os.replace(temp_path, module_path)
+    return module_path
+
+
+def load_ui(ui_path, widget):
+    """set up a widget from a ui file, like PyQt6.uic.loadUi
+
+    The compiled module is used instead of parsing the xml of the ui file
+    on every launch, and its bytecode is cached by python as usual. The
+    child widgets are set as attributes of the widget, as loadUi does.
+    If the module can not be written, the ui file is loaded directly.
+
+    Args:
+        ui_path: path of the ui file
+        widget: the widget to set up, e.g. the experiment window
+    """
+    try:
+        module_path = compile_ui(ui_path)
+    except OSError:
+        uic.loadUi(ui_path, widget)
+        return
+    name = os.path.splitext(os.path.basename(module_path))[0]
+    spec = importlib.util.spec_from_file_location(name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    ui_class = next(getattr(module, attr) for attr in dir(module)
+                    if attr.startswith("Ui_"))
+    ui = ui_class()
+    ui.setupUi(widget)
+    for attr, value in vars(ui).items():
+        setattr(widget, attr, value)
@@ -1,17 +1,24 @@
 import random
+from exp_sampler import BallBags, alias_table
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def random_portion(size, n):
+
+def random_portion(size, n, rng=random):
     """ split balls into n parts of different colors
 
     Args:
         size: the total amount of balls
         n: amount of colors
+        rng: the random module or a random.Random object
 
     Returns:
         portions: a list of int for each part
     """
-    random_integers = sorted(random.sample(range(0, size + 1), n - 1))
+    random_integers = sorted(rng.sample(range(0, size + 1), n - 1))
     portions = []
     last = 0
     for i in random_integers:
@@ -22,6 +29,91 @@ def random_portion(size, n):
     return portions
 
 
+def batch_portions(size, n, batch, rng=None):
+    """ split balls into n parts for batch urns at once, with NumPy
+
+    Same distribution as random_portion: the n - 1 cut points are a
+    uniform sample without replacement from 0..size, drawn for all urns
+    together with Floyd's algorithm.
+
+    Args:
+        size: the total amount of balls
+        n: amount of colors
+        batch: amount of urns
+        rng: a numpy.random.Generator, defaulted to a new one
+
+    Returns:
+        portions: an int array of shape (batch, n)
+    """
+    if np is None:
+        raise ImportError("batch sampling needs NumPy")
+    if rng is None:
+        rng = np.random.default_rng()
+    k = n - 1
+    if k > size + 1:
+        raise ValueError("more colors than possible cut points")
+    cuts = np.empty((batch, k), dtype=np.int64)
+    for j, high in enumerate(range(size + 1 - k, size + 1)):
+        cut = rng.integers(0, high + 1, batch)
+        if j:
+            taken = (cuts[:, :j] == cut[:, None]).any(axis=1)
+            cut = np.where(taken, high, cut)
+        cuts[:, j] = cut
+    cuts.sort(axis=1)
+    edges = np.empty((batch, n + 1), dtype=np.int64)
+    edges[:, 0] = 0
+    edges[:, 1:n] = cuts
+    edges[:, n] = size
+    return np.diff(edges, axis=1)
+
+
+def batch_balls(color_num, batch, rng=None):
+    """ draw batch balls at once, with NumPy
+
+    Same distribution as get_ball, each color is drawn with a probability
+    proportional to its amount of balls.
+
+    Args:
+        color_num: amount of each color, shape (n,) for one urn or
+                   (batch, n) for one urn per draw
+        batch: amount of draws
+        rng: a numpy.random.Generator, defaulted to a new one
+
+    Returns:
+        balls: an int array of shape (batch,), indices of the colors
+    """
+    if np is None:
+        raise ImportError("batch sampling needs NumPy")
+    if rng is None:
+        rng = np.random.default_rng()
+    cumulative = np.cumsum(color_num, axis=-1)
+    ball = rng.integers(0, cumulative[..., -1], batch)
+    return (cumulative <= ball[:, None]).sum(axis=1)
+
+
+def get_ball(colors, color_num):
+    return random.choices(colors, color_num)[0]
+
+
+def draw_ball(current_trial, button_name):
+    """draw a ball from the chosen urn
+
+    Args:
+        current_trial: a trial or condition with an urn_index, and the
+                       draws scheduled at the start of the session
+                       (see Settings.start_session)
+        button_name: name of the chosen urn
+
+    Returns:
+        ball: color of the ball
+    """
+    ball = current_trial.draws.get(button_name)
+    if ball is None:
+        urn = current_trial.urn_index[button_name]
+        ball = urn.draw()
+    return ball
+
+
 class Urns:
     """ class of urn"""
 
@@ -37,11 +129,86 @@ class Urns:
         self.colors = colors
         self.color_num = []
         self.image_path = image_path
+        self.alias_table = None
+        self.bag = None
+
+    def set_color_num(self, color_num):
+        """set the amount of each color, the composition of the urn
+
+        The composition is only changed by this method, which drops the
+        alias table and the balls left of the last composition.
+
+        Args:
+            color_num: a list containing int indicating the amount of
+                       each color
+        """
+        self.color_num = color_num
+        self.alias_table = None
+        self.bag = None
+
+    def sampler(self):
+        """get the alias table of the current composition, built once"""
+        if self.alias_table is None:
+            self.alias_table = alias_table(self.color_num)
+        return self.alias_table
+
+    def draw(self, rng=random, replace=True):
+        """draw a ball from this urn
+
+        Args:
+            rng: the random module or a random.Random object
+            replace: True, to put the ball back,
+                     False, to keep it out of the next draws until refill
+
+        Returns:
+            ball: color of the ball
+        """
+        if replace:
+            return self.colors[self.sampler().sample(rng)]
+        if self.bag is None:
+            self.bag = BallBags(self.color_num)
+        return self.colors[self.bag.sample(rng)]
+
+    def refill(self):
+        """put the balls drawn without replacement back"""
+        self.bag = None
+
+    def batch_color_num(self, batch, rng=None):
+        """get the amount of each color for batch urns like this one
+
+        Args:
+            batch: amount of urns
+            rng: a numpy.random.Generator
+
+        Returns:
+            an int array of shape (batch, amount of colors)
+        """
+        if np is None:
+            raise ImportError("batch sampling needs NumPy")
+        return np.tile(np.asarray(self.color_num, dtype=np.int64), (batch, 1))
+
+    def batch_draws(self, batch, rng=None, color_num=None):
+        """draw one ball from each of batch urns like this one
+
+        Args:
+            batch: amount of draws
+            rng: a numpy.random.Generator
+            color_num: amount of each color, defaulted to batch_color_num
+
+        Returns:
+            an int array of shape (batch,), indices into self.colors
+        """
+        if color_num is None:
+            color_num = self.batch_color_num(batch, rng)
+        return batch_balls(color_num, batch, rng)
 
 
 class FixUrns(Urns):
     """ class of fix-mix urns"""
 
+    # kind of urn recorded with a choice, see Recorders.trial_info
+    kind = "fix"
+
     def __init__(self, name, colors, color_num, image_path="urn.png"):
         """ initialize urn with name, colors, color_num
 
@@ -54,7 +221,7 @@ class FixUrns(Urns):
         """
         super().__init__(name, colors, image_path)
         self.size = sum(color_num)
-        self.color_num = color_num
+        self.set_color_num(color_num)
 
     def set_instruction(self, urn_name):
         """set instruction for fix-mix urn in each trial
@@ -68,7 +235,7 @@ class FixUrns(Urns):
         i = 0
         text = ""
         for color in self.colors:
-            num = self.color_num[0]
+            num = self.color_num[i]
             if num == 1:
                 marble = "marble"
             else:
@@ -83,7 +250,10 @@ class FixUrns(Urns):
 class RandomUrns(Urns):
     """ class of random-mix urns"""
 
-    def __init__(self, name, colors, size, image_path="urn.png"):
+    kind = "random"
+
+    def __init__(self, name, colors, size, image_path="urn.png",
+                 rng=random):
         """initialize urn with name, colors, size
 
         Args:
@@ -92,10 +262,24 @@ class RandomUrns(Urns):
                     colors correspond to the path of ball images
             size: the total amount of the balls in this urn
             image_path: path of urn image
+            rng: the random module or a random.Random object mixing the
+                 balls
         """
         super().__init__(name, colors, image_path)
         self.size = size
-        self.color_num = random_portion(self.size, len(colors))
+        self.set_color_num(random_portion(self.size, len(colors), rng))
+
+    def batch_color_num(self, batch, rng=None):
+        """get batch new random mixtures of this urn
+
+        Args:
+            batch: amount of urns
+            rng: a numpy.random.Generator
+
+        Returns:
+            an int array of shape (batch, amount of colors)
+        """
+        return batch_portions(self.size, len(self.colors), batch, rng)
 
     def set_instruction(self, urn_name):
         """set instruction for random-mix urn in each trial
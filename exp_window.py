@@ -1,21 +1,14 @@
-from random import choices
-from PyQt6.QtWidgets import QMainWindow, QPushButton, QLabel
-from PyQt6.QtCore import QPropertyAnimation, QRect
-from PyQt6.QtGui import QPixmap
-from PyQt6.uic import loadUi
+import time
+from PyQt6.QtWidgets import QMainWindow, QLabel, QWidget
+from PyQt6.QtCore import QPropertyAnimation, QRect, QTimer
+from exp_image import image_cache
+from exp_latency import LatencyMonitors
+from exp_metrics import metrics
+from exp_uicache import load_ui
+from exp_urn import draw_ball
 
-
-def get_ball(colors, color_num):
-    return choices(colors, color_num)[0]
-
-
-def draw_ball(current_trial, button_name):
-    for urn in current_trial.urns:
-        if urn.name == button_name:
-            colors = urn.colors
-            num = urn.color_num
-            ball = get_ball(colors, num)
-            return ball
+# names of the pages before the trials, in the metrics
+PAGE_NAMES = ["consent", "demographics", "instruction"]
 
 
 class ExperimentWindow(QMainWindow):
@@ -35,22 +28,103 @@ class ExperimentWindow(QMainWindow):
         self.setting = setting
         self.pages_before_trials = setting.pages_before_trials
 
-        loadUi(self.setting.ui_path, self)
+        # compiled once per version of the ui file, see exp_uicache.py
+        load_ui(self.setting.ui_path, self)
 
         # Connect push button with switching to next page
         self.pushButton_1.clicked.connect(self.to_demography)
         self.pushButton_2.clicked.connect(self.to_trials)
         self.pushButton_3.clicked.connect(self.switch_to_next_page)
+        self.urn_chosen = False
+        self.trial_onset_ns = 0
+        self.press_ns = 0
+        self.anim_start_ns = 0
+        self.page_shown_ns = time.perf_counter_ns()
+        if self.setting.latency_path:
+            self.latency = LatencyMonitors()
+        else:
+            self.latency = None
         self.trials = trials
         self.init_trials()
+        self.initial_age = self.age.value()
 
     def init_trials(self):
-        """insert trial widgets into stacked widgets of main window"""
+        """insert trial widgets into stacked widgets of main window
+
+        Pending trials get an empty placeholder page, which is replaced by
+        the trial widget in build_trial.
+        """
         i = self.pages_before_trials
         for trial in self.trials:
-            self.stackedWidget.insertWidget(i, trial)
+            if isinstance(trial, QWidget):
+                self.stackedWidget.insertWidget(i, trial)
+            else:
+                self.stackedWidget.insertWidget(i, QWidget())
             i += 1
 
+    def remove_trials(self):
+        """remove the trial pages of the last participant"""
+        for _ in self.trials:
+            page = self.stackedWidget.widget(self.pages_before_trials)
+            self.stackedWidget.removeWidget(page)
+            page.deleteLater()
+        self.trials = []
+
+    def reset_pages(self):
+        """clear the answers and warnings of the last participant"""
+        self.checkBox.setChecked(False)
+        self.warning_unchecked.setText("")
+        self.age.setValue(self.initial_age)
+        self.gender.setCurrentIndex(0)
+        self.education.setCurrentIndex(0)
+        self.race.setCurrentIndex(0)
+        self.warning_blank.setText("")
+
+    def next_participant(self):
+        """start over with the next participant in kiosk mode
+
+        The recorder gets a new sequence, the session is randomized
+        again from the seed of the participant and the window, ui and
+        cached images are reused.
+        """
+        self.recorder.new_participant()
+        self.setting.start_session(self.recorder)
+        self.remove_trials()
+        self.trials = self.setting.set_trials()
+        self.init_trials()
+        self.reset_pages()
+        self.leave_page()
+        self.stackedWidget.setCurrentIndex(0)
+
+    def build_trial(self, page_index):
+        """build the trial widget of a page if it is still pending
+
+        Args:
+            page_index: index of the page in the stacked widget
+        """
+        trial_index = page_index - self.pages_before_trials
+        if trial_index < 0 or trial_index >= len(self.trials):
+            return
+        pending = self.trials[trial_index]
+        if isinstance(pending, QWidget):
+            return
+        trial = pending.build()
+        placeholder = self.stackedWidget.widget(page_index)
+        self.stackedWidget.removeWidget(placeholder)
+        placeholder.deleteLater()
+        self.stackedWidget.insertWidget(page_index, trial)
+        self.trials[trial_index] = trial
+
+    def prebuild_next_trial(self):
+        """build the trial after the current page while the participant
+        is looking at the current page
+
+        Widgets can only be built in the GUI thread, so this runs when the
+        event loop is idle after the current page is shown.
+        """
+        next_index = self.stackedWidget.currentIndex() + 1
+        QTimer.singleShot(0, lambda: self.build_trial(next_index))
+
     def to_demography(self):
         """switch to demographic widget"""
         if self.checkBox.isChecked():
@@ -92,48 +166,64 @@ class ExperimentWindow(QMainWindow):
                 self.recorder.append_demographics()
                 self.switch_to_next_page()
 
+    def current_trial(self):
+        """get the trial of the current page
+
+        Returns:
+            a Trials object
+        """
+        current_index = self.stackedWidget.currentIndex()
+        return self.trials[current_index - self.pages_before_trials]
+
     def find_all_buttons(self):
         """find all the buttons on the current widget
 
         Returns:
-            buttons: all QPushButton objects on this widget
+            buttons: all urn buttons of the current trial, taken from its
+                     button index instead of searching the widget tree
         """
-        current_page_widget = self.stackedWidget.currentWidget()
-        buttons = current_page_widget.findChildren(QPushButton)
-        return buttons
+        return self.current_trial().button_index.values()
 
     def connect_all_buttons(self):
         """connect buttons on the trial widgets"""
         buttons = self.find_all_buttons()
+        self.urn_chosen = False
         # if the participant clicked any buttons
         # i. information in this trial would be recorded
         # ii. an animation would start
         for button in buttons:
-            button.clicked.connect(self.record_trial_info)
-            button.clicked.connect(self.draw)
+            button.clicked.connect(self.choose_urn)
 
-    def disconnect_all_buttons(self):
-        """disconnect buttons on the trial widget
-        call this function during the animation in case repetitive clicks
+    def choose_urn(self):
+        """record the trial and draw a ball for the first click only
+
+        Further clicks during the animation are ignored by a flag, instead
+        of disconnecting every button of the trial.
         """
-        buttons = self.find_all_buttons()
-        for button in buttons:
-            button.clicked.disconnect(self.record_trial_info)
-            button.clicked.disconnect(self.draw)
+        press_ns = time.perf_counter_ns()
+        if self.urn_chosen:
+            return
+        self.urn_chosen = True
+        self.press_ns = press_ns
+        self.record_trial_info()
+        self.draw()
 
     def record_trial_info(self):
         """record information in this trial by modifying the values in
         the settings"""
-        current_index = self.stackedWidget.currentIndex()
-        current_trial = self.trials[current_index - self.pages_before_trials]
+        current_trial = self.current_trial()
         self.condition_name = current_trial.condition_name
         self.urn_positions = current_trial.urn_positions
         self.button_clicked_name = self.button_clicked()
         self.ball_color = draw_ball(current_trial, self.button_clicked_name)
+        urn = current_trial.urn_index[self.button_clicked_name]
         self.recorder.append_trial_data(self.condition_name,
                                         self.urn_positions,
                                         self.button_clicked_name,
-                                        self.ball_color)
+                                        urn.kind,
+                                        self.ball_color,
+                                        self.trial_onset_ns,
+                                        self.press_ns)
 
     def button_clicked(self):
         """find the button which was clicked by the participant
@@ -149,28 +239,56 @@ class ExperimentWindow(QMainWindow):
         """switch to the next page"""
         current_index = self.stackedWidget.currentIndex()
         next_index = (current_index + 1) % self.stackedWidget.count()
+        self.build_trial(next_index)
+        self.leave_page()
         self.stackedWidget.setCurrentIndex(next_index)
         current_index = self.stackedWidget.currentIndex()
+        self.prebuild_next_trial()
         # if current page is the final page
         # record the information of this experiment
         # elif current page is trial page, connect buttons
         if current_index == self.stackedWidget.count() - 1:
             self.recorder.completed()
             self.recorder.data_to_csv()
+            if self.setting.kiosk:
+                QTimer.singleShot(self.setting.kiosk_delay_ms,
+                                  self.next_participant)
         elif current_index >= self.pages_before_trials and current_index < len(
                 self.trials) + self.pages_before_trials:
+            self.trial_onset_ns = time.perf_counter_ns()
             self.connect_all_buttons()
 
+    def page_name(self, index):
+        """get the name of a page in the metrics
+
+        Args:
+            index: index of the page in the stacked widget
+        """
+        if index < self.pages_before_trials:
+            if index < len(PAGE_NAMES):
+                return PAGE_NAMES[index]
+            return "page" + str(index + 1)
+        if index < self.pages_before_trials + len(self.trials):
+            return "trial"
+        return "debrief"
+
+    def leave_page(self):
+        """count the time spent on the current page in the metrics, see
+        exp_metrics.py"""
+        left_ns = time.perf_counter_ns()
+        if metrics.enabled:
+            name = self.page_name(self.stackedWidget.currentIndex())
+            metrics.observe("exp_page_dwell_seconds",
+                            (left_ns - self.page_shown_ns) / 1e9,
+                            (("page", name),))
+            metrics.update()
+        self.page_shown_ns = left_ns
+
     def draw(self):
         """show an animation of drawing ball"""
 
         # find the chosen urn
-        current_page_widget = self.stackedWidget.currentWidget()
-        labels = current_page_widget.findChildren(QLabel)
-        urn_name = "image_" + self.button_clicked_name
-        for label in labels:
-            if label.objectName() == urn_name:
-                urn_chosen = label
+        urn_chosen = self.current_trial().label_index[self.button_clicked_name]
 
         # get the geometric information of the urn
         urn_geometry = urn_chosen.geometry()
@@ -189,10 +307,9 @@ class ExperimentWindow(QMainWindow):
         end_y = round(ball_y - height * 0.1)
 
         # instantiate a QLabel
-        ball_png_path = self.setting.ball_path + \
-                         self.ball_color +\
-                         self.setting.ball_file_extension
-        ball_png = QPixmap(ball_png_path)
+        # the ball image is decoded at startup, see exp_image.py
+        ball_png_path = image_cache.ball_path(self.setting, self.ball_color)
+        ball_png = image_cache.pixmap(ball_png_path, ball_width, ball_height)
         self.ball = QLabel(self.stackedWidget.currentWidget())
         self.ball.setGeometry(ball_x, ball_y, ball_width, ball_height)
         self.ball.setPixmap(ball_png)
@@ -201,17 +318,39 @@ class ExperimentWindow(QMainWindow):
 
         # instantiate a QPropertyAnimation
         self.anim = QPropertyAnimation(self.ball, b'geometry')
-        self.anim.setDuration(1000)
+        self.anim.setDuration(self.setting.anim_duration)
         self.anim.setStartValue(QRect(ball_x, ball_y, ball_width, ball_height))
         self.anim.setEndValue(QRect(end_x, end_y, ball_width, ball_height))
+        if self.latency:
+            self.latency.watch_animation(self.anim)
+        self.anim_start_ns = time.perf_counter_ns()
         self.anim.start()
-        self.disconnect_all_buttons()
+        if self.latency:
+            self.latency.click(self.press_ns, self.anim_start_ns)
         # switch to the next page after the anim finished
-        self.anim.finished.connect(self.switch_to_next_page)
+        self.anim.finished.connect(self.finish_animation)
+
+    def finish_animation(self):
+        """record the animation times, then switch to the next page"""
+        anim_end_ns = time.perf_counter_ns()
+        self.recorder.record_animation(self.anim_start_ns, anim_end_ns)
+        self.switch_to_next_page()
 
     def closeEvent(self, event):
         """record the data if and only if the participant exit the experiment
-        before completing it"""
-        if self.recorder.ppt_cmplt != 1:
+        before completing it
+
+        In kiosk mode nobody has started while the consent page is shown,
+        so nothing is recorded then, and the cell allocated for the next
+        participant is handed out again (see exp_schedule.py).
+        """
+        waiting = self.setting.kiosk and self.stackedWidget.currentIndex() == 0
+        if waiting:
+            self.recorder.finish_cell(self.recorder.ppt_cell, False)
+        else:
+            self.leave_page()
+        if self.recorder.ppt_cmplt != 1 and not waiting:
             self.recorder.data_to_csv()
+        if self.latency:
+            self.latency.write(self.setting.latency_path)
         super().closeEvent(event)
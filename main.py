@@ -2,19 +2,24 @@ from PyQt6.QtWidgets import QApplication
 from exp_window import ExperimentWindow
 from exp_recorder import Recorders
 from exp_setting import Settings
+from exp_image import image_cache
 
 # instantiate setting object, recorder object
 setting = Settings()
 recorder = Recorders(setting)
 
+# randomize the session of the participant from its seed and
 # choose conditions based on experiment design(see settings.between)
 # one condition per participant if between
 # all conditions for every participant if within
-setting.choose_condition(recorder)
+setting.start_session(recorder)
 
 # create a QApp
 app = QApplication([])
 
+# decode and scale the urn and ball images once
+image_cache.warm(setting)
+
 # get trials objects
 trials = setting.set_trials()
 
@@ -22,3 +27,4 @@ trials = setting.set_trials()
 window = ExperimentWindow(trials, setting, recorder)
 window.show()
 app.exec()
+recorder.close()